@@ -2,7 +2,10 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
+from scripts.cache import AtlasCache
+from scripts.dispatcher import AtlasDispatcher
 from scripts.message import AtlasMessage
+from scripts.pomice import AtlasPrefetcher
 
 
 class Miscellaneous(commands.Cog):
@@ -24,6 +27,22 @@ class Miscellaneous(commands.Cog):
         """Pings the bot."""
         await AtlasMessage(interaction).send(description=f'**Pong!** *{round(self.bot.latency*1000, 4)} ms*')
 
+    @app_commands.command(name="stats")
+    @app_commands.checks.cooldown(rate=1, per=2)
+    async def _stats(self, interaction: discord.Interaction):
+        """Shows the bot's cache, dispatcher and radio statistics."""
+        caches = (f"**{cache.name}**: {cache.hits} hit(s), {cache.misses} miss(es) ({cache.hit_rate:.1%}) | {len(cache)} entries" for cache in AtlasCache.caches)
+        dispatchers = (
+            f"**{dispatcher.name}**: {dispatcher.delivered} delivered, {dispatcher.failed} failed | {dispatcher.mean_latency:.1f}s mean, {dispatcher.max_latency:.1f}s max late"
+            for dispatcher in AtlasDispatcher.dispatchers
+        )
+        gaps = AtlasPrefetcher.gaps
+        radio = (
+            f"**radio**: {AtlasPrefetcher.hits} prefetched, {AtlasPrefetcher.misses} resolved on demand ({AtlasPrefetcher.hit_rate():.1%})"
+            f" | {sum(gaps) / len(gaps) * 1000 if gaps else 0:.0f}ms mean, {max(gaps, default=0) * 1000:.0f}ms max gap"
+        )
+        await AtlasMessage(interaction).send(title="Statistics", description="\n".join((*caches, *dispatchers, radio)))
+
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(Miscellaneous(bot))
@@ -1,10 +1,13 @@
 import discord
+import datetime
 import re
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from croniter import croniter
 from discord import app_commands
 from discord.ext import commands
 
 from scripts.message import AtlasMessage
-from scripts.database import ModuleDB
+from scripts.database import ModuleDB, QotdDB
 from scripts.permissions import ModuleDisabled
 from utils.enums import Module
 
@@ -24,7 +27,7 @@ class Modules(commands.Cog):
     @app_commands.checks.has_permissions(administrator=True)
     async def _fun(self, interaction: discord.Interaction):
         """Enable the fun module."""
-        ModuleDB(interaction.guild.id).enable(Module.FUN)
+        await ModuleDB(interaction.guild.id).enable(Module.FUN)
         await AtlasMessage(interaction).send(title=f"**Enabled Module Fun!**")
 
     @enable.command(name="blame")
@@ -33,7 +36,7 @@ class Modules(commands.Cog):
     @app_commands.checks.has_permissions(administrator=True)
     async def _blame(self, interaction: discord.Interaction):
         """Enable the blame module."""
-        ModuleDB(interaction.guild.id).enable(Module.BLAME)
+        await ModuleDB(interaction.guild.id).enable(Module.BLAME)
         await AtlasMessage(interaction).send(title=f"**Enabled Module Blame!**")
 
     @enable.command(name="radio")
@@ -43,22 +46,39 @@ class Modules(commands.Cog):
     @app_commands.checks.has_permissions(administrator=True)
     async def _radio(self, interaction: discord.Interaction, channel: discord.TextChannel):
         """Enable the radio module."""
-        ModuleDB(interaction.guild.id).enable(Module.RADIO, {"channel": channel.id})
+        await ModuleDB(interaction.guild.id).enable(Module.RADIO, {"channel": channel.id})
         await AtlasMessage(interaction).send(title=f"**Enabled Module Radio!**", description=f"Channel: {channel.mention}")
 
     @enable.command(name="qotd")
-    @app_commands.describe(channel="The channel to send QOTD messages", time="Time at which to send QOTD messages [HH:MM UTC 24h]")
+    @app_commands.describe(
+        channel="The channel to send QOTD messages",
+        time="When to send QOTD messages [HH:MM 24h or a cron expression]",
+        timezone="The timezone the time is in [e.g. Europe/London]"
+    )
     @app_commands.guild_only()
     @app_commands.checks.cooldown(rate=1, per=2)
     @app_commands.checks.has_permissions(administrator=True)
-    async def _qotd(self, interaction: discord.Interaction, channel: discord.TextChannel, time: str):
+    async def _qotd(self, interaction: discord.Interaction, channel: discord.TextChannel, time: str, timezone: str = "UTC"):
         """Enable the qotd module."""
-        if not re.search("^(2[0-4]|[0-1|]?[0-9]):([0-5]?[0-9])$", time):
-            await AtlasMessage(interaction).send_error(description=f"Invalid Time Format [HH:MM UTC 24h]: {time}")
+        if match := re.search("^(2[0-3]|[0-1]?[0-9]):([0-5]?[0-9])$", time):
+            time = f"{int(match.group(2))} {int(match.group(1))} * * *"
+        if not croniter.is_valid(time):
+            await AtlasMessage(interaction).send_error(description=f"Invalid Time Format [HH:MM 24h or a cron expression]: {time}")
+            return
+        try:
+            ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            await AtlasMessage(interaction).send_error(description=f"Unknown Timezone: {timezone}")
             return
 
-        ModuleDB(interaction.guild.id).enable(Module.QOTD, {"channel": channel.id, "time": time})
-        await AtlasMessage(interaction).send(title=f"**Enabled Module QOTD!**", description=f"**Channel:** {channel.mention}\n**Time:** {time} UTC")
+        config = {"channel": channel.id, "cron": time, "timezone": timezone}
+        await ModuleDB(interaction.guild.id).enable(Module.QOTD, config)
+        next_run = await QotdDB(interaction.guild.id).set_schedule(time, timezone)
+        self.bot.dispatch("module_update", interaction.guild.id, Module.QOTD, config)
+        await AtlasMessage(interaction).send(
+            title=f"**Enabled Module QOTD!**",
+            description=f"**Channel:** {channel.mention}\n**Schedule:** `{time}` {timezone}\n**Next QOTD:** {discord.utils.format_dt(next_run.replace(tzinfo=datetime.timezone.utc))}"
+        )
 
     @modules.command(name="disable")
     @app_commands.describe(module="The module to disable")
@@ -70,12 +90,15 @@ class Modules(commands.Cog):
         if not (module := Module.__dict__.get(module.upper())):
             raise ModuleDisabled
 
-        ModuleDB(interaction.guild.id).disable(module)
+        await ModuleDB(interaction.guild.id).disable(module)
+        if module == Module.QOTD:
+            await QotdDB(interaction.guild.id).clear_schedule()
+        self.bot.dispatch("module_update", interaction.guild.id, module, None)
         await AtlasMessage(interaction).send(f"Disabled Module {module.value}!")
 
     @_disable.autocomplete("module")
     async def _disable_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-        modules = ModuleDB(interaction.guild.id).fetch_enabled_name()
+        modules = await ModuleDB(interaction.guild.id).fetch_enabled_name()
         return [app_commands.Choice(name=choice, value=choice) for choice in modules if current.lower() in choice.lower()]
 
     @modules.command(name="list")
@@ -84,7 +107,7 @@ class Modules(commands.Cog):
     @app_commands.checks.has_permissions(administrator=True)
     async def _list(self, interaction: discord.Interaction):
         """List out all available modules on the server."""
-        modules = ModuleDB(interaction.guild.id).fetch_enabled_name()
+        modules = await ModuleDB(interaction.guild.id).fetch_enabled_name()
         await AtlasMessage(interaction).send_field(
             title="Modules List",
             description=f" • **Blame** - Blame your friends!\n • **QOTD** - Pings a role at a certain time of the day everyday to ask a question\n • **Fun** - Just a bunch of random commands lol.\n • **Radio** - Play Music!",
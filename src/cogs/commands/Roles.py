@@ -21,13 +21,17 @@ class Roles(commands.Cog):
 
     roles = app_commands.Group(name="roles", description="Manage Roles")
 
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        RoleDB.invalidate(role.guild.id)
+
     @roles.command(name="list")
     @app_commands.guild_only()
     @app_commands.checks.cooldown(rate=1, per=2)
     @app_commands.checks.has_permissions(administrator=True)
     async def _list(self, interaction: discord.Interaction):
         """Send a list of available roles"""
-        registered_roles = RoleDB(interaction.guild.id).list().items()
+        registered_roles = (await RoleDB(interaction.guild.id).list()).items()
         roles = ((f"**{type.lower()}**: <@&{id}>") for (type, id) in registered_roles)
 
         await AtlasMessage(interaction).send_field(
@@ -48,7 +52,7 @@ class Roles(commands.Cog):
             await AtlasMessage(interaction).send_error(description=f"**Unknown role!**")
             return
 
-        RoleDB(interaction.guild.id).insert(role.id, name.lower())
+        await RoleDB(interaction.guild.id).insert(role.id, name.lower())
         await AtlasMessage(interaction).send(description=f"Set **{name.lower()}** to role {role.mention}")
 
     @_add.autocomplete("name")
@@ -62,7 +66,7 @@ class Roles(commands.Cog):
     @app_commands.checks.has_permissions(administrator=True)
     async def _remove(self, interaction: discord.Interaction, name: str):
         """Unregister a role from the bot"""
-        if name.lower() in BOT_ROLES and (role := RoleDB(interaction.guild.id).remove(name.lower())):
+        if name.lower() in BOT_ROLES and (role := await RoleDB(interaction.guild.id).remove(name.lower())):
             await AtlasMessage(interaction).send(description=f"Removed role <@&{role}> from **{name.lower()}**")
         else:
             await AtlasMessage(interaction).send_error(description=f"**Unknown role!**")
@@ -2,8 +2,9 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
-from scripts.message import AtlasMessage
-from scripts.database import ModuleDB, BlameDB
+from scripts.message import AtlasMessage, AtlasPageSource, PAGE_SIZE
+from scripts.context import AtlasContext
+from scripts.database import BlameDB
 from scripts.permissions import ModuleDisabled
 from utils.enums import Module
 
@@ -15,7 +16,7 @@ class Blame(commands.Cog):
         self.bot = bot
 
     async def interaction_check(self, interaction: discord.Interaction):
-        if not ModuleDB(interaction.guild.id).is_enabled(Module.BLAME):
+        if not (await AtlasContext.get(interaction)).is_enabled(Module.BLAME):
             raise ModuleDisabled
         return True
 
@@ -25,13 +26,12 @@ class Blame(commands.Cog):
     @app_commands.checks.cooldown(rate=1, per=2)
     async def _blame(self, interaction: discord.Interaction, blamed: discord.Member, reason: str = None):
         """Add a blame to any user of choice!"""
-        blame = BlameDB(interaction.guild.id)
-        blame.push(blamed.id, interaction.user.id, reason)
+        count = await BlameDB(interaction.guild.id).push(blamed.id, interaction.user.id, reason)
 
         if reason:
             await AtlasMessage(interaction).send(description=f"{blamed.mention} has been blamed for **{reason}**")
         else:
-            await AtlasMessage(interaction).send(description=f"{blamed.mention} has been blamed **{blame.count(blamed.id)}** time(s)!")
+            await AtlasMessage(interaction).send(description=f"{blamed.mention} has been blamed **{count}** time(s)!")
 
     @app_commands.command(name="blamelist")
     @app_commands.describe(blamed="The user that's been blamed")
@@ -41,13 +41,19 @@ class Blame(commands.Cog):
         """List out all the blames for a user."""
         blamed = blamed if blamed else interaction.user
         blame = BlameDB(interaction.guild.id)
-        length, data = blame.list(blamed.id)
 
-        date_formatted = ((f"{i}) {blames['reason']}", f"by <@{blames['blamer']}>") for i, blames in enumerate(data, start=1))
+        async def query(skip: int, limit: int) -> tuple[int, list]:
+            _, reasons, blames = await blame.list(blamed.id, skip, limit)
+            return reasons, blames
+
+        blames = AtlasPageSource(query=query, format=lambda i, blame: (f"{i}) {blame['reason']}", f"by <@{blame['blamer']}>"))
+        count, reasons, data = await blame.list(blamed.id, limit=PAGE_SIZE)  # the first page comes with the total count
+        blames.prime(reasons, data)
+
         await AtlasMessage(interaction).send_page(
             title=f'{blamed.name} has been blamed for...',
-            description=f'\nTotal blames: **{blame.count(blamed.id)}**',
-            length=length, data=date_formatted
+            description=f'\nTotal blames: **{count}**',
+            source=blames
         )
 
     @app_commands.command(name="blamecount")
@@ -57,9 +63,8 @@ class Blame(commands.Cog):
     async def _blamecount(self, interaction: discord.Interaction, blamed: discord.Member = None):
         """Count the total number of blames on a user."""
         blamed = blamed if blamed else interaction.user
-        blame = BlameDB(interaction.guild.id)
-
-        await AtlasMessage(interaction).send(description=f'User {blamed.mention} has been blamed **{blame.count(blamed.id)}** time(s)!')
+        count = await BlameDB(interaction.guild.id).count(blamed.id)
+        await AtlasMessage(interaction).send(description=f'User {blamed.mention} has been blamed **{count}** time(s)!')
 
 
 async def setup(bot: commands.Bot):
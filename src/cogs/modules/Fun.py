@@ -6,7 +6,7 @@ from discord import app_commands
 from discord.ext import commands
 
 from scripts.message import AtlasMessage
-from scripts.database import ModuleDB
+from scripts.context import AtlasContext
 from scripts.permissions import ModuleDisabled
 from utils.enums import Module
 
@@ -24,7 +24,7 @@ class Fun(commands.Cog):
         self.bot = bot
 
     async def interaction_check(self, interaction: discord.Interaction):
-        if not ModuleDB(interaction.guild.id).is_enabled(Module.FUN):
+        if not (await AtlasContext.get(interaction)).is_enabled(Module.FUN):
             raise ModuleDisabled
         return True
 
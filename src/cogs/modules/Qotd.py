@@ -3,8 +3,9 @@ import datetime
 from discord import app_commands
 from discord.ext import commands
 
-from scripts.message import AtlasMessage, Colour
-from scripts.database import ModuleDB, QotdDB, RoleDB
+from scripts.message import AtlasMessage, AtlasPageSource, Colour
+from scripts.context import AtlasContext
+from scripts.database import QotdDB
 from scripts.permissions import ModuleDisabled, AtlasPermissions
 from utils.enums import Module, Roles
 
@@ -16,7 +17,7 @@ class QOTD(commands.Cog):
         self.bot = bot
 
     async def interaction_check(self, interaction: discord.Interaction):
-        if not ModuleDB(interaction.guild.id).is_enabled(Module.QOTD):
+        if not (await AtlasContext.get(interaction)).is_enabled(Module.QOTD):
             raise ModuleDisabled
         return True
 
@@ -29,7 +30,7 @@ class QOTD(commands.Cog):
     @app_commands.checks.cooldown(rate=1, per=2)
     async def _suggest(self, interaction: discord.Interaction, question: str):
         """Suggest a question!"""
-        QotdDB(interaction.guild.id).suggest(question, interaction.user.id)
+        await QotdDB(interaction.guild.id).suggest(question, interaction.user.id)
         await AtlasMessage(interaction).send_field(
             title="Question Added to the Queue",
             colour=Colour.QOTD,
@@ -42,14 +43,16 @@ class QOTD(commands.Cog):
     @app_commands.checks.cooldown(rate=1, per=2)
     async def _pending(self, interaction: discord.Interaction):
         """List out the questions in the pending queue."""
-        length, questions = QotdDB(interaction.guild.id).get_pending()
-        questions_formatted = ((f"{i}) {question['question']}", f"by <@{question['user']}>") for i, question in enumerate(questions, start=1))
+        questions = AtlasPageSource(
+            query=QotdDB(interaction.guild.id).get_pending,
+            format=lambda i, question: (f"{question['id']}) {question['question']}", f"by <@{question['user']}>")
+        )
 
         await AtlasMessage(interaction).send_page(
             title="QOTD Pending Queue",
-            description="Accept/Decline a question with +qotd accept/decline index",
+            description="Accept/Decline a question with /qotd accept/decline and the number shown next to it",
             colour=Colour.QOTD,
-            length=length, data=questions_formatted
+            source=questions
         )
 
     @qotd.command(name="queue")
@@ -57,24 +60,25 @@ class QOTD(commands.Cog):
     @app_commands.checks.cooldown(rate=1, per=2)
     async def _queue(self, interaction: discord.Interaction):
         """List out the questions in the accepted queue."""
-        length, questions = QotdDB(interaction.guild.id).get_accepted()
-        questions_formatted = ((f"{i}) {question['question']}", f"by <@{question['user']}>") for i, question in enumerate(questions, start=1))
+        questions = AtlasPageSource(
+            query=QotdDB(interaction.guild.id).get_accepted,
+            format=lambda i, question: (f"{i}) {question['question']}", f"by <@{question['user']}>")
+        )
 
         await AtlasMessage(interaction).send_page(
             title="QOTD Questions Queue",
             colour=Colour.QOTD,
-            length=length, data=questions_formatted
+            source=questions
         )
 
     @qotd.command(name="accept")
-    @app_commands.describe(index="The index of the question to accept")
+    @app_commands.describe(index="The number of the question in the pending queue")
     @app_commands.guild_only()
     @app_commands.checks.cooldown(rate=1, per=2)
     @AtlasPermissions.verify_level(Roles.MANAGER)
     async def _accept(self, interaction: discord.Interaction, index: int):
         """Accept a QOTD question."""
-        index = max(abs(index), 1) - 1
-        if not (data := QotdDB(interaction.guild.id).accept(index)):
+        if not (data := await QotdDB(interaction.guild.id).accept(abs(index))):
             await AtlasMessage(interaction).send_error(title="Invalid Index")
             return
 
@@ -86,14 +90,13 @@ class QOTD(commands.Cog):
         )
 
     @qotd.command(name="decline")
-    @app_commands.describe(index="The index of the question to decline")
+    @app_commands.describe(index="The number of the question in the pending queue")
     @app_commands.guild_only()
     @app_commands.checks.cooldown(rate=1, per=2)
     @AtlasPermissions.verify_level(Roles.MANAGER)
     async def _decline(self, interaction: discord.Interaction, index: int):
         """Decline a QOTD question."""
-        index = max(abs(index), 1) - 1
-        if not (data := QotdDB(interaction.guild.id).decline(index)):
+        if not (data := await QotdDB(interaction.guild.id).decline(abs(index))):
             await AtlasMessage(interaction).send_error(title="Invalid Index")
             return
 
@@ -110,15 +113,15 @@ class QOTD(commands.Cog):
     @AtlasPermissions.verify_level(Roles.MANAGER)
     async def _force(self, interaction: discord.Interaction):
         """Force a QOTD if one fails."""
-        channel = self.bot.get_channel(ModuleDB(interaction.guild.id).get_config(Module.QOTD, "channel"))
-        question = QotdDB(interaction.guild.id).fetch()
+        channel = self.bot.get_channel((context := await AtlasContext.get(interaction)).get_config(Module.QOTD, "channel"))
+        question = await QotdDB(interaction.guild.id).fetch()
 
         if channel is None or question is None:
             await AtlasMessage(interaction).send_error(title=f"An error has occured! Either the channel doesn't exist or the queue is empty.")
             return
 
         await AtlasMessage(interaction).send(title=f"A QOTD was sent to {channel.name}", colour=Colour.QOTD)
-        role = RoleDB(interaction.guild.id).get('qotd')
+        role = context.get_role('qotd')
         await channel.send(f'<@&{role}>', embed=discord.Embed(colour=Colour.QOTD.value)
             .set_author(name="Question Of The Day")
             .add_field(name=f"Q) {question['question']}", value=f"by <@{question['user']}>")
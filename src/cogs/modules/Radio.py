@@ -2,33 +2,39 @@ import asyncio
 import discord
 import os
 import pomice
+import time
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 
-from scripts.database import ModuleDB, RadioDB
-from scripts.message import AtlasMessage, AtlasPlayerControl, Colour
-from scripts.pomice import AtlasNodePool, AtlasPlayer
+from scripts.context import AtlasContext
+from scripts.database import RadioDB
+from scripts.message import AtlasMessage, AtlasPageSource, AtlasPlayerControl, Colour
+from scripts.pomice import AtlasNodePool, AtlasPlayer, AtlasPrefetcher
+from scripts.queue import AtlasQueue
 from scripts.permissions import ModuleDisabled, AtlasPermissions
 from utils.enums import Module, Roles
-from utils.functions import clamp
+from utils.functions import clamp, format_track_time
 
 
 class RadioCore(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
         self.pomice = AtlasNodePool()
-        bot.loop.create_task(self.connect_nodes())
+        for identifier, host, port in AtlasNodePool.config():
+            bot.loop.create_task(self.connect_node(identifier, host, port))
+        self.balance.start()
+        AtlasPlayerControl.register(bot)
 
-    async def connect_nodes(self):
+    async def connect_node(self, identifier: str, host: str, port: int):
         while True:
             try:
                 await asyncio.sleep(2)
                 await self.pomice.create_node(
                     bot=self.bot,
-                    host="lavalink",
-                    port=2333,
+                    host=host,
+                    port=port,
                     password=os.getenv("LAVALINK_PASSWORD"),
-                    identifier="MAIN",
+                    identifier=identifier,
                     spotify_client_id=os.getenv("SPOTIFY_CLIENT_ID"),
                     spotify_client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
                     apple_music=True,
@@ -36,55 +42,102 @@ class RadioCore(commands.Cog):
                 break
             except pomice.NodeConnectionFailure:  # keep reconnecting until lavalink is ready
                 continue
-        print(f'Pomice is ready!')
+        print(f'Pomice node {identifier} is ready!')
 
-    async def play_song(self, player: AtlasPlayer, playlist: list):
+    async def cog_unload(self):
+        self.balance.cancel()
+
+    @tasks.loop(seconds=30)
+    async def balance(self):
+        await self.pomice.balance()
+
+    @balance.before_loop
+    async def before_balance(self):
+        await self.bot.wait_until_ready()
+
+    async def play_song(self, player: AtlasPlayer, playlist: list, ended: float = None):
         if not player:  # idk it stops working if i remove this
             return
+        while playlist:
+            try:
+                await self.play_entry(player, playlist[0])
+                break
+            except (pomice.exceptions.TrackLoadError, pomice.exceptions.NodeRestException, IndexError, TypeError):
+                # nothing playable behind the entry, drop it rather than leave the radio stuck on it
+                await player.queue.remove(0)
+                player.prefetcher.discard(playlist[0])
+                await self.send_unplayable(player, playlist[0])
+                playlist = await player.queue.playlist(8)
         if not playlist:
             await player.destroy()
             return
-        self.bot.loop.create_task(AtlasPlayerControl(player, playlist).update_player_controls())
-        song = await player.get_tracks(query=playlist[0]["url"])
-        await player.play(track=song[0])
+        AtlasPlayerControl.refresh(player)
+        if ended is not None:
+            AtlasPrefetcher.gaps.append(time.monotonic() - ended)
+        player.prefetcher.invalidate()
+
+    @staticmethod
+    async def play_entry(player: AtlasPlayer, entry: dict) -> None:
+        try:
+            await player.play(track=await player.prefetcher.get(entry))
+        except pomice.exceptions.NodeRestException:  # lavalink rejected the stored encoding, resolve the url again
+            player.prefetcher.discard(entry)
+            await player.play(track=await player.resolve({**entry, "track": None}))
+
+    @staticmethod
+    async def send_unplayable(player: AtlasPlayer, entry: dict) -> None:
+        if player.text_channel is None:
+            return
+        try:
+            await player.text_channel.send(delete_after=30, embed=discord.Embed(
+                title="Skipped a song that couldn't be played",
+                description=f"{entry['author']} | {entry['title']}",
+                colour=Colour.ERROR.value
+            ))
+        except discord.HTTPException:
+            pass
 
     @commands.Cog.listener()
     async def on_error(self, interaction, error):
         if isinstance(error, (pomice.exceptions.SpotifyAlbumLoadFailed, pomice.exceptions.SpotifyPlaylistLoadFailed, pomice.exceptions.SpotifyTrackLoadFailed)):
             await AtlasMessage(interaction).send_error(description=f"Could not find the song or playlist")
 
+    @staticmethod
+    def queue(guild: discord.Guild) -> AtlasQueue | RadioDB:
+        """The connected player's in-memory queue, or the stored queue when the radio isn't active"""
+        if isinstance(player := guild.voice_client, AtlasPlayer):
+            return player.queue
+        return RadioDB(guild.id)
+
     @commands.Cog.listener()
     async def on_pomice_track_end(self, player, track, _):
-        RadioDB(player.guild.id).update()
-        playlist = RadioDB(player.guild.id).playlist(8)
-        await self.play_song(player, playlist)
+        ended = time.monotonic()
+        await player.queue.update()
+        playlist = await player.queue.playlist(8)
+        await self.play_song(player, playlist, ended)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        player = message.guild.voice_client if message.guild else None
+        if isinstance(player, AtlasPlayer) and player.message and message.channel == player.text_channel and message.id != player.message.id:
+            player.messages_below += 1
 
     @commands.Cog.listener("on_voice_state_update")
     async def afk_check(self, member, before, after):
-        player = self.pomice.get_node().get_player(member.guild.id)
-        if player and len(self.bot.get_channel(player.channel.id).members) == 1:
-            try:
-                await self.bot.wait_for("voice_state_update", timeout=15,
-                                        check=lambda member, before, after: member is not self.bot.user)  # 15 second grace before disconnect
-            except asyncio.TimeoutError:
-                await player.destroy()
+        player = member.guild.voice_client
+        if not isinstance(player, AtlasPlayer) or player.channel not in (before.channel, after.channel):
+            return  # nothing changed in a channel the radio is playing in
+        player.update_idle()
 
 
 class Radio(RadioCore):
     """Play Music!"""
 
     async def interaction_check(self, interaction: discord.Interaction):
-        if not ModuleDB(interaction.guild.id).is_enabled(Module.RADIO):
+        if not (await AtlasContext.get(interaction)).is_enabled(Module.RADIO):
             raise ModuleDisabled
         return True
 
-    @staticmethod
-    def format_track_time(length: int) -> str:
-        if length < 3600000:  # if less than 01:00:00 minutes
-            return f"{length//60000:02}:{(length//1000)%60:02}"
-        else:
-            return f"{length//3600000:02}:{(length//60000)%60:02}:{(length//1000)%60:02}"
-
     @staticmethod
     async def is_player_ready(interaction: discord.Interaction) -> bool:
         if not interaction.guild.voice_client:
@@ -124,7 +177,7 @@ class Radio(RadioCore):
             return
         player.text_channel = interaction.channel
 
-        if not (playlist := RadioDB(interaction.guild.id).playlist(8)):
+        if not (playlist := await player.queue.playlist(8)):
             await AtlasMessage(interaction).send_error(title="The current playlist is empty")
             return
 
@@ -163,21 +216,23 @@ class Radio(RadioCore):
         player.text_channel = interaction.channel
 
         if query:
+            await interaction.response.defer()  # loading a large playlist can take longer than the response window
             data = await player.get_tracks(query)
             if isinstance(data, list):
                 data = data[0]
-                position = RadioDB(interaction.guild.id).push([{
+                position = await player.queue.push([{
                     "url": data.uri,
                     "title": data.title,
                     "author": data.author,
                     "length": 0 if data.is_stream else data.length,
+                    "track": data.track_id if data.original else None,
                     "user": interaction.user.id
                 }])
 
                 match data.track_type.value:
                     case "youtube":
                         await AtlasMessage(interaction).send(
-                            description=f"**Added [{data.title}]({data.uri}) [{'∞' if data.is_stream else self.format_track_time(data.length)}] to the queue ({position})**",
+                            description=f"**Added [{data.title}]({data.uri}) [{'∞' if data.is_stream else format_track_time(data.length)}] to the queue ({position})**",
                             colour=Colour.YOUTUBE
                         )
                     case "soundcloud":
@@ -202,12 +257,15 @@ class Radio(RadioCore):
                         )
 
             elif isinstance(data, pomice.Playlist):
-                position = RadioDB(interaction.guild.id).push([{
+                position = await player.queue.push([{
                     "url": track.uri,
                     "title": track.title,
                     "author": track.author,
                     "length": 0 if track.is_stream else track.length,
+                    "track": track.track_id if track.original else None,
                     "user": interaction.user.id,
+                    # spotify/apple music tracks are matched to a playable track in the background or when they come up
+                    **({} if track.original else {"isrc": track.isrc or None}),
                 } for track in data.tracks])
 
                 match data.playlist_type.value:
@@ -236,15 +294,16 @@ class Radio(RadioCore):
                 await AtlasMessage(interaction).send_error(description=f"Could not find the song or playlist **{query}**")
                 return
 
-        elif not (playlist := RadioDB(interaction.guild.id).playlist(1)):
+        elif not (playlist := await player.queue.playlist(1)):
             await AtlasMessage(interaction).send_error(title="The current playlist is empty")
             return
         else:
             await AtlasMessage(interaction).send(title=f"Now Playing: {playlist[0]['author']} | {playlist[0]['title']}", colour=Colour.RADIO)
 
-        playlist = RadioDB(interaction.guild.id).playlist(8)
-        if player.message:
-            await AtlasPlayerControl(player, playlist).update_player_controls()
+        playlist = await player.queue.playlist(8)
+        if player.is_playing:  # the panel only shows up after a short delay, it can't tell whether the radio is already running
+            player.prefetcher.invalidate()
+            AtlasPlayerControl.refresh(player)
         else:
             await self.play_song(player, playlist)
 
@@ -260,13 +319,14 @@ class Radio(RadioCore):
         if not await self.is_user_connected(interaction):
             return
 
-        song = RadioDB(interaction.guild.id).remove(abs(position)-1)
+        song = await self.queue(interaction.guild).remove(abs(position)-1)
         if not song:
             await AtlasMessage(interaction).send_error(title="Invalid index")
             return
 
         if player:
-            await AtlasPlayerControl(player, RadioDB(interaction.guild.id).playlist(8)).update_player_controls()
+            player.prefetcher.invalidate()
+            AtlasPlayerControl.refresh(player)
         await AtlasMessage(interaction).send(title=f"Removed song {song['title']}", colour=Colour.RADIO)
 
     @app_commands.command(name="jump")
@@ -284,9 +344,10 @@ class Radio(RadioCore):
             return
 
         if position > 1:
-            RadioDB(interaction.guild.id).jump(abs(position) - 2)
+            await player.queue.jump(abs(position) - 2)
+            player.prefetcher.invalidate()
             await player.stop()
-        song = RadioDB(interaction.guild.id).playlist(1)[0]
+        song = (await self.queue(interaction.guild).playlist(1))[0]
         await AtlasMessage(interaction).send(title=f"Now Playing: {song['author']} | {song['title']}", colour=Colour.RADIO)
 
     @app_commands.command(name="move")
@@ -304,9 +365,10 @@ class Radio(RadioCore):
         if index1 in {0, 1} or index2 in {0, 1}:
             await AtlasMessage(interaction).send_error(title=f"Cannot move currently playing track")
 
-        RadioDB(interaction.guild.id).swap(index1 - 1, index2 - 1)
+        await self.queue(interaction.guild).swap(index1 - 1, index2 - 1)
         if player:
-            await AtlasPlayerControl(player, RadioDB(interaction.guild.id).playlist(8)).update_player_controls()
+            player.prefetcher.invalidate()
+            AtlasPlayerControl.refresh(player)
         await AtlasMessage(interaction).send(title=f"Moved song ({index1} -> {index2})", colour=Colour.RADIO)
 
     @app_commands.command(name="clear")
@@ -317,7 +379,7 @@ class Radio(RadioCore):
     async def _clear(self, interaction: discord.Interaction):
         """Clears the current playlist."""
         player = interaction.guild.voice_client
-        RadioDB(interaction.guild.id).clear()
+        await self.queue(interaction.guild).clear()
 
         if player:
             await player.stop()
@@ -354,15 +416,15 @@ class Radio(RadioCore):
         # probably a better way to do this whole command
         match type.lower():
             case "playlist":
-                RadioDB(interaction.guild.id).set_loop("playlist_repeat")
+                await RadioDB(interaction.guild.id).set_loop("playlist_repeat")
             case "track":
-                RadioDB(interaction.guild.id).set_loop("track_repeat")
+                await RadioDB(interaction.guild.id).set_loop("track_repeat")
             case "disable":
-                RadioDB(interaction.guild.id).set_loop("no_repeat")
+                await RadioDB(interaction.guild.id).set_loop("no_repeat")
             case _:
-                RadioDB(interaction.guild.id).cycle_loop()
+                await RadioDB(interaction.guild.id).cycle_loop()
 
-        match RadioDB(interaction.guild.id).get_loop():
+        match await RadioDB(interaction.guild.id).get_loop():
             case "playlist_repeat":
                 await AtlasMessage(interaction).send(title="Now Looping Playlist", colour=Colour.RADIO)
             case "track_repeat":
@@ -387,8 +449,9 @@ class Radio(RadioCore):
         if not await self.is_user_connected(interaction):
             return
 
-        RadioDB(interaction.guild.id).shuffle()
+        await self.queue(interaction.guild).shuffle()
         if player:
+            player.prefetcher.invalidate()
             await player.stop()
         await AtlasMessage(interaction).send(title="Playlist Shuffled!", colour=Colour.RADIO)
 
@@ -398,21 +461,19 @@ class Radio(RadioCore):
     @AtlasPermissions.verify_channel(Module.RADIO)
     async def _queue(self, interaction: discord.Interaction):
         """Show the current playlist queue."""
-        length, playlist = RadioDB(interaction.guild.id).playlist()
-        playlist_length = RadioDB(interaction.guild.id).playlist_length()
-
-        def playlist_formatted():
-            for i, track in enumerate(playlist, start=1):
-                yield (
-                    f"{i}) {track['author']} | {track['title']} [{self.format_track_time(track['length']) if track['length'] else '∞'}]\n{track['url']}",
-                    f"by <@{track['user']}>"
-                )
+        queue = self.queue(interaction.guild)
+        stats = await queue.stats()
+
+        playlist = AtlasPageSource(query=queue.page, format=lambda i, track: (
+            f"{i}) {track['author']} | {track['title']} [{format_track_time(track['length']) if track['length'] else '∞'}]\n{track['url']}",
+            f"by <@{track['user']}>"
+        ))
 
         await AtlasMessage(interaction).send_page(
             title=f"Radio Queue for {interaction.guild.name}",
-            description=f"**Queue Length: {self.format_track_time(playlist_length)}**",
+            description=f"**Queue Length: {format_track_time(stats['length'])}** | {stats['count']} track(s)" + (f", {stats['streams']} stream(s)" if stats['streams'] else ""),
             colour=Colour.RADIO,
-            length=length, data=playlist_formatted()
+            source=playlist
         )
 
     @app_commands.command(name="volume")
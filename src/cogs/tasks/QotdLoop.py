@@ -1,38 +1,78 @@
-import discord, datetime, asyncio
-from discord.ext import commands, tasks
+import discord, datetime, asyncio, functools, logging, os
+from discord.ext import commands
 
 from scripts.message import Colour
 from scripts.database import ModuleDB, QotdDB, RoleDB
+from scripts.dispatcher import AtlasDispatcher
 from utils.enums import Module
 
+logger = logging.getLogger(__name__)
+
 class QOTDLoop(commands.Cog):
     """Internal QOTD loop."""
+    # other instances may schedule an earlier QOTD without this one hearing about it
+    poll_interval = float(os.getenv("QOTD_POLL_INTERVAL", 60))
+    retry_interval = 10  # a schedule that failed is still due, don't spin on it
+    dispatcher = AtlasDispatcher("qotd", concurrency = int(os.getenv("QOTD_CONCURRENCY", 10)))
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.qotd.start()
+        self.changed = asyncio.Event()
+
+    async def cog_load(self):
+        self.scheduler = asyncio.create_task(self.run())
+
+    async def cog_unload(self):
+        self.scheduler.cancel()
 
-    @tasks.loop(minutes = 1) # Not the most ideal solution but it works
-    async def qotd(self):
-        current_time = datetime.datetime.utcnow().strftime("%H:%M")
-        for data in ModuleDB(None).get_guilds_enabled(Module.QOTD):
-            if current_time == data["config"]["time"]:
-                await self.execute(data)
+    @commands.Cog.listener()
+    async def on_module_update(self, guild: int, module: Module, config: dict | None):
+        if module == Module.QOTD:
+            self.changed.set()
 
-    @qotd.before_loop
-    async def wait(self):
+    async def run(self):
         await self.bot.wait_until_ready()
-        await asyncio.sleep(75 - datetime.datetime.now().second) # Start the loop at XX:XX:15
-
-    async def execute(self, data: dict):
-        if (channel := self.bot.get_channel(data["config"]["channel"])) is None:
-            return
-        if (question := QotdDB(data["guild"]).fetch()) is None:
-            return
-        role = RoleDB(data["guild"]).get('qotd')
-        await channel.send(role, embed = discord.Embed(colour = Colour.QOTD.value)
-                                         .set_author(name = "Question Of The Day")
-                                         .add_field(name = f"Q) {question['question']}", value = f"by <@{question['user']}>")
-                                         .set_footer(text = f"{datetime.datetime.utcnow().strftime('%d/%m/%Y | %H:%M')}"))
+        while True:
+            self.changed.clear()
+            delay = QOTDLoop.poll_interval
+            failed = False
+            try:
+                now = datetime.datetime.utcnow()
+                for schedule in await QotdDB.due(now):
+                    try:
+                        # fires late or missed are sent once, the next one is always in the future
+                        next_run = QotdDB.next_run(schedule["cron"], schedule["timezone"], max(schedule["next_run"], now))
+                        if await QotdDB(schedule["guild"]).claim(schedule["next_run"], next_run):
+                            QOTDLoop.dispatcher.dispatch(schedule["guild"], schedule["next_run"], functools.partial(self.prepare, schedule["guild"]))
+                    except Exception:
+                        failed = True
+                        logger.exception(f"failed to schedule the qotd of {schedule['guild']}")
+
+                if (upcoming := await QotdDB.upcoming()) is not None:
+                    delay = min(delay, (upcoming - datetime.datetime.utcnow()).total_seconds())
+            except Exception:
+                failed, delay = True, QOTDLoop.retry_interval
+                logger.exception("failed to look up the due qotds")
+
+            if failed:
+                delay = max(delay, QOTDLoop.retry_interval)
+            try:
+                await asyncio.wait_for(self.changed.wait(), max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def prepare(self, guild: int):
+        """Pops the guild's next question, returns the send for the dispatcher to deliver"""
+        if (channel := self.bot.get_channel(await ModuleDB(guild).get_config(Module.QOTD, "channel"))) is None:
+            return None
+        if (question := await QotdDB(guild).fetch()) is None:
+            return None
+        role = await RoleDB(guild).get('qotd')
+        embed = (discord.Embed(colour = Colour.QOTD.value)
+                 .set_author(name = "Question Of The Day")
+                 .add_field(name = f"Q) {question['question']}", value = f"by <@{question['user']}>")
+                 .set_footer(text = f"{datetime.datetime.utcnow().strftime('%d/%m/%Y | %H:%M')}"))
+        return functools.partial(channel.send, role, embed = embed)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(QOTDLoop(bot))
@@ -3,6 +3,12 @@ import os
 import discord
 from discord.ext import commands
 
+from scripts.cache import AtlasCache
+from scripts import schema
+from scripts.database import ModuleDB, RoleDB
+from scripts.pomice import AtlasPlayer
+from scripts.storage import AtlasStorage
+
 os.makedirs("logs", exist_ok=True)
 handler = logging.FileHandler(filename='./logs/bot.log', encoding='utf-8', mode='w')
 handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s]: %(name)s  %(message)s'))
@@ -13,6 +19,10 @@ logger.addHandler(handler)
 
 class AtlasBot(commands.Bot):
     async def setup_hook(self) -> None:
+        await schema.bootstrap()
+        self.loop.create_task(AtlasStorage.get().watch("modules", ModuleDB.cache))
+        self.loop.create_task(AtlasStorage.get().watch("roles", RoleDB.cache, RoleDB.levels))
+
         for filename in os.listdir("./cogs/commands"):
             if filename.endswith('.py'):
                 await bot.load_extension(f"cogs.commands.{filename[:-3]}")
@@ -31,6 +41,18 @@ class AtlasBot(commands.Bot):
 
         await bot.tree.sync()
 
+    async def close(self) -> None:
+        # connected radio queues still hold the changes of their last few seconds
+        for player in self.voice_clients:
+            if isinstance(player, AtlasPlayer):
+                try:
+                    await player.queue.flush()
+                except Exception:
+                    logger.exception(f"failed to write back the radio queue of {player.guild.id}")
+        await super().close()
+        await AtlasStorage.close()
+        AtlasCache.save_all()
+
 
 intents = discord.Intents.default()
 intents.members = True
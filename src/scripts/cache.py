@@ -0,0 +1,81 @@
+import pickle
+import time
+from collections import OrderedDict
+
+
+class AtlasCache:
+    """In-memory key/value cache that keeps hit/miss counters, entries optionally expire after `ttl` seconds, are evicted least recently used first past `maxsize` and persist to `path`"""
+    caches: list["AtlasCache"] = []  # every cache created, used to report metrics
+
+    def __init__(self, name: str, ttl: float | None = None, maxsize: int | None = None, path: str | None = None) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        AtlasCache.caches.append(self)
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        if (entry := self._data.get(key)) is not None:
+            value, expires = entry
+            if expires is None or expires > time.monotonic():
+                self.hits += 1
+                if self.maxsize:
+                    self._data.move_to_end(key)
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        ttl = ttl or self.ttl
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        if self.maxsize:
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def load(self) -> None:
+        # expiry times are stored as wall clock time, the monotonic clock doesn't survive a restart
+        try:
+            with open(self.path, "rb") as file:
+                entries = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return
+        offset = time.monotonic() - time.time()
+        for key, value, expires in entries:
+            if expires is None or expires + offset > time.monotonic():
+                self._data[key] = (value, expires + offset if expires is not None else None)
+
+    def save(self) -> None:
+        offset = time.time() - time.monotonic()
+        entries = [(key, value, expires + offset if expires is not None else None) for key, (value, expires) in self._data.items()]
+        try:
+            with open(self.path, "wb") as file:
+                pickle.dump(entries, file)
+        except (OSError, pickle.PicklingError, AttributeError, TypeError):
+            pass
+
+    @staticmethod
+    def save_all() -> None:
+        """Writes every cache created with a `path` to disk"""
+        for cache in AtlasCache.caches:
+            if cache.path:
+                cache.save()
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / total if (total := self.hits + self.misses) else 0.0
@@ -0,0 +1,44 @@
+import discord
+
+from scripts.database import ModuleDB, RoleDB
+from scripts.storage import AtlasStorage
+from utils.enums import Module
+
+
+class AtlasContext:
+    """The invoking guild's module and role settings, loaded once per interaction and shared by every check and the command itself"""
+
+    def __init__(self, guild: int, modules: dict, roles: dict) -> None:
+        self.guild = guild
+        self.modules = modules  # module name -> config
+        self.roles = roles  # role name -> role id
+
+    @staticmethod
+    async def get(interaction: discord.Interaction) -> "AtlasContext":
+        if (context := interaction.extras.get("context")) is None:
+            context = interaction.extras["context"] = await AtlasContext.load(interaction.guild.id)
+        return context
+
+    @staticmethod
+    async def load(guild: int) -> "AtlasContext":
+        """Reads both settings from the caches, whatever is missing is fetched together"""
+        modules, roles = ModuleDB.cache.get(guild), RoleDB.cache.get(guild)
+        if modules is None or roles is None:
+            stored_modules, stored_roles = await AtlasStorage.get().get_settings(guild)
+            if modules is None:
+                ModuleDB.cache.set(guild, modules := stored_modules)
+            if roles is None:
+                RoleDB.store(guild, roles := stored_roles)
+        return AtlasContext(guild, modules, roles)
+
+    def is_enabled(self, module: Module) -> bool:
+        return module.value in self.modules
+
+    def get_config(self, module: Module, data: str):
+        return self.modules.get(module.value, {}).get(data)
+
+    def get_role(self, role: str) -> int:
+        return self.roles.get(role, 0)
+
+    def permission_level(self, member: discord.Member) -> int:
+        return RoleDB.level(self.guild, self.roles, member)
@@ -1,244 +1,279 @@
-import random
-import pymongo
-
+import copy
+import datetime
+import os
+from bson import ObjectId
+from zoneinfo import ZoneInfo
+from croniter import croniter
+
+from scripts.cache import AtlasCache
+from scripts.storage import AtlasStorage
 from utils.enums import Roles, Module
 
 
-class MongoDB:
-    """Base class to establish a connection with the Mongo Database and a few helper functions"""
-    def __init__(self, guild: int, collection: str, schema: dict = {}) -> None:
-        self.client = pymongo.MongoClient("mongodb://mongo:27017/")
-        self.data = self.client["discordbot"][collection]
-        self.guild = guild
-        self._new_guild(schema)
-
-    def _new_guild(self, schema: dict) -> None:
-        schema.update({"_id": self.guild})
-        try:
-            self.data.insert_one(schema)
-        except pymongo.errors.DuplicateKeyError:
-            pass
-
-    def _exists(self, object: str) -> bool:
-        return bool(self.data.find_one({"_id": self.guild, object: {"$exists": True}}))
-
-    def _get_object(self, key: str, filter: dict = {}) -> None:
-        return self.data.find_one({"_id": self.guild}, filter).get(key)
-
-    def _set_object(self, document: dict = {}, filter: dict = {}):
-        filter.update({"_id": self.guild})
-        self.data.update_one(filter, {"$set": document})
-
-    def _get_array_element_by_index(self, array: str, index: int):
-        return next(self.data.aggregate([
-            {"$match": {"_id": self.guild}},
-            {"$project": {"object": {"$arrayElemAt": [f"${array}", index]}}}
-        ])).get("object")
-
-    def _remove_array_element_by_index(self, array: str, index: int):
-        index = abs(index)
-        if (val := self._get_array_element_by_index(array, index)):
-            # https://jira.mongodb.org/browse/SERVER-1014 :D
-            self.data.update_one({"_id": self.guild}, [
-                {"$set": {f"{array}": {"$concatArrays": [{"$slice": [f"${array}", index]}, {"$slice": [f"${array}", index+1, {"$size": f"${array}"}]}]}}}
-            ])
-        return val
-
-    def _get_array_length(self, array: str) -> int:
-        if not self._exists(array):
-            return 0
-        return next(self.data.aggregate([
-            {"$match": {"_id": self.guild}},
-            {"$project": {"length": {"$size": f"${array}"}}}
-        ])).get("length")
-
-    def _push(self, data: dict) -> None:
-        self.data.update_one({"_id": self.guild}, {"$push": data})
-
-
-class ModuleDB(MongoDB):
+class AtlasDB:
+    """Base class of the per guild DB classes, every query goes through the storage backend picked with STORAGE_BACKEND"""
+
     def __init__(self, guild: int) -> None:
-        super().__init__(guild, collection="modules", schema={"modules": []})
+        self.guild = guild
+        self.storage = AtlasStorage.get()
 
-    def enable(self, module: Module, config: dict={}) -> None:
-        if not self.data.find_one({"_id": self.guild, "modules.name": module.value}):
-            self._push({"modules": {"name": module.value, "config": config}})
-        else:
-            self._set_object({"modules.$.config": config}, {"modules.name": module.value})
 
-    def disable(self, module: Module) -> None:
-        self.data.update_one({"_id": self.guild}, {"$pull": {"modules": {"name": module.value}}})
+class ModuleDB(AtlasDB):
+    # guild -> {module name: config}, kept write-through by enable/disable and invalidated by AtlasStorage.watch
+    cache = AtlasCache("modules", ttl=float(os.getenv("CACHE_TTL", 60)))
 
-    def is_enabled(self, module: Module) -> bool:
-        if not self.data.find_one({"_id": self.guild, "modules.name": module.value}):
-            return False
-        return True
+    async def _modules(self) -> dict:
+        if (modules := ModuleDB.cache.get(self.guild)) is None:
+            modules = await self.storage.get_modules(self.guild)
+            ModuleDB.cache.set(self.guild, modules)
+        return modules
 
-    def get_config(self, module: Module, data: str) -> dict | None:
-        return next(self.data.aggregate([
-            {"$unwind": "$modules"},
-            {"$match": {"_id": self.guild, "modules.name": module.value}},
-            {"$project": {"_id": False, "config": "$modules.config"}}
-        ])).get("config").get(data)
+    async def enable(self, module: Module, config: dict={}) -> None:
+        await self.storage.set_module(self.guild, module.value, config)
+        (await self._modules())[module.value] = config
 
-    def fetch_enabled_name(self) -> list:
-        return [module["name"] for module in self._get_object("modules")]
+    async def disable(self, module: Module) -> None:
+        await self.storage.unset_module(self.guild, module.value)
+        (await self._modules()).pop(module.value, None)
 
-    def get_guilds_enabled(self, module: Module) -> list:
-        return self.data.aggregate([
-            {"$unwind": "$modules"},
-            {"$match": {"modules.name": module.value}},
-            {"$project": {"_id": False, "guild": "$_id", "config": "$modules.config"}}
-        ])
+    async def is_enabled(self, module: Module) -> bool:
+        return module.value in await self._modules()
 
+    async def get_config(self, module: Module, data: str) -> dict | None:
+        return (await self._modules()).get(module.value, {}).get(data)
 
-class BlameDB(MongoDB):
-    def __init__(self, guild: int) -> None:
-        super().__init__(guild, collection="blame")
+    async def fetch_enabled_name(self) -> list:
+        return list(await self._modules())
 
-    def push(self, user: int, blamer: int, reason: str) -> None:
-        self._push({f"n{user}": {"blamer": blamer, "reason": reason}})
+    @staticmethod
+    async def get_guilds_enabled(module: Module) -> list[dict]:
+        return await AtlasStorage.get().guilds_with_module(module.value)
 
-    def list(self, user: int) -> tuple[int, list]:
-        if not self.data.find_one({"_id": self.guild}):
-            return 
-        blames = next(self.data.aggregate([
-            {"$match": {"_id": self.guild}},
-            {"$project": {"blames": {"$filter": {"input": f"$n{user}", "as": "buffer", "cond": {"$ne": ["$$buffer.reason", None]}}}}}
-        ])).get("blames")
-        length = next(self.data.aggregate([
-            {"$match": {"_id": self.guild}},
-            {"$project": {"length": {"$size": {"$filter": {"input": f"$n{user}", "as": "buffer", "cond": {"$ne": ["$$buffer.reason", None]}}}}}}
-        ])).get("length")
-        return length, blames
 
-    def count(self, user: int) -> int:
-        return self._get_array_length(f"n{user}")
+class BlameDB(AtlasDB):
+    """Every blame is kept on its own, with a running total per user"""
 
+    async def push(self, user: int, blamer: int, reason: str) -> int:
+        return await self.storage.push_blame(self.guild, user, blamer, reason)
 
-class QotdDB(MongoDB):
-    def __init__(self, guild: int) -> None:
-        super().__init__(guild, collection="qotd", schema={"pending": [], "accepted": []})
+    async def list(self, user: int, skip: int = 0, limit: int = 0) -> tuple[int, int, list]:
+        """Returns the total number of blames on the user, how many of them have a reason and a window of those"""
+        return await self.storage.list_blames(self.guild, user, skip, limit)
 
-    def suggest(self, question: str, user: int) -> None:
-        self._push({"pending": {"$each": [{"question": f"{question}", "user": user}]}})
+    async def count(self, user: int) -> int:
+        return (await self.storage.count_blames(self.guild, user))[0]
 
-    def decline(self, index: int) -> str | None:
-        return self._remove_array_element_by_index("pending", index)
 
-    def accept(self, index: int) -> str | None:
-        if question := self._remove_array_element_by_index("pending", index):
-            self._push({"accepted": question})
-        return question
+class QotdDB(AtlasDB):
+    """Questions are kept individually, the guild's schedule and question counter on their own"""
 
-    def fetch(self) -> str | None:
-        if question := self._remove_array_element_by_index("accepted", 0):
-            return question
+    async def suggest(self, question: str, user: int) -> int:
+        return await self.storage.push_question(self.guild, f"{question}", user)
 
-    def get_pending(self) -> tuple[int, list]:
-        return self._get_array_length("pending"), self._get_object("pending")
+    async def decline(self, id: int) -> dict | None:
+        return await self.storage.delete_question(self.guild, "pending", id)
 
-    def get_accepted(self) -> tuple[int, list]:
-        return self._get_array_length("accepted"), self._get_object("accepted")
+    async def accept(self, id: int) -> dict | None:
+        return await self.storage.accept_question(self.guild, id)
 
+    async def fetch(self) -> dict | None:
+        return await self.storage.pop_question(self.guild)
 
-class RadioDB(MongoDB):
-    def __init__(self, guild: int) -> None:
-        super().__init__(guild, collection="radio", schema={"loop": "playlist_repeat", "playlist": []})
+    @staticmethod
+    def next_run(cron: str, timezone: str, after: datetime.datetime | None = None) -> datetime.datetime:
+        """The first time the cron expression fires in the timezone strictly after `after` (naive UTC, like every stored time)"""
+        after = (after or datetime.datetime.utcnow()).replace(tzinfo=datetime.timezone.utc).astimezone(ZoneInfo(timezone))
+        return croniter(cron, after).get_next(datetime.datetime).astimezone(datetime.timezone.utc).replace(tzinfo=None)
 
-    def playlist(self, limit: int = None) -> tuple[int, list] | list:
-        if limit:
-            return self._get_object("playlist", filter={"playlist": {"$slice": limit}})
-        return self._get_array_length("playlist"), self._get_object("playlist")
-
-    def playlist_length(self) -> int:
-        return next(self.data.aggregate([
-            {"$match": {"_id": self.guild}},
-            {"$project": {"length": {"$sum": "$playlist.length"}}}
-        ])).get("length")
-
-    def push(self, tracks: list[dict]) -> int:
-        self._push({"playlist": {"$each": tracks}})
-        return self.position()
-
-    def position(self) -> int:
-        return next(self.data.aggregate([
-            {"$match": {"_id": self.guild}},
-            {"$project": {"position": {"$size": "$playlist"}}}
-        ])).get("position")
-
-    def remove(self, index: int) -> dict | None:
-        return self._remove_array_element_by_index("playlist", index)
-
-    def update(self) -> None:
-        if not (track := self._get_array_element_by_index("playlist", 0)):
-            return
+    @staticmethod
+    async def due(now: datetime.datetime) -> list[dict]:
+        """Every guild whose next QOTD is due by `now`"""
+        return await AtlasStorage.get().due_schedules(now)
+
+    @staticmethod
+    async def upcoming() -> datetime.datetime | None:
+        """When the earliest scheduled QOTD across all guilds is due"""
+        return await AtlasStorage.get().upcoming_schedule()
+
+    async def set_schedule(self, cron: str, timezone: str) -> datetime.datetime:
+        next_run = QotdDB.next_run(cron, timezone)
+        await self.storage.set_schedule(self.guild, cron, timezone, next_run)
+        return next_run
+
+    async def clear_schedule(self) -> None:
+        await self.storage.clear_schedule(self.guild)
+
+    async def claim(self, run: datetime.datetime, next_run: datetime.datetime) -> bool:
+        """Advances the schedule past `run` if nobody else has, only the instance that gets True should send the QOTD"""
+        return await self.storage.claim_schedule(self.guild, run, next_run)
+
+    async def get_pending(self, skip: int = 0, limit: int = 0) -> tuple[int, list]:
+        return await self.storage.get_questions(self.guild, "pending", skip, limit)
+
+    async def get_accepted(self, skip: int = 0, limit: int = 0) -> tuple[int, list]:
+        return await self.storage.get_questions(self.guild, "accepted", skip, limit)
 
-        match self.get_loop():
+
+class RadioDB(AtlasDB):
+    """Each queued track is stored on its own, ordered per guild by a gap-based position key"""
+    # guild -> {"loop": loop type, "tail": last reserved position, "stats": queue stats}, a guild's radio is only ever driven by one process
+    settings = AtlasCache("radio")
+
+    async def _track_at(self, index: int) -> dict | None:
+        return next(iter(await self.storage.get_tracks(self.guild, skip=index, limit=1)), None)
+
+    async def _settings(self) -> dict:
+        if (settings := RadioDB.settings.get(self.guild)) is None:
+            # nothing may have been written for the guild yet
+            stored = await self.storage.get_radio(self.guild) or {}
+            settings = {
+                "loop": stored.get("loop") or "playlist_repeat", "tail": stored.get("tail") or 0,
+                "stats": stored.get("stats") or AtlasStorage.tally_stats([])
+            }
+            RadioDB.settings.set(self.guild, settings)
+        return settings
+
+    async def _account(self, tracks: list[dict], sign: int = 1) -> None:
+        """Keeps the stored queue stats in step with tracks being added or removed"""
+        change = AtlasStorage.tally_stats(tracks, sign)
+        await self.storage.add_radio_stats(self.guild, change)
+        AtlasStorage.apply_stats((await self._settings())["stats"], change)
+
+    async def _set_stats(self, stats: dict) -> None:
+        await self.storage.set_radio_stats(self.guild, stats)
+        (await self._settings())["stats"] = copy.deepcopy(stats)
+
+    async def _reserve(self, count: int) -> float:
+        """Reserves `count` positions after the end of the queue and returns the position before the first one"""
+        settings = await self._settings()
+        tail, settings["tail"] = settings["tail"], settings["tail"] + count
+        return tail
+
+    async def playlist(self, limit: int = None) -> tuple[int, list] | list:
+        if limit:
+            return await self.storage.get_tracks(self.guild, limit=limit)
+        return await self.position(), await self.storage.get_tracks(self.guild)
+
+    async def page(self, skip: int, limit: int) -> tuple[int, list]:
+        return await self.position(), await self.storage.get_tracks(self.guild, skip, limit)
+
+    async def stats(self) -> dict:
+        """Total length, number of tracks, number of streams and tracks queued per user"""
+        return copy.deepcopy((await self._settings())["stats"])
+
+    async def playlist_length(self) -> int:
+        return (await self._settings())["stats"]["length"]
+
+    async def push(self, tracks: list[dict]) -> int:
+        if not tracks:
+            return await self.position()
+        tail = await self._reserve(len(tracks))
+        await self.storage.write_tracks(self.guild, inserted=[{**track, "_id": ObjectId(), "position": tail + i} for i, track in enumerate(tracks, start=1)])
+        await self._account(tracks)
+        return await self.position()
+
+    async def write(self, inserted: list[dict] = [], updated: list[dict] = [], deleted: list = []) -> None:
+        """Applies a batch of track changes, updated tracks only have their position and encoded track written"""
+        await self.storage.write_tracks(self.guild, inserted, updated, deleted)
+
+    async def position(self) -> int:
+        return (await self._settings())["stats"]["count"]
+
+    async def remove(self, index: int) -> dict | None:
+        if (track := await self._track_at(abs(index))):
+            await self.storage.write_tracks(self.guild, deleted=[track["_id"]])
+            await self._account([track], -1)
+        return track
+
+    async def update(self) -> dict | None:
+        """Advances the queue past the current track according to the loop type, returns the track that finished"""
+        match (await self._settings())["loop"]:
             case "playlist_repeat":
-                self._remove_array_element_by_index("playlist", 0)
-                self.push([track])
+                return await self.storage.rotate_track(self.guild, await self._reserve(1) + 1)
             case "track_repeat":
                 pass
             case "no_repeat":
-                self._remove_array_element_by_index("playlist", 0)
+                if track := await self.storage.pop_track(self.guild):
+                    await self._account([track], -1)
+                return track
 
-    def clear(self) -> None:
-        self._set_object({"playlist": []})
+    async def clear(self) -> None:
+        await self.storage.clear_tracks(self.guild)
+        await self._set_stats(AtlasStorage.tally_stats([]))
 
-    def jump(self, index: int) -> None:
-        self.data.update_one({"_id": self.guild}, [
-            {"$set": {"playlist": {"$concatArrays": [{"$slice": ["$playlist", index, {"$size": "$playlist"}]}, {"$slice": ["$playlist", index]}]}}}
-        ])
+    async def jump(self, index: int) -> None:
+        if index <= 0:
+            return
+        await self.storage.jump_tracks(self.guild, index, await self._reserve(index))
 
-    def swap(self, first: int, second: int) -> None:
-        track1 = self._get_array_element_by_index("playlist", first)
-        track2 = self._get_array_element_by_index("playlist", second)
-        self._set_object({f"playlist.{first}": track2})
-        self._set_object({f"playlist.{second}": track1})
+    async def swap(self, first: int, second: int) -> None:
+        await self.storage.swap_tracks(self.guild, first, second)
 
-    def get_loop(self) -> bool:
-        return self._get_object("loop")
+    async def get_loop(self) -> bool:
+        return (await self._settings())["loop"]
 
-    def set_loop(self, loop_type: str) -> bool:
-        self._set_object({"loop": loop_type})
+    async def set_loop(self, loop_type: str) -> bool:
+        await self.storage.set_loop(self.guild, loop_type)
+        (await self._settings())["loop"] = loop_type
 
-    def cycle_loop(self) -> bool:
+    async def cycle_loop(self) -> bool:
         loops = ["playlist_repeat", "track_repeat", "no_repeat", "playlist_repeat"]
-        loop = loops[loops.index(self.get_loop()) + 1]
-        self._set_object({"loop": loop})
+        loop = loops[loops.index(await self.get_loop()) + 1]
+        await self.set_loop(loop)
         return loop
 
-    def shuffle(self) -> None:
-        playlist = list(self.playlist()[1])
-        random.shuffle(playlist)
-        self._set_object({"playlist": playlist})
+    async def shuffle(self) -> None:
+        await self.storage.shuffle_tracks(self.guild, (await self._settings())["tail"])
 
 
-class RoleDB(MongoDB):
-    def __init__(self, guild: int) -> None:
-        super().__init__(guild, collection="roles")
+class RoleDB(AtlasDB):
+    cache = AtlasCache("roles", ttl=float(os.getenv("CACHE_TTL", 60)))  # guild -> {role name: role id}
+    levels = AtlasCache("permission levels", ttl=float(os.getenv("CACHE_TTL", 60)))  # guild -> {member role ids: level}
+
+    @staticmethod
+    def invalidate(guild: int) -> None:
+        """Drop everything cached for the guild, memoized levels only depend on its role mapping so they go with it"""
+        RoleDB.cache.pop(guild)
+        RoleDB.levels.pop(guild)
 
-    def insert(self, id: int, role: str) -> None:
-        self._set_object({role: id})
+    @staticmethod
+    def store(guild: int, roles: dict) -> None:
+        """Caches a freshly loaded role mapping, levels memoized against the one it replaces may no longer hold"""
+        RoleDB.levels.pop(guild)
+        RoleDB.cache.set(guild, roles)
 
-    def remove(self, role: str) -> int:
-        id = self.get(role)
-        self.data.update_one({"_id": self.guild}, {"$unset": {role: True}})
+    async def insert(self, id: int, role: str) -> None:
+        await self.storage.set_role(self.guild, role, id)
+        RoleDB.invalidate(self.guild)
+
+    async def remove(self, role: str) -> int:
+        id = await self.get(role)
+        await self.storage.unset_role(self.guild, role)
+        RoleDB.invalidate(self.guild)
         return id
 
-    def get(self, role: str) -> int:
-        if not (role := self._get_object(role)):
-            role = 0
-        return role
+    async def get(self, role: str) -> int:
+        return (await self.list()).get(role, 0)
+
+    async def permission_level(self, member) -> int:
+        return RoleDB.level(self.guild, await self.list(), member)
 
-    def permission_level(self, member) -> int:
+    @staticmethod
+    def level(guild: int, roles: dict, member) -> int:
+        """The member's permission level given the guild's registered roles, memoized per set of member roles"""
         if member.guild_permissions.administrator:
             return Roles.ADMINISTRATOR.value
 
-        guild_roles = self.data.find_one({"_id": self.guild}, {"_id": False}).items()
-        user_roles = [role.id for role in member.roles]
-        return max((Roles[name.upper()].value for name, role in guild_roles if role in user_roles), default=0)
+        if (levels := RoleDB.levels.get(guild)) is None:
+            RoleDB.levels.set(guild, levels := {})
+
+        user_roles = frozenset(role.id for role in member.roles)
+        if (level := levels.get(user_roles)) is None:
+            level = levels[user_roles] = max((Roles[name.upper()].value for name, role in roles.items() if role in user_roles), default=0)
+        return level
 
-    def list(self) -> dict:
-        return self.data.find_one({"_id": self.guild}, {"_id": False})
+    async def list(self) -> dict:
+        if (roles := RoleDB.cache.get(self.guild)) is None:
+            roles = await self.storage.get_roles(self.guild)
+            RoleDB.store(self.guild, roles)
+        return dict(roles)
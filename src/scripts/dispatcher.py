@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+import logging
+import random
+import aiohttp
+import discord
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class AtlasDispatcher:
+    """Fans scheduled posts out with bounded concurrency, retries transient failures with jittered backoff and records how late each delivery was"""
+    dispatchers: list["AtlasDispatcher"] = []  # every dispatcher created, used to report metrics
+
+    def __init__(self, name: str, concurrency: int = 10, rate: float = 40, retries: int = 3) -> None:
+        self.name = name
+        self.retries = retries
+        self.latencies: dict[int, float] = {}  # key -> seconds between the scheduled time and the delivery
+        self.delivered = 0
+        self.failed = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # discord.py already waits out per-route buckets, spacing requests keeps the burst under the global limit too
+        self._interval = 1 / rate
+        self._next_request = 0.0
+        self._tasks: set[asyncio.Task] = set()
+        AtlasDispatcher.dispatchers.append(self)
+
+    @staticmethod
+    def _transient(error: Exception) -> bool:
+        if isinstance(error, discord.HTTPException):
+            return error.status == 429 or error.status >= 500
+        return isinstance(error, (discord.RateLimited, aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+    async def _throttle(self) -> None:
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next_request)
+        self._next_request = start + self._interval
+        await asyncio.sleep(start - now)
+
+    def dispatch(self, key: int, scheduled: datetime.datetime, prepare: Callable[[], Awaitable[Callable[[], Awaitable] | None]]) -> None:
+        """Queues a post, `prepare` runs once and returns the request to deliver (or None to skip), only that request is retried"""
+        task = asyncio.create_task(self._run(key, scheduled, prepare))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: int, scheduled: datetime.datetime, prepare: Callable[[], Awaitable[Callable[[], Awaitable] | None]]) -> None:
+        async with self._semaphore:
+            try:
+                if (send := await prepare()) is None:
+                    return
+            except Exception:
+                self.failed += 1
+                logger.exception(f"{self.name}: failed to prepare the post for {key}")
+                return
+
+            for attempt in range(self.retries + 1):
+                await self._throttle()
+                try:
+                    await send()
+                except Exception as error:
+                    if not self._transient(error) or attempt == self.retries:
+                        self.failed += 1
+                        logger.exception(f"{self.name}: failed to deliver the post for {key}")
+                        return
+                    # full jitter so retries from a burst don't line up again
+                    await asyncio.sleep(getattr(error, "retry_after", 0) + random.uniform(0, 2 ** attempt))
+                else:
+                    self.delivered += 1
+                    self.latencies[key] = (datetime.datetime.utcnow() - scheduled).total_seconds()
+                    return
+
+    @property
+    def mean_latency(self) -> float:
+        return sum(self.latencies.values()) / len(self.latencies) if self.latencies else 0.0
+
+    @property
+    def max_latency(self) -> float:
+        return max(self.latencies.values(), default=0.0)
@@ -0,0 +1,165 @@
+import bisect
+import copy
+import datetime
+
+from scripts.storage import AtlasStorage
+
+
+class MemoryStorage(AtlasStorage):
+    """Keeps everything in dicts for the lifetime of the process, for local runs and benchmarks, nothing is persisted"""
+
+    def __init__(self) -> None:
+        self.modules: dict[int, dict] = {}  # guild -> {module name: config}
+        self.roles: dict[int, dict] = {}  # guild -> {role name: role id}
+        self.blames: dict[tuple[int, int], list[dict]] = {}  # (guild, user) -> blames in insertion order
+        self.questions: dict[int, dict[int, dict]] = {}  # guild -> {id: question}
+        self.qotd: dict[int, dict] = {}  # guild -> {"seq", "cron", "timezone", "next_run", "last_run"}
+        self.radio: dict[int, dict] = {}  # guild -> {"loop", "stats"}
+        self.tracks: dict[int, list[dict]] = {}  # guild -> tracks kept sorted by position
+
+    # everything handed out is a copy, like it would be coming off the wire
+    async def get_modules(self, guild: int) -> dict:
+        return copy.deepcopy(self.modules.get(guild, {}))
+
+    async def set_module(self, guild: int, name: str, config: dict) -> None:
+        self.modules.setdefault(guild, {})[name] = copy.deepcopy(config)
+
+    async def unset_module(self, guild: int, name: str) -> None:
+        self.modules.get(guild, {}).pop(name, None)
+
+    async def guilds_with_module(self, name: str) -> list[dict]:
+        return [{"guild": guild, "config": copy.deepcopy(modules[name])} for guild, modules in self.modules.items() if name in modules]
+
+    async def get_roles(self, guild: int) -> dict:
+        return dict(self.roles.get(guild, {}))
+
+    async def set_role(self, guild: int, name: str, id: int) -> None:
+        self.roles.setdefault(guild, {})[name] = id
+
+    async def unset_role(self, guild: int, name: str) -> None:
+        self.roles.get(guild, {}).pop(name, None)
+
+    async def push_blame(self, guild: int, user: int, blamer: int, reason: str | None) -> int:
+        blames = self.blames.setdefault((guild, user), [])
+        blames.append({"blamer": blamer, "reason": reason})
+        return len(blames)
+
+    async def count_blames(self, guild: int, user: int) -> tuple[int, int]:
+        blames = self.blames.get((guild, user), [])
+        return len(blames), sum(isinstance(blame["reason"], str) for blame in blames)
+
+    async def list_blames(self, guild: int, user: int, skip: int = 0, limit: int = 0) -> tuple[int, int, list[dict]]:
+        blames = self.blames.get((guild, user), [])
+        reasons = [dict(blame) for blame in blames if isinstance(blame["reason"], str)]
+        return len(blames), len(reasons), reasons[skip:skip + limit if limit else None]
+
+    def _ordered(self, guild: int, state: str) -> list[dict]:
+        return sorted((question for question in self.questions.get(guild, {}).values() if question["state"] == state), key=lambda question: (question["order"], question["id"]))
+
+    async def push_question(self, guild: int, question: str, user: int) -> int:
+        qotd = self.qotd.setdefault(guild, {"seq": 0})
+        qotd["seq"] = id = qotd.get("seq", 0) + 1
+        self.questions.setdefault(guild, {})[id] = {"id": id, "state": "pending", "order": datetime.datetime.utcnow(), "question": question, "user": user}
+        return id
+
+    async def get_questions(self, guild: int, state: str, skip: int = 0, limit: int = 0) -> tuple[int, list]:
+        questions = self._ordered(guild, state)
+        return len(questions), copy.deepcopy(questions[skip:skip + limit if limit else None])
+
+    async def delete_question(self, guild: int, state: str, id: int) -> dict | None:
+        questions = self.questions.get(guild, {})
+        if (question := questions.get(id)) is None or question["state"] != state:
+            return None
+        return questions.pop(id)
+
+    async def accept_question(self, guild: int, id: int) -> dict | None:
+        if (question := self.questions.get(guild, {}).get(id)) is None or question["state"] != "pending":
+            return None
+        before = dict(question)
+        question.update(state="accepted", order=datetime.datetime.utcnow())
+        return before
+
+    async def pop_question(self, guild: int) -> dict | None:
+        if not (questions := self._ordered(guild, "accepted")):
+            return None
+        return self.questions[guild].pop(questions[0]["id"])
+
+    async def set_schedule(self, guild: int, cron: str, timezone: str, next_run: datetime.datetime) -> None:
+        self.qotd.setdefault(guild, {"seq": 0}).update(cron=cron, timezone=timezone, next_run=next_run)
+
+    async def clear_schedule(self, guild: int) -> None:
+        if (qotd := self.qotd.get(guild)) is not None:
+            qotd.update(cron=None, timezone=None, next_run=None)
+
+    async def due_schedules(self, now: datetime.datetime) -> list[dict]:
+        return [
+            {"guild": guild, "cron": qotd["cron"], "timezone": qotd["timezone"], "next_run": qotd["next_run"]}
+            for guild, qotd in self.qotd.items() if qotd.get("next_run") is not None and qotd["next_run"] <= now
+        ]
+
+    async def upcoming_schedule(self) -> datetime.datetime | None:
+        return min((qotd["next_run"] for qotd in self.qotd.values() if qotd.get("next_run") is not None), default=None)
+
+    async def claim_schedule(self, guild: int, run: datetime.datetime, next_run: datetime.datetime) -> bool:
+        if (qotd := self.qotd.get(guild)) is None or qotd.get("next_run") != run:
+            return False
+        qotd.update(next_run=next_run, last_run=run)
+        return True
+
+    async def get_radio(self, guild: int) -> dict | None:
+        if (radio := self.radio.get(guild)) is None:
+            return None
+        tracks = self.tracks.get(guild)
+        return {"loop": radio.get("loop"), "tail": tracks[-1]["position"] if tracks else 0, "stats": copy.deepcopy(radio.get("stats"))}
+
+    async def set_loop(self, guild: int, loop: str) -> None:
+        self.radio.setdefault(guild, {})["loop"] = loop
+
+    async def set_radio_stats(self, guild: int, stats: dict) -> None:
+        self.radio.setdefault(guild, {})["stats"] = copy.deepcopy(stats)
+
+    async def add_radio_stats(self, guild: int, change: dict) -> None:
+        radio = self.radio.setdefault(guild, {})
+        if radio.get("stats") is None:
+            radio["stats"] = AtlasStorage.tally_stats([])
+        AtlasStorage.apply_stats(radio["stats"], change)
+
+    @staticmethod
+    def _position(track: dict) -> float:
+        return track["position"]
+
+    def _insert(self, guild: int, track: dict) -> None:
+        bisect.insort(self.tracks.setdefault(guild, []), track, key=MemoryStorage._position)
+
+    def _remove(self, guild: int, id) -> dict | None:
+        tracks = self.tracks.get(guild, [])
+        index = next((index for index, track in enumerate(tracks) if track["_id"] == id), None)
+        return tracks.pop(index) if index is not None else None
+
+    async def get_tracks(self, guild: int, skip: int = 0, limit: int = 0) -> list[dict]:
+        return copy.deepcopy(self.tracks.get(guild, [])[skip:skip + limit if limit else None])
+
+    async def write_tracks(self, guild: int, inserted: list[dict] = [], updated: list[dict] = [], deleted: list = []) -> None:
+        for track in inserted:
+            self._insert(guild, copy.deepcopy(track))
+        for change in updated:
+            if (track := self._remove(guild, change["_id"])) is not None:
+                track.update(position=change["position"], track=change.get("track"))
+                self._insert(guild, track)
+        for id in deleted:
+            self._remove(guild, id)
+
+    async def rotate_track(self, guild: int, position: float) -> dict | None:
+        if not (tracks := self.tracks.get(guild)):
+            return None
+        track = tracks.pop(0)
+        before = copy.deepcopy(track)
+        track["position"] = position
+        self._insert(guild, track)
+        return before
+
+    async def pop_track(self, guild: int) -> dict | None:
+        return self.tracks[guild].pop(0) if self.tracks.get(guild) else None
+
+    async def clear_tracks(self, guild: int) -> None:
+        self.tracks.pop(guild, None)
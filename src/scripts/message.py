@@ -1,15 +1,18 @@
+import asyncio
 import discord
 import datetime
-import itertools
 
 from discord.interactions import Interaction
 
-from scripts.database import RadioDB, RoleDB
+from scripts.context import AtlasContext
 from scripts.permissions import PermissionError
 from scripts.pomice import AtlasPlayer
 from utils.enums import Colour
-from utils.functions import clamp
-from typing import Iterable
+from utils.functions import clamp, format_track_time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+PAGE_SIZE = 7
 
 
 class AtlasEmbed:
@@ -30,17 +33,41 @@ class AtlasEmbed:
         )
         return embed
 
+class AtlasPageSource:
+    """Paginated data fetched one window at a time, `query(skip, limit)` returns the total length and the window's items"""
+    def __init__(self, query: Callable[[int, int], Awaitable[tuple[int, list]]], format: Callable[[int, Any], tuple[str, str]]) -> None:
+        self.query = query
+        self.format = format  # (position, item) -> (field name, field value)
+        self.length = 0
+        self._primed = None
+
+    def prime(self, length: int, items: list) -> None:
+        """Hand over a first page that was already fetched alongside other data"""
+        self.length = length
+        self._primed = items
+
+    async def fetch(self, skip: int, limit: int) -> tuple[tuple[str, str], ...]:
+        if skip == 0 and self._primed is not None:
+            items, self._primed = self._primed, None
+        else:
+            self.length, items = await self.query(skip, limit)
+        return tuple(self.format(i, item) for i, item in enumerate(items, start=skip + 1))
+
 class AtlasPagifier(discord.ui.View):
-    def __init__(self, data: Iterable, timeout: float, divider: int, length: int) -> None:
-        self.data = data
+    def __init__(self, source: AtlasPageSource, timeout: float, divider: int, cached_pages: int = 3) -> None:
+        self.source = source
         self.divider = divider  # number of fields per page
+        self.cached_pages = cached_pages  # bounds the memory held by an open view
 
-        self.cache = []
-        self.last_page = (length - 1) // divider + 1
+        self.cache: OrderedDict[int, asyncio.Task] = OrderedDict()
         self._current_page = 0
 
         super().__init__(timeout=timeout)
 
+    @property
+    def last_page(self) -> int:
+        return (self.source.length - 1) // self.divider + 1
+
     @property
     def current_page(self) -> int:
         return self._current_page
@@ -48,8 +75,20 @@ class AtlasPagifier(discord.ui.View):
     @current_page.setter
     def current_page(self, value: int) -> None:
         self._current_page = clamp(value, 0, self.last_page - 1)
-        if self._current_page > len(self.cache) - 1:
-            self.cache.append(tuple(itertools.islice(self.data, self.divider))) # fetch the next set of values
+
+    def fetch_page(self, page: int) -> asyncio.Task:
+        if (task := self.cache.get(page)) is None:
+            task = self.cache[page] = asyncio.create_task(self.source.fetch(page * self.divider, self.divider))
+            task.add_done_callback(lambda task: self.forget(page, task))
+            while len(self.cache) > self.cached_pages:
+                self.cache.popitem(last=False)
+        self.cache.move_to_end(page)
+        return task
+
+    def forget(self, page: int, task: asyncio.Task) -> None:
+        """Drops a failed or cancelled fetch so the next press on its page fetches it again"""
+        if (task.cancelled() or task.exception() is not None) and self.cache.get(page) is task:
+            del self.cache[page]
 
     @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.primary)
     async def previous_button_callback(self, interaction: discord.Interaction, button: discord.Button) -> None:
@@ -59,82 +98,132 @@ class AtlasPagifier(discord.ui.View):
     async def next_button_callback(self, interaction: discord.Interaction, button: discord.Button) -> None:
         await self.change_page(interaction, +1)
 
-    def update_embed(self, embed: discord.Embed, increment: int = 0) -> discord.Embed:
+    async def update_embed(self, embed: discord.Embed, increment: int = 0) -> discord.Embed:
         embed.clear_fields()
+        if not self.cache:  # the first page tells us how long the data is
+            await self.fetch_page(0)
         self.current_page += increment
-        for name, value in self.cache[self.current_page]:
+        for name, value in await self.fetch_page(self.current_page):
             embed.add_field(
                 name=name,
                 value=value,
                 inline=False
             )
+        if self.current_page + 1 < self.last_page:
+            self.fetch_page(self.current_page + 1)  # prefetch the next page while this one is being read
         embed.set_footer(text=f"Page: {self.current_page + 1}/{self.last_page}")
         return embed
 
     async def change_page(self, interaction: discord.Interaction, increment: int = 0) -> None:
-        embed = self.update_embed(interaction.message.embeds[0], increment=increment)
+        embed = await self.update_embed(interaction.message.embeds[0], increment=increment)
         await interaction.response.edit_message(embed=embed)
 
 class AtlasPlayerControl(discord.ui.View):
-    def __init__(self, player: AtlasPlayer, playlist: list) -> None:
-        self.player = player
-        self.playlist = playlist
+    """The radio's control panel, a single persistent view shared by the panel message of every player"""
+    view: "AtlasPlayerControl" = None  # the instance registered with the bot, it handles the buttons of every panel
+    layout: "AtlasPlayerControl" = None  # a stopped copy panels are sent with, discord.py doesn't store views that are finished
+    debounce = 1  # seconds to wait for more queue changes before editing the panel
+    reposition = 4  # the panel is reposted once this many messages have been sent below it
+
+    def __init__(self) -> None:
         super().__init__(timeout=None)
 
+    @classmethod
+    def register(cls, bot: discord.Client) -> None:
+        if cls.view is None:
+            cls.view = cls()
+            cls.layout = cls()
+            cls.layout.stop()
+        bot.add_view(cls.view)
+
     async def interaction_check(self, interaction: Interaction) -> bool:
-        if not (interaction.user.voice and interaction.user.voice.channel == self.player.channel):
+        player = interaction.guild.voice_client
+        if not isinstance(player, AtlasPlayer):
+            await AtlasMessage(interaction).send_error(title="The radio isn't currently active")
+            return False
+
+        if not (interaction.user.voice and interaction.user.voice.channel == player.channel):
             await AtlasMessage(interaction).send_error(title="You are not connected to the bot's channel!")
-            return
+            return False
 
-        if not RoleDB(self.player.guild.id).permission_level(interaction.user) >= 8:
+        if not (await AtlasContext.get(interaction)).permission_level(interaction.user) >= 8:
             raise PermissionError
 
         return True
 
-    @discord.ui.button(emoji="⏯️", style=discord.ButtonStyle.primary)
+    @discord.ui.button(emoji="⏯️", style=discord.ButtonStyle.primary, custom_id="atlas:radio:pause")
     async def pause_callback(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
-        await self.player.set_pause(not self.player.is_paused)
+        player = interaction.guild.voice_client
+        await player.set_pause(not player.is_paused)
         await interaction.response.defer()
 
-    @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.primary)
+    @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.primary, custom_id="atlas:radio:skip")
     async def skip_callback(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
-        await self.player.stop()
+        await interaction.guild.voice_client.stop()
         await interaction.response.defer()
 
-    @discord.ui.button(emoji="🔁", style=discord.ButtonStyle.primary)
+    @discord.ui.button(emoji="🔁", style=discord.ButtonStyle.primary, custom_id="atlas:radio:loop")
     async def loop_callback(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
-        RadioDB(self.player.guild.id).cycle_loop()
-        await interaction.response.edit_message(embed=interaction.message.embeds[0].set_footer(text=self.loop_text()))
+        player = interaction.guild.voice_client
+        await player.queue.cycle_loop()
+        await interaction.response.edit_message(embed=interaction.message.embeds[0].set_footer(text=await self.loop_text(player)))
+
+    @staticmethod
+    def refresh(player: AtlasPlayer) -> None:
+        """Schedules an update of the player's panel, a burst of queue changes ends up as a single edit"""
+        player.panel_stale = True
+        if player.panel_task is None or player.panel_task.done():
+            player.panel_task = asyncio.get_running_loop().create_task(AtlasPlayerControl.update_panel(player))
 
-    async def update_player_controls(self) -> None:
-        if not self.player:
+    @staticmethod
+    async def update_panel(player: AtlasPlayer) -> None:
+        # changes made while an update is underway are picked up by the next round
+        while player.panel_stale:
+            await asyncio.sleep(AtlasPlayerControl.debounce)
+            player.panel_stale = False
+            await AtlasPlayerControl.update_player_controls(player)
+
+    @staticmethod
+    async def update_player_controls(player: AtlasPlayer) -> None:
+        if player.text_channel is None or not (playlist := await player.queue.playlist(8)):
             return
 
-        if self.player.message in [message async for message in self.player.text_channel.history(limit=4)]:
-            await self.player.message.edit(embed=self.update_embed(), view=self)
-        else:
-            if self.player.message:
-                await self.player.message.delete()
-            self.player.message = await self.player.text_channel.send(embed=self.update_embed(), view=self)
+        embed = await AtlasPlayerControl.update_embed(player, playlist, await player.queue.stats())
+        if player.message and player.messages_below < AtlasPlayerControl.reposition:
+            try:
+                await player.message.edit(embed=embed)
+                return
+            except discord.NotFound:
+                pass
+        elif player.message:
+            try:
+                await player.message.delete()
+            except discord.NotFound:
+                pass
+        player.message = await player.text_channel.send(embed=embed, view=AtlasPlayerControl.layout)
+        player.messages_below = 0
 
-    def update_embed(self) -> discord.Embed:
+    @staticmethod
+    async def update_embed(player: AtlasPlayer, playlist: list, stats: dict) -> discord.Embed:
         embed = discord.Embed(
-            title=f"Now Playing: {self.playlist[0]['author']} | {self.playlist[0]['title']}",
+            title=f"Now Playing: {playlist[0]['author']} | {playlist[0]['title']}",
+            description=f"{stats['count']} track(s) | {format_track_time(stats['length'])}",
             colour=Colour.RADIO.value
         )
-        for i, item in enumerate(self.playlist[1:], start=2):
+        for i, item in enumerate(playlist[1:], start=2):
             embed.add_field(
                 name=f"{i}) {item['author']} | {item['title']}",
                 value=f"by <@{item['user']}>",
                 inline=False
             )
-        embed.set_author(name="Radio", icon_url=self.player.bot.user.avatar)
-        embed.set_footer(text=self.loop_text())
+        embed.set_author(name="Radio", icon_url=player.bot.user.avatar)
+        embed.set_footer(text=await AtlasPlayerControl.loop_text(player))
 
         return embed
 
-    def loop_text(self) -> str:
-        match RadioDB(self.player.guild.id).get_loop():
+    @staticmethod
+    async def loop_text(player: AtlasPlayer) -> str:
+        match await player.queue.get_loop():
             case "playlist_repeat":
                 return "🔁 | Playlist"
             case "track_repeat":
@@ -154,7 +243,7 @@ class AtlasVolumeControl(discord.ui.View):
             await AtlasMessage(interaction).send_error(title="You are not connected to the bot's channel!")
             return False
 
-        if not RoleDB(self.player.guild.id).permission_level(interaction.user) >= 8:
+        if not (await AtlasContext.get(interaction)).permission_level(interaction.user) >= 8:
             raise PermissionError
 
         return True
@@ -217,8 +306,17 @@ class AtlasMessage:
     def __init__(self, interaction: discord.Interaction) -> None:
         self.interaction = interaction
 
+    async def _respond(self, delete_after: float = None, **kwargs) -> None:
+        """Sends the interaction response, or a followup if the interaction was deferred"""
+        if not self.interaction.response.is_done():
+            await self.interaction.response.send_message(delete_after=delete_after, **kwargs)
+            return
+        message = await self.interaction.followup.send(wait=True, **kwargs)
+        if delete_after is not None:
+            await message.delete(delay=delete_after)
+
     async def send(self, title: str = "", description: str = "", colour: Colour = Colour.INFO) -> None:
-        await self.interaction.response.send_message(embed=AtlasEmbed.default(
+        await self._respond(embed=AtlasEmbed.default(
             user=self.interaction.user,
             title=title,
             description=description,
@@ -226,7 +324,7 @@ class AtlasMessage:
         ))
 
     async def send_error(self, title: str = "", description: str = "", colour: Colour = Colour.ERROR, delete_after: float = 5) -> None:
-        await self.interaction.response.send_message(delete_after=delete_after, ephemeral=True, embed=AtlasEmbed.default(
+        await self._respond(delete_after=delete_after, ephemeral=True, embed=AtlasEmbed.default(
             user=self.interaction.user,
             title=title,
             description=description,
@@ -234,7 +332,7 @@ class AtlasMessage:
         ))
 
     async def send_image(self, url: str, title: str = "", description: str = "", colour: Colour = Colour.INFO, file=discord.utils.MISSING) -> None:
-        await self.interaction.response.send_message(file=file, embed=AtlasEmbed.default(
+        await self._respond(file=file, embed=AtlasEmbed.default(
             user=self.interaction.user,
             title=title,
             description=description,
@@ -249,22 +347,22 @@ class AtlasMessage:
             colour=colour
         )
         embed.add_field(name=name, value=value, inline=inline)
-        await self.interaction.response.send_message(embed=embed)
+        await self._respond(embed=embed)
 
-    async def send_page(self, data: Iterable, length: int, title: str = "", description: str = "", colour: Colour = Colour.INFO, timeout: float = 30, divider: int = 7) -> None:
-        view = AtlasPagifier(data=data, divider=divider, timeout=timeout, length=length)
-        embed = view.update_embed(embed=AtlasEmbed.default(
+    async def send_page(self, source: AtlasPageSource, title: str = "", description: str = "", colour: Colour = Colour.INFO, timeout: float = 30, divider: int = PAGE_SIZE) -> None:
+        view = AtlasPagifier(source=source, divider=divider, timeout=timeout)
+        embed = await view.update_embed(embed=AtlasEmbed.default(
             user=self.interaction.user,
             title=title,
             description=description,
             colour=colour
         ))
-        await self.interaction.response.send_message(embed=embed, view=view)
+        await self._respond(embed=embed, view=view)
 
     async def send_radio_volume_control(self):
         view = AtlasVolumeControl(self.interaction)
-        await self.interaction.response.send_message(embed=view.update_embed(), view=view)
+        await self._respond(embed=view.update_embed(), view=view)
 
     async def send_radio_voteskip(self):
         view = AtlasVoteSkipControl(self.interaction)
-        await self.interaction.response.send_message(embed=view.update_embed(), view=view)
+        await self._respond(embed=view.update_embed(), view=view)
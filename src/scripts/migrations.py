@@ -0,0 +1,116 @@
+import asyncio
+import datetime
+
+from scripts import schema
+from scripts.database import ModuleDB, QotdDB
+from scripts.mongo import MongoStorage
+from scripts.storage import AtlasStorage
+from utils.enums import Module
+
+BATCH_SIZE = 1000
+
+
+async def radio_playlists() -> None:
+    """Moves every guild's `playlist` array out of the radio document and into one radio_tracks document per track"""
+    database = MongoStorage.get_database()
+    async for document in database["radio"].find({"playlist": {"$exists": True}}, {"playlist": True}):
+        await database["radio_tracks"].delete_many({"guild": document["_id"]})  # in case a previous run was interrupted
+        if tracks := document["playlist"]:
+            await database["radio_tracks"].insert_many([
+                {**track, "guild": document["_id"], "position": position} for position, track in enumerate(tracks, start=1)
+            ])
+        await database["radio"].update_one({"_id": document["_id"]}, {"$unset": {"playlist": True}})
+        print(f"Migrated {len(tracks)} track(s) for guild {document['_id']}")
+
+
+async def blames() -> None:
+    """Streams the per-guild blame documents (one `n<user>` array per user) into individual blames and per-user counters"""
+    database = MongoStorage.get_database()
+    async for document in database["blame"].find({}, batch_size=1):
+        guild = document.pop("_id")
+        # start from a clean slate in case a previous run was interrupted half way through this guild
+        await database["blames"].delete_many({"guild": guild})
+        await database["blame_counts"].delete_many({"_id.guild": guild})
+
+        for field, blames in document.items():
+            if not field.startswith("n"):
+                continue
+            user = int(field[1:])
+            for i in range(0, len(blames), BATCH_SIZE):
+                await database["blames"].insert_many([
+                    {"guild": guild, "user": user, "blamer": blame.get("blamer"), "reason": blame.get("reason")} for blame in blames[i:i + BATCH_SIZE]
+                ])
+            await database["blame_counts"].insert_one({
+                "_id": {"guild": guild, "user": user}, "count": len(blames),
+                "reasons": sum(isinstance(blame.get("reason"), str) for blame in blames)
+            })
+
+        await database["blame"].delete_one({"_id": guild})
+        print(f"Migrated blames for guild {guild}")
+
+
+async def qotd_questions() -> None:
+    """Moves the pending and accepted arrays of every guild's qotd document into individual qotd_questions documents"""
+    database = MongoStorage.get_database()
+    async for document in database["qotd"].find({"$or": [{"pending": {"$exists": True}}, {"accepted": {"$exists": True}}]}):
+        guild = document["_id"]
+        await database["qotd_questions"].delete_many({"guild": guild})  # in case a previous run was interrupted
+
+        # keep the current ordering, accepted questions are still asked oldest first
+        now = datetime.datetime.utcnow()
+        questions = [("accepted", question) for question in document.get("accepted", [])] + [("pending", question) for question in document.get("pending", [])]
+        if questions:
+            await database["qotd_questions"].insert_many([{
+                "guild": guild, "id": id, "state": state, "order": now + datetime.timedelta(milliseconds=id),
+                "question": question["question"], "user": question["user"]
+            } for id, (state, question) in enumerate(questions, start=1)])
+
+        await database["qotd"].update_one({"_id": guild}, {"$set": {"seq": len(questions)}, "$unset": {"pending": True, "accepted": True}})
+        print(f"Migrated {len(questions)} question(s) for guild {guild}")
+
+
+async def qotd_schedules() -> None:
+    """Turns the "HH:MM" UTC time of every guild's qotd config into a cron schedule with a precomputed next run"""
+    database = MongoStorage.get_database()
+    for data in await ModuleDB.get_guilds_enabled(Module.QOTD):
+        if "time" not in data["config"]:
+            continue
+        hour, minute = map(int, data["config"]["time"].split(":"))
+        config = {"channel": data["config"]["channel"], "cron": f"{minute} {hour % 24} * * *", "timezone": "UTC"}
+        await database["modules"].update_one({"_id": data["guild"], "modules.name": Module.QOTD.value}, {"$set": {"modules.$.config": config}})
+        await QotdDB(data["guild"]).set_schedule(config["cron"], config["timezone"])
+        print(f"Migrated the qotd schedule for guild {data['guild']}")
+
+
+async def radio_stats() -> None:
+    """Computes the running queue stats (length, track, stream and per-user counts) of every guild's radio queue"""
+    await MongoStorage.get_database()["radio_tracks"].aggregate([
+        {"$group": {
+            "_id": {"guild": "$guild", "user": "$user"},
+            "length": {"$sum": "$length"}, "count": {"$sum": 1}, "streams": {"$sum": {"$cond": [{"$eq": ["$length", 0]}, 1, 0]}}
+        }},
+        {"$group": {
+            "_id": "$_id.guild",
+            "length": {"$sum": "$length"}, "count": {"$sum": "$count"}, "streams": {"$sum": "$streams"},
+            "users": {"$push": {"k": {"$toString": "$_id.user"}, "v": "$count"}}
+        }},
+        {"$project": {"stats": {"length": "$length", "count": "$count", "streams": "$streams", "users": {"$arrayToObject": "$users"}}}},
+        {"$merge": {"into": "radio", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]).to_list(None)
+    print("Migrated the radio queue stats")
+
+
+async def migrate() -> None:
+    # the layouts being migrated only ever existed in mongo, whatever STORAGE_BACKEND says
+    AtlasStorage.storage = MongoStorage()
+    await schema.bootstrap()
+    await radio_playlists()
+    await blames()
+    await qotd_questions()
+    await qotd_schedules()
+    await radio_stats()
+    await AtlasStorage.close()
+
+
+if __name__ == "__main__":  # python -m scripts.migrations
+    asyncio.run(migrate())
@@ -0,0 +1,312 @@
+import asyncio
+import datetime
+import os
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from scripts.cache import AtlasCache
+from scripts.storage import AtlasStorage
+
+
+class MongoStorage(AtlasStorage):
+    """Stores every guild's settings as a document per collection, queued tracks, blames and questions as a document each"""
+    client: AsyncIOMotorClient | None = None
+
+    def __init__(self) -> None:
+        self.database = MongoStorage.get_database()
+        self.transactions = False  # only replica sets and sharded clusters run them, found out by bootstrap()
+
+    @staticmethod
+    def connect() -> AsyncIOMotorClient:
+        """Returns the process-wide client, every instance borrows connections from its pool"""
+        if MongoStorage.client is None:
+            MongoStorage.client = AsyncIOMotorClient(
+                os.getenv("MONGO_URI", "mongodb://mongo:27017/"),
+                maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+                minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+                maxIdleTimeMS=int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000)),
+                connectTimeoutMS=int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+                serverSelectionTimeoutMS=int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)),
+                socketTimeoutMS=int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 10000)),
+            )
+        return MongoStorage.client
+
+    @staticmethod
+    def get_database() -> AsyncIOMotorDatabase:
+        return MongoStorage.connect()[os.getenv("MONGO_DATABASE", "discordbot")]
+
+    async def disconnect(self) -> None:
+        if MongoStorage.client is not None:
+            MongoStorage.client.close()
+            MongoStorage.client = None
+
+    async def bootstrap(self) -> None:
+        from scripts.schema import COLLECTIONS
+        existing = await self.database.list_collection_names()
+
+        async def ensure(name: str, indexes: list[pymongo.IndexModel]) -> None:
+            if name not in existing:
+                try:
+                    await self.database.create_collection(name)
+                except pymongo.errors.CollectionInvalid:  # another instance got there first
+                    pass
+            if indexes:
+                await self.database[name].create_indexes(indexes)
+
+        await asyncio.gather(*(ensure(name, indexes) for name, indexes in COLLECTIONS.items()))
+        hello = await self.database.command("hello")
+        self.transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+
+    async def watch(self, collection: str, *caches: AtlasCache) -> None:
+        ttl = {cache: cache.ttl for cache in caches}
+        while True:
+            try:
+                async with self.database[collection].watch() as stream:
+                    for cache in caches:
+                        cache.ttl = None  # the stream keeps entries coherent, no need to expire them
+                    async for change in stream:
+                        for cache in caches:
+                            cache.pop(change["documentKey"]["_id"])
+            except pymongo.errors.OperationFailure:  # change streams need a replica set, fall back to polling
+                for cache in caches:
+                    cache.ttl = ttl[cache]
+                return
+            except pymongo.errors.PyMongoError:  # lost the stream, anything cached since may be stale
+                for cache in caches:
+                    cache.ttl = ttl[cache]
+                    cache.clear()
+                await asyncio.sleep(5)
+
+    async def get_modules(self, guild: int) -> dict:
+        document = await self.database["modules"].find_one({"_id": guild}) or {}
+        return {module["name"]: module["config"] for module in document.get("modules", [])}
+
+    async def set_module(self, guild: int, name: str, config: dict) -> None:
+        modules = self.database["modules"]
+        if (await modules.update_one({"_id": guild, "modules.name": name}, {"$set": {"modules.$.config": config}})).matched_count == 0:
+            # the guild's document is only created by its first write
+            await modules.update_one({"_id": guild}, {"$push": {"modules": {"name": name, "config": config}}}, upsert=True)
+
+    async def unset_module(self, guild: int, name: str) -> None:
+        await self.database["modules"].update_one({"_id": guild}, {"$pull": {"modules": {"name": name}}})
+
+    async def guilds_with_module(self, name: str) -> list[dict]:
+        # the first match narrows down to the guilds through the index, the second drops their other modules
+        return await self.database["modules"].aggregate([
+            {"$match": {"modules.name": name}},
+            {"$unwind": "$modules"},
+            {"$match": {"modules.name": name}},
+            {"$project": {"_id": False, "guild": "$_id", "config": "$modules.config"}}
+        ]).to_list(None)
+
+    async def get_settings(self, guild: int) -> tuple[dict, dict]:
+        # both documents in one round trip
+        documents = await self.database["modules"].aggregate([
+            {"$match": {"_id": guild}},
+            {"$unionWith": {"coll": "roles", "pipeline": [
+                {"$match": {"_id": guild}},
+                {"$replaceWith": {"roles": "$$ROOT"}}
+            ]}}
+        ]).to_list(2)
+        document = {key: value for document in documents for key, value in document.items()}
+        modules = {module["name"]: module["config"] for module in document.get("modules", [])}
+        roles = {name: id for name, id in document.get("roles", {}).items() if name != "_id"}
+        return modules, roles
+
+    async def get_roles(self, guild: int) -> dict:
+        return await self.database["roles"].find_one({"_id": guild}, {"_id": False}) or {}
+
+    async def set_role(self, guild: int, name: str, id: int) -> None:
+        await self.database["roles"].update_one({"_id": guild}, {"$set": {name: id}}, upsert=True)
+
+    async def unset_role(self, guild: int, name: str) -> None:
+        await self.database["roles"].update_one({"_id": guild}, {"$unset": {name: True}})
+
+    async def push_blame(self, guild: int, user: int, blamer: int, reason: str | None) -> int:
+        async def push(session=None) -> int:
+            # the counter goes first, without a transaction a failed insert leaves a blame counted but never listed
+            counter = await self.database["blame_counts"].find_one_and_update(
+                {"_id": {"guild": guild, "user": user}}, {"$inc": {"count": 1, "reasons": 1 if isinstance(reason, str) else 0}},
+                upsert=True, return_document=pymongo.ReturnDocument.AFTER, session=session
+            )
+            await self.database["blames"].insert_one({"guild": guild, "user": user, "blamer": blamer, "reason": reason}, session=session)
+            return counter["count"]
+
+        if not self.transactions:
+            return await push()
+        async with await self.database.client.start_session() as session:
+            return await session.with_transaction(push)
+
+    async def count_blames(self, guild: int, user: int) -> tuple[int, int]:
+        counter = await self.database["blame_counts"].find_one({"_id": {"guild": guild, "user": user}}) or {}
+        return counter.get("count", 0), counter.get("reasons", 0)
+
+    async def list_blames(self, guild: int, user: int, skip: int = 0, limit: int = 0) -> tuple[int, int, list[dict]]:
+        # the window is looked up alongside the counter, its match has no variables so it's answered straight off the partial blames index
+        documents = await self.database["blame_counts"].aggregate([
+            {"$match": {"_id": {"guild": guild, "user": user}}},
+            {"$lookup": {"from": "blames", "as": "blames", "pipeline": [
+                {"$match": {"guild": guild, "user": user, "reason": {"$type": "string"}}},
+                {"$sort": {"_id": pymongo.ASCENDING}},
+                {"$skip": skip},
+                *([{"$limit": limit}] if limit else []),
+                {"$project": {"_id": False, "blamer": True, "reason": True}}
+            ]}}
+        ]).to_list(1)
+        if not documents:
+            return 0, 0, []
+        return documents[0]["count"], documents[0]["reasons"], documents[0]["blames"]
+
+    async def push_question(self, guild: int, question: str, user: int) -> int:
+        counter = await self.database["qotd"].find_one_and_update(
+            {"_id": guild}, {"$inc": {"seq": 1}}, upsert=True, return_document=pymongo.ReturnDocument.AFTER
+        )
+        await self.database["qotd_questions"].insert_one({
+            "guild": guild, "id": counter["seq"], "state": "pending", "order": datetime.datetime.utcnow(), "question": question, "user": user
+        })
+        return counter["seq"]
+
+    async def get_questions(self, guild: int, state: str, skip: int = 0, limit: int = 0) -> tuple[int, list]:
+        questions, query = self.database["qotd_questions"], {"guild": guild, "state": state}
+        window = questions.find(query, {"_id": False, "guild": False}, sort=[("order", pymongo.ASCENDING), ("id", pymongo.ASCENDING)], skip=skip, limit=limit)
+        return await questions.count_documents(query), await window.to_list(None)
+
+    async def delete_question(self, guild: int, state: str, id: int) -> dict | None:
+        return await self.database["qotd_questions"].find_one_and_delete({"guild": guild, "state": state, "id": id}, {"_id": False, "guild": False})
+
+    async def accept_question(self, guild: int, id: int) -> dict | None:
+        return await self.database["qotd_questions"].find_one_and_update(
+            {"guild": guild, "state": "pending", "id": id}, [{"$set": {"state": "accepted", "order": "$$NOW"}}], {"_id": False, "guild": False}
+        )
+
+    async def pop_question(self, guild: int) -> dict | None:
+        return await self.database["qotd_questions"].find_one_and_delete(
+            {"guild": guild, "state": "accepted"}, {"_id": False, "guild": False}, sort=[("order", pymongo.ASCENDING), ("id", pymongo.ASCENDING)]
+        )
+
+    async def set_schedule(self, guild: int, cron: str, timezone: str, next_run: datetime.datetime) -> None:
+        await self.database["qotd"].update_one({"_id": guild}, {"$set": {"cron": cron, "timezone": timezone, "next_run": next_run}}, upsert=True)
+
+    async def clear_schedule(self, guild: int) -> None:
+        await self.database["qotd"].update_one({"_id": guild}, {"$unset": {"cron": True, "timezone": True, "next_run": True}})
+
+    async def due_schedules(self, now: datetime.datetime) -> list[dict]:
+        return await self.database["qotd"].find(
+            {"next_run": {"$lte": now}}, {"_id": False, "guild": "$_id", "next_run": True, "cron": True, "timezone": True}
+        ).to_list(None)
+
+    async def upcoming_schedule(self) -> datetime.datetime | None:
+        # bounded to dates so the scan stays within the sparse next_run index
+        document = await self.database["qotd"].find_one({"next_run": {"$type": "date"}}, {"next_run": True}, sort=[("next_run", pymongo.ASCENDING)])
+        return document["next_run"] if document else None
+
+    async def claim_schedule(self, guild: int, run: datetime.datetime, next_run: datetime.datetime) -> bool:
+        result = await self.database["qotd"].update_one({"_id": guild, "next_run": run}, {"$set": {"next_run": next_run, "last_run": run}})
+        return result.modified_count == 1
+
+    async def get_radio(self, guild: int) -> dict | None:
+        return next(iter(await self.database["radio"].aggregate([
+            {"$match": {"_id": guild}},
+            {"$lookup": {"from": "radio_tracks", "as": "tail", "pipeline": [
+                {"$match": {"guild": guild}},
+                {"$sort": {"position": pymongo.DESCENDING}},
+                {"$limit": 1}
+            ]}},
+            {"$project": {
+                "_id": False, "loop": {"$ifNull": ["$loop", None]}, "tail": {"$ifNull": [{"$first": "$tail.position"}, 0]}, "stats": {"$ifNull": ["$stats", None]}
+            }}
+        ]).to_list(1)), None)
+
+    async def set_loop(self, guild: int, loop: str) -> None:
+        await self.database["radio"].update_one({"_id": guild}, {"$set": {"loop": loop}}, upsert=True)
+
+    async def set_radio_stats(self, guild: int, stats: dict) -> None:
+        await self.database["radio"].update_one({"_id": guild}, {"$set": {"stats": stats}}, upsert=True)
+
+    async def add_radio_stats(self, guild: int, change: dict) -> None:
+        # an update pipeline rather than $inc, so users whose tracks are all gone are dropped like apply_stats does
+        users = {"$arrayToObject": [[
+            {"k": user, "v": {"$add": [{"$ifNull": [f"$stats.users.{user}", 0]}, count]}} for user, count in change["users"].items()
+        ]]}
+        await self.database["radio"].update_one({"_id": guild}, [{"$set": {"stats": {
+            **{key: {"$add": [{"$ifNull": [f"$stats.{key}", 0]}, change[key]]} for key in ("length", "count", "streams")},
+            "users": {"$arrayToObject": {"$filter": {
+                "input": {"$objectToArray": {"$mergeObjects": ["$stats.users", users]}}, "cond": {"$gt": ["$$this.v", 0]}
+            }}}
+        }}}], upsert=True)
+
+    def _find(self, guild: int, skip: int = 0, limit: int = 0):
+        return self.database["radio_tracks"].find({"guild": guild}, {"guild": False}, sort=[("position", pymongo.ASCENDING)], skip=skip, limit=limit)
+
+    async def get_tracks(self, guild: int, skip: int = 0, limit: int = 0) -> list[dict]:
+        return await self._find(guild, skip, limit).to_list(limit or None)
+
+    async def write_tracks(self, guild: int, inserted: list[dict] = [], updated: list[dict] = [], deleted: list = []) -> None:
+        operations = [
+            # upserted rather than inserted, a batch that is written again after failing part way mustn't trip over its own tracks
+            *(pymongo.ReplaceOne({"_id": track["_id"]}, {**track, "guild": guild}, upsert=True) for track in inserted),
+            *(pymongo.UpdateOne({"_id": track["_id"]}, {"$set": {"position": track["position"], "track": track.get("track")}}) for track in updated),
+            *(pymongo.DeleteOne({"_id": id}) for id in deleted),
+        ]
+        if operations:
+            await self.database["radio_tracks"].bulk_write(operations, ordered=False)
+
+    async def rotate_track(self, guild: int, position: float) -> dict | None:
+        return await self.database["radio_tracks"].find_one_and_update(
+            {"guild": guild}, {"$set": {"position": position}}, projection={"guild": False}, sort=[("position", pymongo.ASCENDING)]
+        )
+
+    async def pop_track(self, guild: int) -> dict | None:
+        return await self.database["radio_tracks"].find_one_and_delete(
+            {"guild": guild}, projection={"guild": False}, sort=[("position", pymongo.ASCENDING)]
+        )
+
+    async def clear_tracks(self, guild: int) -> None:
+        await self.database["radio_tracks"].delete_many({"guild": guild})
+
+    async def _merge(self, pipeline: list) -> None:
+        """Runs a pipeline whose output documents are written back onto radio_tracks, all in one round trip"""
+        await self.database["radio_tracks"].aggregate([
+            *pipeline,
+            # the pipeline reads radio_tracks off the position index while $merge moves tracks along it, streamed straight
+            # through a moved track could be read again and moved twice, so every output is collected before anything is written
+            {"$group": {"_id": None, "tracks": {"$push": "$$ROOT"}}},
+            {"$unwind": "$tracks"},
+            {"$replaceWith": "$tracks"},
+            {"$merge": {"into": "radio_tracks", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+        ]).to_list(None)
+
+    async def jump_tracks(self, guild: int, index: int, tail: float) -> None:
+        await self._merge([
+            {"$match": {"guild": guild}},
+            {"$sort": {"position": pymongo.ASCENDING}},
+            {"$limit": index},
+            {"$setWindowFields": {"sortBy": {"position": pymongo.ASCENDING}, "output": {"rank": {"$documentNumber": {}}}}},
+            {"$project": {"position": {"$add": [tail, "$rank"]}}}
+        ])
+
+    async def swap_tracks(self, guild: int, first: int, second: int) -> None:
+        def track_at(index: int) -> list:
+            return [
+                {"$match": {"guild": guild}},
+                {"$sort": {"position": pymongo.ASCENDING}},
+                {"$skip": index},
+                {"$limit": 1},
+                {"$project": {"position": True}}
+            ]
+
+        await self._merge([
+            *track_at(first),
+            {"$unionWith": {"coll": "radio_tracks", "pipeline": track_at(second)}},
+            {"$group": {"_id": None, "ids": {"$push": "$_id"}, "positions": {"$push": "$position"}}},
+            {"$match": {"ids.1": {"$exists": True}}},  # both indexes have to exist
+            {"$project": {"swapped": {"$zip": {"inputs": ["$ids", {"$reverseArray": "$positions"}]}}}},
+            {"$unwind": "$swapped"},
+            {"$replaceWith": {"_id": {"$first": "$swapped"}, "position": {"$last": "$swapped"}}}
+        ])
+
+    async def shuffle_tracks(self, guild: int, tail: float) -> None:
+        await self._merge([
+            {"$match": {"guild": guild}},
+            {"$project": {"position": {"$multiply": [{"$rand": {}}, tail]}}}
+        ])
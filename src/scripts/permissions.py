@@ -1,7 +1,7 @@
 import discord
 from discord import app_commands
 
-from scripts.database import ModuleDB, RoleDB
+from scripts.context import AtlasContext
 from utils.enums import Module, Roles
 
 class ModuleDisabled(app_commands.errors.AppCommandError):
@@ -21,16 +21,16 @@ class ChannelError(app_commands.errors.AppCommandError):
 class AtlasPermissions:
     @staticmethod
     def verify_channel(module: Module):
-        def predicate(interaction: discord.Interaction):
-            if (channel_id := ModuleDB(interaction.guild.id).get_config(module, "channel")) != interaction.channel.id:
+        async def predicate(interaction: discord.Interaction):
+            if (channel_id := (await AtlasContext.get(interaction)).get_config(module, "channel")) != interaction.channel.id:
                 raise ChannelError(channel_id=channel_id)
             return True
         return app_commands.check(predicate)
 
     @staticmethod
     def verify_level(role: Roles):
-        def predicate(interaction: discord.Interaction):
-            if not RoleDB(interaction.guild.id).permission_level(interaction.user) >= role.value:
+        async def predicate(interaction: discord.Interaction):
+            if not (await AtlasContext.get(interaction)).permission_level(interaction.user) >= role.value:
                 raise PermissionError
             return True
         return app_commands.check(predicate)
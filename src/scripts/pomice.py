@@ -1,23 +1,289 @@
+import aiohttp
+import asyncio
+import copy
+import logging
+import os
 import re
 import pomice
 
+from bson import ObjectId
+from collections import deque
 from enum import Enum
-from urllib.parse import quote
+from pomice.utils import ExponentialBackoff
+from urllib.parse import parse_qs, quote, urlencode, urlparse
+
+from scripts.cache import AtlasCache
+from scripts.queue import AtlasQueue
+
+logger = logging.getLogger(__name__)
+
+class AtlasPrefetcher:
+    """Resolves the next few queued tracks while the current one plays, so the next play() needs no lookups"""
+    depth = int(os.getenv("RADIO_PREFETCH_DEPTH", 3))
+    rate = float(os.getenv("RADIO_RESOLVE_RATE", 1))  # background resolutions per second past the prefetch depth
+    gaps: deque[float] = deque(maxlen=100)  # seconds between a track ending and the next one starting, across all players
+    hits = 0
+    misses = 0
+
+    def __init__(self, player: "AtlasPlayer") -> None:
+        self.player = player
+        self.buffer: dict[ObjectId, pomice.Track] = {}  # queue entry id -> playable track
+        self.unresolvable: set[ObjectId] = set()  # skipped by the background pass, playback still retries them
+        self._task: asyncio.Task | None = None
+
+    def invalidate(self) -> None:
+        """Retargets the buffer at whatever is next in the queue now, tracks already resolved are kept"""
+        if self._task is not None:
+            self._task.cancel()
+        self._task = asyncio.get_running_loop().create_task(self._fill())
+
+    async def _fill(self) -> None:
+        upcoming = await self.player.queue.playlist(AtlasPrefetcher.depth + 1)
+        ids = {entry["_id"] for entry in upcoming}
+        for id in [id for id in self.buffer if id not in ids]:
+            del self.buffer[id]
+        for entry in upcoming:
+            if entry["_id"] not in self.buffer:
+                try:
+                    self.buffer[entry["_id"]] = await self.player.resolve(entry)
+                except (pomice.exceptions.PomiceException, pomice.exceptions.NodeException, IndexError, TypeError):
+                    pass  # tried again when it comes up to play
+
+        # then whatever is still unresolved further down (e.g. an imported playlist), slowly enough not to flood lavalink
+        for entry in (await self.player.queue.playlist())[1]:
+            if entry.get("track") or entry["_id"] in self.unresolvable:
+                continue
+            await asyncio.sleep(1 / AtlasPrefetcher.rate)
+            try:
+                await self.player.resolve(entry)
+            except (pomice.exceptions.PomiceException, pomice.exceptions.NodeException, IndexError, TypeError):
+                self.unresolvable.add(entry["_id"])
+
+    async def get(self, entry: dict) -> pomice.Track:
+        if (track := self.buffer.get(entry["_id"])) is not None:
+            AtlasPrefetcher.hits += 1
+            return track
+        AtlasPrefetcher.misses += 1
+        self.buffer[entry["_id"]] = track = await self.player.resolve(entry)
+        return track
+
+    def discard(self, entry: dict) -> None:
+        self.buffer.pop(entry["_id"], None)
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self.buffer.clear()
+
+    @staticmethod
+    def hit_rate() -> float:
+        return AtlasPrefetcher.hits / total if (total := AtlasPrefetcher.hits + AtlasPrefetcher.misses) else 0.0
 
 class AtlasPlayer(pomice.Player):
     text_channel = None
-    message = None
+    message = None  # the control panel
+    messages_below = 0  # messages sent in text_channel after the control panel
+    panel_task: asyncio.Task | None = None  # pending control panel update
+    panel_stale = False  # the queue changed since the control panel was last updated
+    idle_timeout = float(os.getenv("RADIO_IDLE_TIMEOUT", 15))  # grace period before leaving an empty channel
+
+    def __init__(self, *args, **kwargs) -> None:
+        kwargs.setdefault("node", AtlasNodePool.get_node())  # pomice's own placement is random
+        super().__init__(*args, **kwargs)
+        self.queue = AtlasQueue(self.guild.id)  # source of truth for the radio queue while connected
+        self.prefetcher = AtlasPrefetcher(self)
+        self._idle: asyncio.TimerHandle | None = None  # pending disconnect while nobody is listening
+
+    @staticmethod
+    def build_track(entry: dict) -> pomice.Track:
+        """Rebuilds a playable track from the lavalink encoding stored with the queue entry"""
+        return pomice.Track(track_id=entry["track"], track_type=pomice.TrackType.HTTP, info={
+            "title": entry["title"],
+            "author": entry["author"],
+            "uri": entry["url"],
+            "length": entry["length"],
+            "isStream": not entry["length"]
+        })
+
+    async def resolve(self, entry: dict) -> pomice.Track:
+        """Turns a queue entry into a track lavalink can play straight away, remembering its encoding in the queue"""
+        if entry.get("track"):
+            return self.build_track(entry)
+
+        if "isrc" in entry:  # a playlist import placeholder, search for it directly rather than loading its source again
+            track = await self.match(entry["isrc"], entry["title"], entry["author"])
+        else:
+            track = (await self.get_tracks(query=entry["url"]))[0]
+            if track.original is None:  # spotify/apple music
+                track.original = await self.match(track.isrc, track.title, track.author)
+                track.track_id = track.original.track_id
+        await self.queue.set_track(entry["_id"], track.track_id)
+        return track
+
+    async def match(self, isrc: str | None, title: str, author: str) -> pomice.Track:
+        """Finds the playable equivalent of a spotify/apple music track the same way pomice's play() would"""
+        if isrc:
+            try:
+                return (await self.get_tracks(f"{pomice.SearchType.ytsearch}:{isrc}"))[0]
+            except (pomice.exceptions.PomiceException, IndexError, TypeError):
+                pass
+        return (await self.get_tracks(f"{pomice.SearchType.ytsearch}:{title} - {author}"))[0]
+
+    async def migrate(self, node: "AtlasNode") -> None:
+        """Moves the player onto another node, carrying over the track, its position, the volume and whether it's paused"""
+        if node._session_id is None:
+            raise pomice.exceptions.NodeNotAvailable(f"The node '{node._identifier}' has no session yet.")
+        self._node._players.pop(self.guild.id, None)
+        self._node = node
+        node._players[self.guild.id] = self
+        self._player_endpoint_uri = f"sessions/{node._session_id}/players"
+
+        await self._dispatch_voice_update()
+        data = {"volume": self.volume, "paused": self.is_paused}
+        if self.current:
+            data.update(encodedTrack=self.current.track_id, position=int(self.position))
+        await node.send(method="PATCH", path=self._player_endpoint_uri, guild_id=self.guild.id, data=data)
+
+    @property
+    def idle(self) -> bool:
+        return self._idle is not None
+
+    def update_idle(self) -> None:
+        """Starts the disconnect timer once the last listener leaves the channel, stops it when someone comes back"""
+        listening = self.channel is not None and any(not member.bot for member in self.channel.members)
+        if not listening and self._idle is None:
+            self._idle = asyncio.get_running_loop().call_later(AtlasPlayer.idle_timeout, lambda: asyncio.ensure_future(self.destroy()))
+        elif listening and self._idle is not None:
+            self._idle.cancel()
+            self._idle = None
 
     async def destroy(self) -> None:
+        if self._idle is not None:
+            self._idle.cancel()
+            self._idle = None
         self.text_channel = None
         self.message = None
-        return await super().destroy()
+        self.prefetcher.close()
+        try:
+            await self.queue.flush()
+        finally:
+            await super().destroy()
 
 class TrackType(Enum):
     TWITCH = "twitch_track"
 
 class AtlasNode(pomice.Node):
+    max_load = float(os.getenv("LAVALINK_MAX_LOAD", 0.9))  # system cpu load past which players are moved elsewhere
+    frame_deficit = 0  # frames missing from the last minute of audio across the node's players
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._stats = None  # pomice only sets it once the node sends its first stats
+
+    @property
+    def penalty(self) -> float:
+        """How loaded the node is, lower is better (the same weighting as lavalink's own clients)"""
+        players = len(self._players)
+        if (stats := self._stats) is None:
+            return players
+        cpu = 1.05 ** (100 * (stats.cpu_system_load or 0)) * 10 - 10
+        deficit = 1.03 ** (500 * self.frame_deficit / 3000) * 300 - 300 if self.frame_deficit > 0 else 0
+        return max(players, stats.players_active or 0) + cpu + deficit
+
+    @property
+    def overloaded(self) -> bool:
+        return self._stats is not None and (self._stats.cpu_system_load or 0) > AtlasNode.max_load
+
+    async def _handle_payload(self, data: dict) -> None:
+        if data.get("op") == "stats":
+            self.frame_deficit = (data.get("frameStats") or {}).get("deficit", 0)
+        await super()._handle_payload(data)
+
+    async def _listen(self) -> None:
+        # pomice's own loop only expects CLOSED and CLOSING, the close frame lavalink sends on shutdown ended it for good
+        backoff = ExponentialBackoff(base=7)
+        while True:
+            msg = await self._websocket.receive()
+            if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                if self._fallback:
+                    await self._handle_node_switch()
+                await asyncio.sleep(backoff.delay())
+                if not self.is_connected:
+                    self._loop.create_task(self.connect())
+            else:
+                self._loop.create_task(self._handle_payload(msg.json()))
+
+    async def _handle_node_switch(self) -> None:
+        # called by _listen when the websocket drops, which then keeps reconnecting to it in the background
+        self._available = False
+        for player in list(self._players.values()):
+            try:
+                await player.migrate(AtlasNodePool.get_node())
+            except pomice.NoNodesAvailable:
+                return
+            except Exception:  # one player failing to move mustn't strand the rest, or end pomice's reconnect loop
+                logger.exception(f"failed to move the player of {player.guild.id} off node {self._identifier}")
+
+    # resolved queries shared by every guild, keyed by the normalized query
+    tracks = AtlasCache("tracks", maxsize=int(os.getenv("TRACK_CACHE_SIZE", 5000)), path=os.getenv("TRACK_CACHE_PATH"))
+    ttls = {
+        "stream": 60,  # live streams go offline
+        "video": 86400,  # a video id always resolves to the same video
+        "playlist": 3600,  # playlists and albums get edited
+        "search": 3600,
+        "not_found": 300,
+    }
+    tracking_parameters = {"si", "feature", "pp", "ab_channel", "context"}
+
+    @staticmethod
+    def cache_key(query: str, search_type: pomice.SearchType) -> str:
+        url = urlparse(query.strip())
+        if url.scheme not in ("http", "https"):
+            return f"{search_type}:{' '.join(query.lower().split())}"
+
+        host = url.netloc.lower().removeprefix("www.").removeprefix("m.")
+        parameters = {key: value for key, value in parse_qs(url.query).items() if key not in AtlasNode.tracking_parameters and not key.startswith("utm_")}
+        if host in ("youtube.com", "music.youtube.com") and url.path == "/watch" and "v" in parameters and "list" not in parameters:
+            return f"youtube:{parameters['v'][0]}"
+        if host == "youtu.be" and "list" not in parameters:
+            return f"youtube:{url.path.strip('/')}"
+        return f"{host}{url.path.rstrip('/')}" + (f"?{urlencode(sorted(parameters.items()), doseq=True)}" if parameters else "")
+
     async def get_tracks(self, query: str, *, ctx = None, search_type = pomice.SearchType.ytsearch, filters = None):
+        if ctx is not None or filters is not None:  # tracks carrying a context or filters are specific to one request
+            return await self._get_tracks(query, ctx=ctx, search_type=search_type, filters=filters)
+
+        key = AtlasNode.cache_key(query, search_type)
+        if (result := AtlasNode.tracks.get(key)) is not None:
+            return None if result is False else AtlasNode.copy_tracks(result)
+
+        result = await self._get_tracks(query, search_type=search_type)
+        if not result:
+            AtlasNode.tracks.set(key, False, AtlasNode.ttls["not_found"])
+        elif isinstance(result, pomice.Playlist):
+            AtlasNode.tracks.set(key, result, AtlasNode.ttls["playlist"])
+        elif any(track.is_stream for track in result):
+            AtlasNode.tracks.set(key, result, AtlasNode.ttls["stream"])
+        else:
+            AtlasNode.tracks.set(key, result, AtlasNode.ttls["video" if key.startswith("youtube:") else "search"])
+        return AtlasNode.copy_tracks(result)
+
+    @staticmethod
+    def copy_tracks(result: list[pomice.Track] | pomice.Playlist) -> list[pomice.Track] | pomice.Playlist:
+        """Copies a cached result down to its tracks, players set the original and encoding on the tracks they resolve"""
+        if not isinstance(result, pomice.Playlist):
+            return [copy.copy(track) for track in result]
+
+        playlist = copy.copy(result)
+        playlist.tracks = []
+        for track in result.tracks:
+            playlist.tracks.append(copied := copy.copy(track))
+            copied.playlist = playlist
+            if track is result.selected_track:
+                playlist.selected_track = copied
+        return playlist
+
+    async def _get_tracks(self, query: str, *, ctx = None, search_type = pomice.SearchType.ytsearch, filters = None):
         if re.match("^https://(|www\.|go\.)twitch.tv/([^/]+)$", query):
             data: dict = await self.send(method="GET", path="loadtracks", query=f"identifier={quote(query)}")
 
@@ -49,6 +315,39 @@ class AtlasNode(pomice.Node):
         return await super().get_tracks(query, ctx=ctx, search_type=search_type, filters=filters)
 
 class AtlasNodePool(pomice.NodePool):
+    @staticmethod
+    def config() -> list[tuple[str, str, int]]:
+        """The (identifier, host, port) of every node in LAVALINK_NODES, a comma separated list of [identifier@]host:port"""
+        nodes = []
+        for i, node in enumerate(os.getenv("LAVALINK_NODES", "MAIN@lavalink:2333").split(","), start=1):
+            identifier, _, address = node.strip().rpartition("@")
+            host, _, port = address.rpartition(":")
+            nodes.append((identifier or f"NODE{i}", host, int(port)))
+        return nodes
+
+    @classmethod
+    def get_node(cls, *, identifier: str = None) -> AtlasNode:
+        """Fetches a node by its identifier, or the least loaded node"""
+        if identifier is not None:
+            return super().get_node(identifier=identifier)
+        if not (nodes := [node for node in cls._nodes.values() if node._available]):
+            raise pomice.NoNodesAvailable("There are no nodes available.")
+        return min(nodes, key=lambda node: node.penalty)
+
+    @classmethod
+    async def balance(cls) -> None:
+        """Moves a player off every overloaded node onto the least loaded node, if that one isn't overloaded as well"""
+        for node in list(cls._nodes.values()):
+            if not (node._available and node.overloaded and node._players):
+                continue
+            target = cls.get_node()
+            if target is node or target.overloaded:
+                continue
+            try:
+                await next(iter(node._players.values())).migrate(target)
+            except Exception:
+                logger.exception(f"failed to move a player off node {node._identifier}")  # tried again on the next round
+
     @classmethod
     async def create_node(cls, *, bot, host: str, port: str, password: str, identifier: str, secure: bool = False, heartbeat: int = 30, spotify_client_id = None, spotify_client_secret = None, session = None, apple_music: bool = False):
         if identifier in cls._nodes.keys():
@@ -59,7 +358,7 @@ class AtlasNodePool(pomice.NodePool):
             identifier=identifier, secure=secure, heartbeat=heartbeat,
             spotify_client_id=spotify_client_id,
             session=session, spotify_client_secret=spotify_client_secret,
-            apple_music=apple_music
+            apple_music=apple_music, fallback=True
         )
 
         await node.connect()
@@ -0,0 +1,224 @@
+import asyncio
+import copy
+import logging
+import os
+import random
+from bson import ObjectId
+
+from scripts.database import RadioDB
+from scripts.storage import AtlasStorage
+
+logger = logging.getLogger(__name__)
+
+
+class AtlasQueue:
+    """In-memory radio queue of a connected player, changes are written back to RadioDB in coalesced batches"""
+    flush_interval = float(os.getenv("RADIO_FLUSH_INTERVAL", 5))
+
+    def __init__(self, guild: int) -> None:
+        self.guild = guild
+        self.db = RadioDB(guild)
+        self.tracks: list[dict] | None = None  # loaded on first use
+        self.totals = AtlasStorage.tally_stats([])  # the queue stats, kept in step with tracks
+
+        # changes not yet persisted
+        self._cleared = False
+        self._inserted: dict[ObjectId, dict] = {}
+        self._changed: set[ObjectId] = set()
+        self._deleted: set[ObjectId] = set()
+        self._stale = False  # stats not yet written back
+
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+
+    async def _load(self) -> list[dict]:
+        if self.tracks is None:
+            tracks = (await self.db.playlist())[1]
+            if self.tracks is None:  # another coroutine may have loaded it while we were waiting
+                self.tracks = tracks
+                self.totals = AtlasStorage.tally_stats(tracks)
+        return self.tracks
+
+    def _schedule(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        while True:
+            await asyncio.sleep(AtlasQueue.flush_interval)
+            try:
+                return await self.flush()
+            except Exception:
+                logger.exception(f"failed to write back the radio queue of {self.guild}, retrying")
+
+    def _change(self, entry: dict, **fields) -> None:
+        entry.update(fields)
+        if entry["_id"] not in self._inserted:
+            self._changed.add(entry["_id"])
+
+    def _move(self, track: dict, position: float) -> None:
+        self._change(track, position=position)
+
+    def _delete(self, track: dict) -> None:
+        if self._inserted.pop(track["_id"], None) is None:
+            self._changed.discard(track["_id"])
+            self._deleted.add(track["_id"])
+
+    async def flush(self) -> None:
+        """Writes every pending change to the database, whatever fails to be written stays pending"""
+        async with self._lock:
+            cleared, self._cleared = self._cleared, False
+            inserted, self._inserted = self._inserted, {}
+            changed, self._changed = self._changed, set()
+            deleted, self._deleted = self._deleted, set()
+            stale, self._stale = self._stale or cleared or bool(inserted) or bool(deleted), False
+
+            try:
+                if cleared:
+                    await self.db.clear()
+                    cleared = False
+
+                updated = [track for track in self.tracks or [] if track["_id"] in changed]
+                if inserted or updated or deleted:
+                    await self.db.write(list(inserted.values()), updated, list(deleted))
+                    inserted, changed, deleted = {}, set(), set()
+                if stale:
+                    await self.db._set_stats(self.totals)
+            except BaseException:
+                self._restore(cleared, inserted, changed, deleted, stale)
+                raise
+
+    def _restore(self, cleared: bool, inserted: dict[ObjectId, dict], changed: set[ObjectId], deleted: set[ObjectId], stale: bool) -> None:
+        """Puts the unwritten part of a batch back under the changes made since it was taken"""
+        self._stale = self._stale or stale
+        if self._cleared:  # cleared again since, nothing in the batch is left to write
+            return
+        self._cleared = cleared
+
+        # tracks removed since they were taken were never written, so there is nothing to delete either
+        self._inserted = {id: track for id, track in inserted.items() if id not in self._deleted} | self._inserted
+        self._deleted -= inserted.keys()
+        self._changed -= inserted.keys()
+        self._changed |= changed - self._deleted
+        self._deleted |= deleted
+
+    async def playlist(self, limit: int = None) -> tuple[int, list] | list:
+        tracks = await self._load()
+        if limit:
+            return tracks[:limit]
+        return len(tracks), list(tracks)
+
+    async def page(self, skip: int, limit: int) -> tuple[int, list]:
+        tracks = await self._load()
+        return len(tracks), tracks[skip:skip + limit if limit else None]
+
+    async def stats(self) -> dict:
+        await self._load()
+        return copy.deepcopy(self.totals)
+
+    async def playlist_length(self) -> int:
+        await self._load()
+        return self.totals["length"]
+
+    async def push(self, tracks: list[dict]) -> int:
+        queue = await self._load()
+        tail = await self.db._reserve(len(tracks))
+        for i, track in enumerate(tracks, start=1):
+            track = {**track, "_id": ObjectId(), "position": tail + i}
+            self._inserted[track["_id"]] = track
+            queue.append(track)
+        AtlasStorage.apply_stats(self.totals, AtlasStorage.tally_stats(tracks))
+        self._schedule()
+        return len(queue)
+
+    async def position(self) -> int:
+        return len(await self._load())
+
+    async def remove(self, index: int) -> dict | None:
+        tracks = await self._load()
+        if abs(index) >= len(tracks):
+            return None
+        track = tracks.pop(abs(index))
+        self._delete(track)
+        AtlasStorage.apply_stats(self.totals, AtlasStorage.tally_stats([track], -1))
+        self._schedule()
+        return track
+
+    async def update(self) -> dict | None:
+        """Advances the queue past the current track according to the loop type, returns the track that finished"""
+        tracks = await self._load()
+        match await self.db.get_loop():
+            case "playlist_repeat":
+                position = await self.db._reserve(1) + 1
+                if not tracks:
+                    return None
+                track = tracks.pop(0)
+                self._move(track, position)
+                tracks.append(track)
+            case "track_repeat":
+                return None
+            case "no_repeat":
+                if not tracks:
+                    return None
+                track = tracks.pop(0)
+                self._delete(track)
+                AtlasStorage.apply_stats(self.totals, AtlasStorage.tally_stats([track], -1))
+        self._schedule()
+        return track
+
+    async def set_track(self, id: ObjectId, encoded: str | None) -> None:
+        """Stores the lavalink encoding of a queued track so it can be played again without being resolved"""
+        track = next((track for track in await self._load() if track["_id"] == id), None)
+        if track is not None and encoded and track.get("track") != encoded:
+            self._change(track, track=encoded)
+            self._schedule()
+
+    async def clear(self) -> None:
+        await self._load()
+        self.tracks = []
+        self.totals = AtlasStorage.tally_stats([])
+        self._cleared = True
+        self._inserted.clear()
+        self._changed.clear()
+        self._deleted.clear()
+        self._schedule()
+
+    async def jump(self, index: int) -> None:
+        if index <= 0:
+            return
+        tracks = await self._load()
+        tail = await self.db._reserve(index)
+        skipped = tracks[:index]
+        del tracks[:index]
+        for i, track in enumerate(skipped, start=1):
+            self._move(track, tail + i)
+        tracks.extend(skipped)
+        self._schedule()
+
+    async def swap(self, first: int, second: int) -> None:
+        tracks = await self._load()
+        if not (0 <= first < len(tracks) and 0 <= second < len(tracks)):
+            return
+        track1, track2 = tracks[first], tracks[second]
+        tracks[first], tracks[second] = track2, track1
+        position1, position2 = track1["position"], track2["position"]
+        self._move(track1, position2)
+        self._move(track2, position1)
+        self._schedule()
+
+    async def shuffle(self) -> None:
+        tracks = await self._load()
+        positions = sorted(track["position"] for track in tracks)
+        random.shuffle(tracks)
+        for track, position in zip(tracks, positions):
+            self._move(track, position)
+        self._schedule()
+
+    async def get_loop(self) -> str:
+        return await self.db.get_loop()
+
+    async def set_loop(self, loop_type: str) -> None:
+        await self.db.set_loop(loop_type)
+
+    async def cycle_loop(self) -> str:
+        return await self.db.cycle_loop()
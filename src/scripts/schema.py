@@ -0,0 +1,46 @@
+import pymongo
+from pymongo import IndexModel
+
+from scripts.storage import AtlasStorage
+
+# every mongo collection and the indexes its queries rely on, besides _id
+COLLECTIONS: dict[str, list[IndexModel]] = {
+    # multikey, lets a module's guilds be found without unwinding every guild's modules
+    "modules": [IndexModel("modules.name")],
+    "roles": [],
+    "blame_counts": [],
+    # only blames with a reason are ever listed, the rest just count towards the total
+    "blames": [IndexModel(
+        [("guild", pymongo.ASCENDING), ("user", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        partialFilterExpression={"reason": {"$type": "string"}}
+    )],
+    "qotd": [IndexModel("next_run", sparse=True)],
+    "qotd_questions": [
+        IndexModel([("guild", pymongo.ASCENDING), ("state", pymongo.ASCENDING), ("order", pymongo.ASCENDING), ("id", pymongo.ASCENDING)]),
+        IndexModel([("guild", pymongo.ASCENDING), ("id", pymongo.ASCENDING)], unique=True)
+    ],
+    "radio": [],
+    "radio_tracks": [IndexModel([("guild", pymongo.ASCENDING), ("position", pymongo.ASCENDING)])],
+}
+
+# the same layout as sqlite tables, times are stored as microseconds since the epoch and dicts as json
+TABLES: list[str] = [
+    "CREATE TABLE IF NOT EXISTS modules (guild INTEGER NOT NULL, name TEXT NOT NULL, config TEXT NOT NULL, PRIMARY KEY (guild, name)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS modules_name ON modules (name)",
+    "CREATE TABLE IF NOT EXISTS roles (guild INTEGER NOT NULL, name TEXT NOT NULL, role INTEGER NOT NULL, PRIMARY KEY (guild, name)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS blame_counts (guild INTEGER NOT NULL, user INTEGER NOT NULL, count INTEGER NOT NULL, reasons INTEGER NOT NULL, PRIMARY KEY (guild, user)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS blames (id INTEGER PRIMARY KEY, guild INTEGER NOT NULL, user INTEGER NOT NULL, blamer INTEGER, reason TEXT)",
+    "CREATE INDEX IF NOT EXISTS blames_reasons ON blames (guild, user, id) WHERE reason IS NOT NULL",
+    "CREATE TABLE IF NOT EXISTS qotd (guild INTEGER PRIMARY KEY, seq INTEGER NOT NULL DEFAULT 0, cron TEXT, timezone TEXT, next_run INTEGER, last_run INTEGER)",
+    "CREATE INDEX IF NOT EXISTS qotd_next_run ON qotd (next_run) WHERE next_run IS NOT NULL",
+    'CREATE TABLE IF NOT EXISTS qotd_questions (guild INTEGER NOT NULL, id INTEGER NOT NULL, state TEXT NOT NULL, "order" INTEGER NOT NULL, question TEXT NOT NULL, user INTEGER NOT NULL, PRIMARY KEY (guild, id)) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS qotd_questions_order ON qotd_questions (guild, state, "order", id)',
+    "CREATE TABLE IF NOT EXISTS radio (guild INTEGER PRIMARY KEY, loop TEXT, stats TEXT)",
+    "CREATE TABLE IF NOT EXISTS radio_tracks (id TEXT PRIMARY KEY, guild INTEGER NOT NULL, position REAL NOT NULL, data TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS radio_tracks_position ON radio_tracks (guild, position)",
+]
+
+
+async def bootstrap() -> None:
+    """Creates any missing collection, table and index of the configured backend, run once at startup before anything touches the database"""
+    await AtlasStorage.get().bootstrap()
@@ -0,0 +1,277 @@
+import asyncio
+import datetime
+import json
+import sqlite3
+from bson import ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from scripts.storage import AtlasStorage
+
+T = TypeVar("T")
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _time(value: datetime.datetime | None) -> int | None:
+    # integer microseconds, so a time read back compares equal to the stored one
+    return None if value is None else (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _datetime(value: int | None) -> datetime.datetime | None:
+    return None if value is None else EPOCH + datetime.timedelta(microseconds=value)
+
+
+class SQLiteStorage(AtlasStorage):
+    """Keeps everything in a single sqlite file in WAL mode, for single box deployments that don't want to run mongo"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # sqlite connections aren't meant to be shared across threads, every statement runs on this one
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._connection: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # statements are kept prepared in the connection's statement cache, keyed by their sql
+            self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=256)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+            self._connection.execute("PRAGMA busy_timeout = 5000")
+        return self._connection
+
+    async def _run(self, function: Callable[[sqlite3.Connection], T], write: bool = False) -> T:
+        """Runs the function off the event loop, writes in a transaction of their own"""
+        def run() -> T:
+            connection = self._connect()
+            if not write:
+                return function(connection)
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = function(connection)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return result
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    async def _execute(self, sql: str, parameters: tuple = ()) -> int:
+        return await self._run(lambda connection: connection.execute(sql, parameters).rowcount, write=True)
+
+    async def _fetchall(self, sql: str, parameters: tuple = ()) -> list[sqlite3.Row]:
+        return await self._run(lambda connection: connection.execute(sql, parameters).fetchall())
+
+    async def _fetchone(self, sql: str, parameters: tuple = ()) -> sqlite3.Row | None:
+        return await self._run(lambda connection: connection.execute(sql, parameters).fetchone())
+
+    async def bootstrap(self) -> None:
+        from scripts.schema import TABLES
+
+        def create(connection: sqlite3.Connection) -> None:
+            for statement in TABLES:
+                connection.execute(statement)
+        await self._run(create, write=True)
+
+    async def disconnect(self) -> None:
+        def close() -> None:
+            if self._connection is not None:
+                self._connection.execute("PRAGMA optimize")
+                self._connection.close()
+                self._connection = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, close)
+        self._executor.shutdown()
+
+    async def get_modules(self, guild: int) -> dict:
+        return {row["name"]: json.loads(row["config"]) for row in await self._fetchall("SELECT name, config FROM modules WHERE guild = ?", (guild,))}
+
+    async def set_module(self, guild: int, name: str, config: dict) -> None:
+        await self._execute(
+            "INSERT INTO modules (guild, name, config) VALUES (?, ?, ?) ON CONFLICT (guild, name) DO UPDATE SET config = excluded.config",
+            (guild, name, json.dumps(config))
+        )
+
+    async def unset_module(self, guild: int, name: str) -> None:
+        await self._execute("DELETE FROM modules WHERE guild = ? AND name = ?", (guild, name))
+
+    async def guilds_with_module(self, name: str) -> list[dict]:
+        return [{"guild": row["guild"], "config": json.loads(row["config"])} for row in await self._fetchall("SELECT guild, config FROM modules WHERE name = ?", (name,))]
+
+    async def get_settings(self, guild: int) -> tuple[dict, dict]:
+        def read(connection: sqlite3.Connection) -> tuple[dict, dict]:
+            modules = connection.execute("SELECT name, config FROM modules WHERE guild = ?", (guild,)).fetchall()
+            roles = connection.execute("SELECT name, role FROM roles WHERE guild = ?", (guild,)).fetchall()
+            return {row["name"]: json.loads(row["config"]) for row in modules}, {row["name"]: row["role"] for row in roles}
+        return await self._run(read)
+
+    async def get_roles(self, guild: int) -> dict:
+        return {row["name"]: row["role"] for row in await self._fetchall("SELECT name, role FROM roles WHERE guild = ?", (guild,))}
+
+    async def set_role(self, guild: int, name: str, id: int) -> None:
+        await self._execute("INSERT INTO roles (guild, name, role) VALUES (?, ?, ?) ON CONFLICT (guild, name) DO UPDATE SET role = excluded.role", (guild, name, id))
+
+    async def unset_role(self, guild: int, name: str) -> None:
+        await self._execute("DELETE FROM roles WHERE guild = ? AND name = ?", (guild, name))
+
+    async def push_blame(self, guild: int, user: int, blamer: int, reason: str | None) -> int:
+        reason = reason if isinstance(reason, str) else None
+
+        def push(connection: sqlite3.Connection) -> int:
+            connection.execute("INSERT INTO blames (guild, user, blamer, reason) VALUES (?, ?, ?, ?)", (guild, user, blamer, reason))
+            return connection.execute(
+                "INSERT INTO blame_counts (guild, user, count, reasons) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (guild, user) DO UPDATE SET count = count + 1, reasons = reasons + excluded.reasons RETURNING count",
+                (guild, user, int(reason is not None))
+            ).fetchone()["count"]
+        return await self._run(push, write=True)
+
+    async def count_blames(self, guild: int, user: int) -> tuple[int, int]:
+        row = await self._fetchone("SELECT count, reasons FROM blame_counts WHERE guild = ? AND user = ?", (guild, user))
+        return (row["count"], row["reasons"]) if row else (0, 0)
+
+    async def list_blames(self, guild: int, user: int, skip: int = 0, limit: int = 0) -> tuple[int, int, list[dict]]:
+        # the counter joined with the window, a counter without blames in the window comes back as a single row of nulls
+        rows = await self._fetchall(
+            "SELECT blame_counts.count, blame_counts.reasons, page.blamer, page.reason FROM blame_counts LEFT JOIN ("
+            "SELECT id, blamer, reason FROM blames WHERE guild = ? AND user = ? AND reason IS NOT NULL ORDER BY id LIMIT ? OFFSET ?"
+            ") AS page WHERE blame_counts.guild = ? AND blame_counts.user = ? ORDER BY page.id",
+            (guild, user, limit or -1, skip, guild, user)
+        )
+        if not rows:
+            return 0, 0, []
+        return rows[0]["count"], rows[0]["reasons"], [{"blamer": row["blamer"], "reason": row["reason"]} for row in rows if row["reason"] is not None]
+
+    @staticmethod
+    def _question(row: sqlite3.Row | None) -> dict | None:
+        return None if row is None else {**dict(row), "order": _datetime(row["order"])}
+
+    async def push_question(self, guild: int, question: str, user: int) -> int:
+        def push(connection: sqlite3.Connection) -> int:
+            id = connection.execute(
+                "INSERT INTO qotd (guild, seq) VALUES (?, 1) ON CONFLICT (guild) DO UPDATE SET seq = seq + 1 RETURNING seq", (guild,)
+            ).fetchone()["seq"]
+            connection.execute(
+                'INSERT INTO qotd_questions (guild, id, state, "order", question, user) VALUES (?, ?, \'pending\', ?, ?, ?)',
+                (guild, id, _time(datetime.datetime.utcnow()), question, user)
+            )
+            return id
+        return await self._run(push, write=True)
+
+    async def get_questions(self, guild: int, state: str, skip: int = 0, limit: int = 0) -> tuple[int, list]:
+        def read(connection: sqlite3.Connection) -> tuple[int, list]:
+            count = connection.execute("SELECT COUNT(*) FROM qotd_questions WHERE guild = ? AND state = ?", (guild, state)).fetchone()[0]
+            rows = connection.execute(
+                'SELECT id, state, "order", question, user FROM qotd_questions WHERE guild = ? AND state = ? ORDER BY "order", id LIMIT ? OFFSET ?',
+                (guild, state, limit or -1, skip)
+            ).fetchall()
+            return count, [self._question(row) for row in rows]
+        return await self._run(read)
+
+    async def delete_question(self, guild: int, state: str, id: int) -> dict | None:
+        return self._question(await self._run(lambda connection: connection.execute(
+            'DELETE FROM qotd_questions WHERE guild = ? AND state = ? AND id = ? RETURNING id, state, "order", question, user', (guild, state, id)
+        ).fetchone(), write=True))
+
+    async def accept_question(self, guild: int, id: int) -> dict | None:
+        def accept(connection: sqlite3.Connection) -> sqlite3.Row | None:
+            row = connection.execute(
+                'SELECT id, state, "order", question, user FROM qotd_questions WHERE guild = ? AND state = \'pending\' AND id = ?', (guild, id)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE qotd_questions SET state = \'accepted\', "order" = ? WHERE guild = ? AND id = ?', (_time(datetime.datetime.utcnow()), guild, id)
+                )
+            return row
+        return self._question(await self._run(accept, write=True))
+
+    async def pop_question(self, guild: int) -> dict | None:
+        return self._question(await self._run(lambda connection: connection.execute(
+            'DELETE FROM qotd_questions WHERE guild = ? AND id = (SELECT id FROM qotd_questions WHERE guild = ? AND state = \'accepted\' ORDER BY "order", id LIMIT 1) '
+            'RETURNING id, state, "order", question, user', (guild, guild)
+        ).fetchone(), write=True))
+
+    async def set_schedule(self, guild: int, cron: str, timezone: str, next_run: datetime.datetime) -> None:
+        await self._execute(
+            "INSERT INTO qotd (guild, cron, timezone, next_run) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (guild) DO UPDATE SET cron = excluded.cron, timezone = excluded.timezone, next_run = excluded.next_run",
+            (guild, cron, timezone, _time(next_run))
+        )
+
+    async def clear_schedule(self, guild: int) -> None:
+        await self._execute("UPDATE qotd SET cron = NULL, timezone = NULL, next_run = NULL WHERE guild = ?", (guild,))
+
+    async def due_schedules(self, now: datetime.datetime) -> list[dict]:
+        rows = await self._fetchall("SELECT guild, cron, timezone, next_run FROM qotd WHERE next_run <= ?", (_time(now),))
+        return [{**dict(row), "next_run": _datetime(row["next_run"])} for row in rows]
+
+    async def upcoming_schedule(self) -> datetime.datetime | None:
+        return _datetime((await self._fetchone("SELECT MIN(next_run) FROM qotd WHERE next_run IS NOT NULL"))[0])
+
+    async def claim_schedule(self, guild: int, run: datetime.datetime, next_run: datetime.datetime) -> bool:
+        return await self._execute(
+            "UPDATE qotd SET next_run = ?, last_run = ? WHERE guild = ? AND next_run = ?", (_time(next_run), _time(run), guild, _time(run))
+        ) == 1
+
+    async def get_radio(self, guild: int) -> dict | None:
+        def read(connection: sqlite3.Connection) -> dict | None:
+            if (row := connection.execute("SELECT loop, stats FROM radio WHERE guild = ?", (guild,)).fetchone()) is None:
+                return None
+            tail = connection.execute("SELECT MAX(position) FROM radio_tracks WHERE guild = ?", (guild,)).fetchone()[0]
+            return {"loop": row["loop"], "tail": tail or 0, "stats": json.loads(row["stats"]) if row["stats"] else None}
+        return await self._run(read)
+
+    async def set_loop(self, guild: int, loop: str) -> None:
+        await self._execute("INSERT INTO radio (guild, loop) VALUES (?, ?) ON CONFLICT (guild) DO UPDATE SET loop = excluded.loop", (guild, loop))
+
+    async def set_radio_stats(self, guild: int, stats: dict) -> None:
+        await self._execute("INSERT INTO radio (guild, stats) VALUES (?, ?) ON CONFLICT (guild) DO UPDATE SET stats = excluded.stats", (guild, json.dumps(stats)))
+
+    async def add_radio_stats(self, guild: int, change: dict) -> None:
+        def add(connection: sqlite3.Connection) -> None:
+            row = connection.execute("SELECT stats FROM radio WHERE guild = ?", (guild,)).fetchone()
+            stats = json.loads(row["stats"]) if row and row["stats"] else AtlasStorage.tally_stats([])
+            AtlasStorage.apply_stats(stats, change)
+            connection.execute("INSERT INTO radio (guild, stats) VALUES (?, ?) ON CONFLICT (guild) DO UPDATE SET stats = excluded.stats", (guild, json.dumps(stats)))
+        await self._run(add, write=True)
+
+    @staticmethod
+    def _track(row: sqlite3.Row | None) -> dict | None:
+        return None if row is None else {**json.loads(row["data"]), "_id": ObjectId(row["id"]), "position": row["position"]}
+
+    @staticmethod
+    def _row(guild: int, track: dict) -> tuple:
+        return str(track["_id"]), guild, track["position"], json.dumps({key: value for key, value in track.items() if key not in ("_id", "position")})
+
+    async def get_tracks(self, guild: int, skip: int = 0, limit: int = 0) -> list[dict]:
+        rows = await self._fetchall("SELECT id, position, data FROM radio_tracks WHERE guild = ? ORDER BY position LIMIT ? OFFSET ?", (guild, limit or -1, skip))
+        return [self._track(row) for row in rows]
+
+    async def write_tracks(self, guild: int, inserted: list[dict] = [], updated: list[dict] = [], deleted: list = []) -> None:
+        def write(connection: sqlite3.Connection) -> None:
+            connection.executemany("INSERT INTO radio_tracks (id, guild, position, data) VALUES (?, ?, ?, ?)", [self._row(guild, track) for track in inserted])
+            connection.executemany(
+                "UPDATE radio_tracks SET position = ?, data = json_set(data, '$.track', json(?)) WHERE id = ?",
+                [(track["position"], json.dumps(track.get("track")), str(track["_id"])) for track in updated]
+            )
+            connection.executemany("DELETE FROM radio_tracks WHERE id = ?", [(str(id),) for id in deleted])
+        await self._run(write, write=True)
+
+    async def rotate_track(self, guild: int, position: float) -> dict | None:
+        def rotate(connection: sqlite3.Connection) -> sqlite3.Row | None:
+            row = connection.execute("SELECT id, position, data FROM radio_tracks WHERE guild = ? ORDER BY position LIMIT 1", (guild,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE radio_tracks SET position = ? WHERE id = ?", (position, row["id"]))
+            return row
+        return self._track(await self._run(rotate, write=True))
+
+    async def pop_track(self, guild: int) -> dict | None:
+        return self._track(await self._run(lambda connection: connection.execute(
+            "DELETE FROM radio_tracks WHERE id = (SELECT id FROM radio_tracks WHERE guild = ? ORDER BY position LIMIT 1) RETURNING id, position, data", (guild,)
+        ).fetchone(), write=True))
+
+    async def clear_tracks(self, guild: int) -> None:
+        await self._execute("DELETE FROM radio_tracks WHERE guild = ?", (guild,))
+
+    async def shuffle_tracks(self, guild: int, tail: float) -> None:
+        # random() is a signed 64 bit integer, scaled down to [0, tail)
+        await self._execute("UPDATE radio_tracks SET position = (random() / 18446744073709551616.0 + 0.5) * ? WHERE guild = ?", (tail, guild))
@@ -0,0 +1,208 @@
+import abc
+import os
+import random
+import datetime
+
+from scripts.cache import AtlasCache
+
+
+class AtlasStorage(abc.ABC):
+    """What the DB classes need from a database, implemented by the mongo, sqlite and memory backends picked with STORAGE_BACKEND"""
+    storage: "AtlasStorage | None" = None  # the process-wide backend
+
+    @staticmethod
+    def get() -> "AtlasStorage":
+        if AtlasStorage.storage is None:
+            # imported here, every backend module imports this one
+            match backend := os.getenv("STORAGE_BACKEND", "mongo"):
+                case "mongo":
+                    from scripts.mongo import MongoStorage
+                    AtlasStorage.storage = MongoStorage()
+                case "sqlite":
+                    from scripts.sqlite import SQLiteStorage
+                    AtlasStorage.storage = SQLiteStorage(os.getenv("SQLITE_PATH", "atlas.db"))
+                case "memory":
+                    from scripts.memory import MemoryStorage
+                    AtlasStorage.storage = MemoryStorage()
+                case _:
+                    raise ValueError(f"Unknown storage backend {backend!r}")
+        return AtlasStorage.storage
+
+    @staticmethod
+    async def close() -> None:
+        if AtlasStorage.storage is not None:
+            await AtlasStorage.storage.disconnect()
+            AtlasStorage.storage = None
+
+    @staticmethod
+    def tally_stats(tracks: list[dict], sign: int = 1) -> dict:
+        """The change in a radio queue's stats from adding the tracks, or removing them with a sign of -1"""
+        stats = {"length": 0, "count": 0, "streams": 0, "users": {}}
+        for track in tracks:
+            stats["length"] += sign * track["length"]
+            stats["count"] += sign
+            stats["streams"] += sign * (not track["length"])
+            stats["users"][str(track["user"])] = stats["users"].get(str(track["user"]), 0) + sign
+        return stats
+
+    @staticmethod
+    def apply_stats(stats: dict, change: dict) -> None:
+        """Adds a change onto the stats in place, users left without tracks are dropped"""
+        for key in ("length", "count", "streams"):
+            stats[key] += change[key]
+        for user, count in change["users"].items():
+            stats["users"][user] = stats["users"].get(user, 0) + count
+            if stats["users"][user] <= 0:
+                del stats["users"][user]
+
+    async def bootstrap(self) -> None:
+        """Creates whatever the backend is missing out of scripts.schema, run once at startup"""
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def watch(self, collection: str, *caches: AtlasCache) -> None:
+        """Evicts guilds from the caches as other processes change them, backends that can't tell leave the caches to expire"""
+
+    # modules, guild -> {module name: config}
+    @abc.abstractmethod
+    async def get_modules(self, guild: int) -> dict:
+        ...
+
+    @abc.abstractmethod
+    async def set_module(self, guild: int, name: str, config: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def unset_module(self, guild: int, name: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def guilds_with_module(self, name: str) -> list[dict]:
+        """{"guild", "config"} of every guild with the module enabled"""
+
+    async def get_settings(self, guild: int) -> tuple[dict, dict]:
+        """The guild's modules and roles"""
+        return await self.get_modules(guild), await self.get_roles(guild)
+
+    # roles, guild -> {role name: role id}
+    @abc.abstractmethod
+    async def get_roles(self, guild: int) -> dict:
+        ...
+
+    @abc.abstractmethod
+    async def set_role(self, guild: int, name: str, id: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def unset_role(self, guild: int, name: str) -> None:
+        ...
+
+    # blames, kept in insertion order with a running count per user
+    @abc.abstractmethod
+    async def push_blame(self, guild: int, user: int, blamer: int, reason: str | None) -> int:
+        """Records the blame and returns the user's new total"""
+
+    @abc.abstractmethod
+    async def count_blames(self, guild: int, user: int) -> tuple[int, int]:
+        """The user's number of blames and how many of them have a reason"""
+
+    @abc.abstractmethod
+    async def list_blames(self, guild: int, user: int, skip: int = 0, limit: int = 0) -> tuple[int, int, list[dict]]:
+        """count_blames together with {"blamer", "reason"} of a window of the user's blames that have a reason, in a single read"""
+
+    # qotd questions, {"id", "state", "order", "question", "user"} ordered by order then id
+    @abc.abstractmethod
+    async def push_question(self, guild: int, question: str, user: int) -> int:
+        """Stores a pending question under the guild's next id and returns it"""
+
+    @abc.abstractmethod
+    async def get_questions(self, guild: int, state: str, skip: int = 0, limit: int = 0) -> tuple[int, list]:
+        ...
+
+    @abc.abstractmethod
+    async def delete_question(self, guild: int, state: str, id: int) -> dict | None:
+        ...
+
+    @abc.abstractmethod
+    async def accept_question(self, guild: int, id: int) -> dict | None:
+        """Moves a pending question to the back of the accepted ones, returns it as it was"""
+
+    @abc.abstractmethod
+    async def pop_question(self, guild: int) -> dict | None:
+        """Removes and returns the first accepted question"""
+
+    # qotd schedules, {"guild", "cron", "timezone", "next_run"} with naive UTC times
+    @abc.abstractmethod
+    async def set_schedule(self, guild: int, cron: str, timezone: str, next_run: datetime.datetime) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def clear_schedule(self, guild: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def due_schedules(self, now: datetime.datetime) -> list[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def upcoming_schedule(self) -> datetime.datetime | None:
+        ...
+
+    @abc.abstractmethod
+    async def claim_schedule(self, guild: int, run: datetime.datetime, next_run: datetime.datetime) -> bool:
+        """Moves the guild's next run from `run` to `next_run`, False if it no longer was `run`"""
+
+    # radio settings, {"loop", "tail", "stats"}, and tracks, {"_id", "position", ...} ordered by position
+    @abc.abstractmethod
+    async def get_radio(self, guild: int) -> dict | None:
+        """The guild's radio settings, with tail being the last track's position, None if nothing was ever written"""
+
+    @abc.abstractmethod
+    async def set_loop(self, guild: int, loop: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def set_radio_stats(self, guild: int, stats: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def add_radio_stats(self, guild: int, change: dict) -> None:
+        """Adds a change as returned by tally_stats onto the stored stats, the same way apply_stats does"""
+
+    @abc.abstractmethod
+    async def get_tracks(self, guild: int, skip: int = 0, limit: int = 0) -> list[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def write_tracks(self, guild: int, inserted: list[dict] = [], updated: list[dict] = [], deleted: list = []) -> None:
+        """Applies a batch of changes, updated tracks only have their position and encoded track written"""
+
+    @abc.abstractmethod
+    async def rotate_track(self, guild: int, position: float) -> dict | None:
+        """Moves the first track to `position`, returns it as it was"""
+
+    @abc.abstractmethod
+    async def pop_track(self, guild: int) -> dict | None:
+        ...
+
+    @abc.abstractmethod
+    async def clear_tracks(self, guild: int) -> None:
+        ...
+
+    async def jump_tracks(self, guild: int, index: int, tail: float) -> None:
+        """Moves the first `index` tracks, in order, to the positions after `tail`"""
+        tracks = await self.get_tracks(guild, limit=index)
+        await self.write_tracks(guild, updated=[{**track, "position": tail + i} for i, track in enumerate(tracks, start=1)])
+
+    async def swap_tracks(self, guild: int, first: int, second: int) -> None:
+        tracks = await self.get_tracks(guild)
+        if not (0 <= first < len(tracks) and 0 <= second < len(tracks)):
+            return
+        track1, track2 = tracks[first], tracks[second]
+        await self.write_tracks(guild, updated=[{**track1, "position": track2["position"]}, {**track2, "position": track1["position"]}])
+
+    async def shuffle_tracks(self, guild: int, tail: float) -> None:
+        """Random positions below the tail, so tracks queued afterwards still land at the end"""
+        tracks = await self.get_tracks(guild)
+        await self.write_tracks(guild, updated=[{**track, "position": random.random() * tail} for track in tracks])
@@ -0,0 +1,114 @@
+"""Interaction throughput under concurrent guild load, before and after the database layer went async
+
+Every simulated interaction runs the module and permission checks of a slash command against its guild and then responds.
+`blocking` makes the same pymongo calls the synchronous database layer made, right on the event loop, `async` loads the
+guild's settings through AtlasContext with the caches emptied first and `cached` is AtlasContext as the bot runs it.
+A heartbeat task reports how late the event loop gets back to it, which is what delays discord.py's gateway keepalive.
+
+    python -m tests.benchmark_interactions [guilds] [interactions] [concurrency]
+"""
+import asyncio
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+import pymongo
+
+from tests.conftest import mongo_database
+from scripts.context import AtlasContext
+from scripts.database import ModuleDB, RoleDB
+from scripts.mongo import MongoStorage
+from scripts.storage import AtlasStorage
+from utils.enums import Module, Roles
+
+RESPONSE_TIME = 0.05  # the interaction response's round trip to discord
+
+
+def seed(database: pymongo.database.Database, guilds: int) -> None:
+    database["modules"].drop()
+    database["roles"].drop()
+    database["modules"].insert_many([{"_id": guild, "modules": [{"name": module.value, "config": {}} for module in Module]} for guild in range(guilds)])
+    database["roles"].insert_many([{"_id": guild, "radio": guild * 10 + 1, "manager": guild * 10 + 2} for guild in range(guilds)])
+
+
+def member(guild: int) -> SimpleNamespace:
+    return SimpleNamespace(guild_permissions=SimpleNamespace(administrator=False), roles=[SimpleNamespace(id=guild * 10 + 1)])
+
+
+def blocking_checks(database: pymongo.database.Database, guild: int) -> int:
+    """ModuleDB(guild).is_enabled and RoleDB(guild).permission_level as they were, each constructor upserting its guild document"""
+    for collection, schema in (("modules", {"modules": []}), ("roles", {})):
+        try:
+            database[collection].insert_one({**schema, "_id": guild})
+        except pymongo.errors.DuplicateKeyError:
+            pass
+    if not database["modules"].find_one({"_id": guild, "modules.name": Module.RADIO.value}):
+        return 0
+    roles = database["roles"].find_one({"_id": guild}, {"_id": False}).items()
+    user_roles = [role.id for role in member(guild).roles]
+    return max((Roles[name.upper()].value for name, role in roles if role in user_roles), default=0)
+
+
+async def async_checks(guild: int) -> int:
+    context = await AtlasContext.load(guild)
+    if not context.is_enabled(Module.RADIO):
+        return 0
+    return context.permission_level(member(guild))
+
+
+async def run(name: str, checks, guilds: int, interactions: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    lag = []
+    running = True
+
+    async def heartbeat() -> None:
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag.append(time.perf_counter() - start - 0.01)
+
+    async def interaction(guild: int) -> None:
+        async with semaphore:
+            assert await checks(guild) == Roles.RADIO.value
+            await asyncio.sleep(RESPONSE_TIME)
+
+    beat = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(interaction(random.randrange(guilds)) for _ in range(interactions)))
+    elapsed = time.perf_counter() - start
+    running = False
+    await beat
+
+    lag.sort()
+    print(f"{name:>8}: {interactions / elapsed:8.1f} interactions/s, loop lag p50 {lag[len(lag) // 2] * 1000:6.1f}ms max {lag[-1] * 1000:6.1f}ms")
+
+
+async def main(guilds: int, interactions: int, concurrency: int) -> None:
+    if (database := mongo_database()) is None:
+        sys.exit("no mongod reachable at MONGO_URI")
+    seed(database, guilds)
+    random.seed(0)
+    AtlasStorage.storage = MongoStorage()
+
+    async def blocking(guild: int) -> int:
+        return blocking_checks(database, guild)
+
+    async def uncached(guild: int) -> int:
+        ModuleDB.cache.pop(guild)
+        RoleDB.cache.pop(guild)
+        return await async_checks(guild)
+
+    print(f"{interactions} interactions over {guilds} guilds, {concurrency} at a time")
+    await run("blocking", blocking, guilds, interactions, concurrency)
+    await run("async", uncached, guilds, interactions, concurrency)
+    await run("cached", async_checks, guilds, interactions, concurrency)
+
+    await AtlasStorage.close()
+    database.client.drop_database(database.name)
+    database.client.close()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*args, *(1000, 5000, 100)[len(args):]))
@@ -0,0 +1,107 @@
+"""Latency of every storage operation on each backend, so they can be compared per operation
+
+Every backend is seeded with the same guilds through the storage interface and each operation is then timed one call at a
+time, spread over the guilds. Mongo is left out when no mongod answers at MONGO_URI.
+
+    python -m tests.benchmark_storage [guilds] [calls]
+"""
+import asyncio
+import datetime
+import sys
+import tempfile
+import time
+
+from bson import ObjectId
+
+from tests.conftest import make_storage, mongo_database
+from scripts.storage import AtlasStorage
+
+NOW = datetime.datetime(2030, 1, 1)
+TRACKS = 10
+
+
+def track(position: float) -> dict:
+    return {"_id": ObjectId(), "position": position, "title": "", "author": "", "url": "", "length": 1000, "user": 7, "track": None}
+
+
+async def seed(storage: AtlasStorage, guilds: int) -> None:
+    for guild in range(guilds):
+        await storage.set_module(guild, "radio", {})
+        await storage.set_module(guild, "qotd", {"channel": guild})
+        await storage.set_role(guild, "radio", guild)
+        await storage.push_blame(guild, 7, 8, "reason")
+        await storage.push_question(guild, "?", 7)
+        await storage.set_schedule(guild, "0 12 * * *", "UTC", NOW + datetime.timedelta(minutes=guild))
+        await storage.set_loop(guild, "playlist_repeat")
+        await storage.write_tracks(guild, inserted=[track(position) for position in range(1, TRACKS + 1)])
+        await storage.set_radio_stats(guild, AtlasStorage.tally_stats([track(0)] * TRACKS))
+
+
+# operation -> the call it times for the i-th call, against guild i % guilds
+OPERATIONS = {
+    "get_settings": lambda storage, guild, i: storage.get_settings(guild),
+    "set_module": lambda storage, guild, i: storage.set_module(guild, "fun", {}),
+    "guilds_with_module": lambda storage, guild, i: storage.guilds_with_module("qotd"),
+    "set_role": lambda storage, guild, i: storage.set_role(guild, "manager", i),
+    "push_blame": lambda storage, guild, i: storage.push_blame(guild, 7, 8, "reason" if i % 2 else None),
+    "count_blames": lambda storage, guild, i: storage.count_blames(guild, 7),
+    "list_blames": lambda storage, guild, i: storage.list_blames(guild, 7, 0, 7),
+    "push_question": lambda storage, guild, i: storage.push_question(guild, "?", 7),
+    "get_questions": lambda storage, guild, i: storage.get_questions(guild, "pending", 0, 7),
+    "accept_question": lambda storage, guild, i: storage.accept_question(guild, 1),
+    "pop_question": lambda storage, guild, i: storage.pop_question(guild),
+    "due_schedules": lambda storage, guild, i: storage.due_schedules(NOW + datetime.timedelta(minutes=10)),
+    "upcoming_schedule": lambda storage, guild, i: storage.upcoming_schedule(),
+    "claim_schedule": lambda storage, guild, i: storage.claim_schedule(guild, NOW, NOW),
+    "get_radio": lambda storage, guild, i: storage.get_radio(guild),
+    "add_radio_stats": lambda storage, guild, i: storage.add_radio_stats(guild, AtlasStorage.tally_stats([track(0)])),
+    "get_tracks": lambda storage, guild, i: storage.get_tracks(guild, limit=8),
+    "write_tracks": lambda storage, guild, i: storage.write_tracks(guild, inserted=[track(TRACKS + 1 + i)]),
+    "rotate_track": lambda storage, guild, i: storage.rotate_track(guild, TRACKS * 2 + i),
+    "swap_tracks": lambda storage, guild, i: storage.swap_tracks(guild, 0, 1),
+    "shuffle_tracks": lambda storage, guild, i: storage.shuffle_tracks(guild, TRACKS),
+}
+
+
+async def measure(backend: str, directory: str, guilds: int, calls: int) -> dict[str, list[float]]:
+    storage = make_storage(backend, directory)
+    await storage.bootstrap()
+    try:
+        await seed(storage, guilds)
+        timings = {}
+        for name, operation in OPERATIONS.items():
+            timings[name] = []
+            for i in range(calls):
+                start = time.perf_counter()
+                await operation(storage, i % guilds, i)
+                timings[name].append(time.perf_counter() - start)
+            timings[name].sort()
+        return timings
+    finally:
+        await storage.disconnect()
+
+
+def main(guilds: int, calls: int) -> None:
+    backends = ["memory", "sqlite"]
+    if (database := mongo_database()) is not None:
+        database.client.drop_database(database.name)
+        backends.append("mongo")
+    else:
+        print("no mongod reachable at MONGO_URI, leaving mongo out")
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {backend: asyncio.run(measure(backend, directory, guilds, calls)) for backend in backends}
+    if database is not None:
+        database.client.drop_database(database.name)
+        database.client.close()
+
+    print(f"{calls} calls over {guilds} guilds, p50 / p99 in ms")
+    print(f"{'':>20}" + "".join(f"{backend:>20}" for backend in backends))
+    for name in OPERATIONS:
+        row = (f"{timings[name][len(timings[name]) // 2] * 1000:.3f} / {timings[name][int(len(timings[name]) * 0.99)] * 1000:.3f}" for timings in results.values())
+        print(f"{name:>20}" + "".join(f"{cell:>20}" for cell in row))
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args, *(1000, 1000)[len(args):])
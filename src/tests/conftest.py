@@ -0,0 +1,55 @@
+import os
+from typing import Callable
+
+import pymongo
+import pytest
+
+from scripts.memory import MemoryStorage
+from scripts.mongo import MongoStorage
+from scripts.sqlite import SQLiteStorage
+from scripts.storage import AtlasStorage
+
+# the suites and benchmarks run against a local mongod and their own database, never the bot's
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/")
+os.environ.setdefault("MONGO_DATABASE", "atlas_tests")
+
+
+def mongo_database() -> pymongo.database.Database | None:
+    """A synchronous handle on the test database, None when no mongod answers at MONGO_URI"""
+    client = pymongo.MongoClient(os.environ["MONGO_URI"], serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        client.close()
+        return None
+    return client[os.environ["MONGO_DATABASE"]]
+
+
+@pytest.fixture(scope="session")
+def mongo() -> pymongo.database.Database:
+    if (database := mongo_database()) is None:
+        pytest.skip("no mongod reachable at MONGO_URI")
+    yield database
+    database.client.drop_database(database.name)
+    database.client.close()
+
+
+def make_storage(backend: str, directory: str) -> AtlasStorage:
+    """A fresh storage backend, sqlite keeps its file in `directory` and mongo uses the test database"""
+    match backend:
+        case "memory":
+            return MemoryStorage()
+        case "sqlite":
+            return SQLiteStorage(os.path.join(directory, "atlas.db"))
+        case "mongo":
+            return MongoStorage()
+
+
+@pytest.fixture(params=["memory", "sqlite", "mongo"])
+def new_storage(request: pytest.FixtureRequest, tmp_path) -> Callable[[], AtlasStorage]:
+    """Builds each storage backend in turn, starting out empty, called from inside the test's event loop"""
+    if request.param == "mongo":
+        database = request.getfixturevalue("mongo")
+        for name in database.list_collection_names():
+            database.drop_collection(name)
+    return lambda: make_storage(request.param, str(tmp_path))
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pomice
+import pytest
+from aiohttp import web
+
+from scripts.memory import MemoryStorage
+from scripts.pomice import AtlasNode, AtlasNodePool, AtlasPlayer
+from scripts.storage import AtlasStorage
+
+
+class FakeLavalink:
+    """Just enough of a lavalink v3 server to connect a node to and move players onto"""
+
+    def __init__(self, session: str, failing: set[int] = set()) -> None:
+        self.session = session
+        self.failing = failing  # guilds whose player updates are answered with a server error
+        self.updates: dict[int, list[dict]] = {}
+        self.sockets: list[web.WebSocketResponse] = []
+
+        app = web.Application()
+        app.router.add_get("/version", self.version)
+        app.router.add_get("/v3/websocket", self.websocket)
+        app.router.add_patch("/v3/sessions/{session}/players/{guild}", self.update_player)
+        self.runner = web.AppRunner(app)
+
+    async def start(self) -> int:
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        for socket in self.sockets:
+            await socket.close()
+        await self.runner.cleanup()
+
+    async def version(self, request: web.Request) -> web.Response:
+        return web.Response(text="3.7.11")
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        self.sockets.append(socket)
+        await socket.send_json({"op": "ready", "resumed": False, "sessionId": self.session})
+        async for _ in socket:
+            pass
+        return socket
+
+    async def update_player(self, request: web.Request) -> web.Response:
+        assert request.match_info["session"] == self.session
+        guild = int(request.match_info["guild"])
+        if guild in self.failing:
+            return web.json_response({"message": "player update failed"}, status=500)
+        self.updates.setdefault(guild, []).append(await request.json())
+        return web.json_response({})
+
+
+async def until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture(autouse=True)
+def storage() -> None:
+    AtlasStorage.storage = MemoryStorage()
+    yield
+    AtlasStorage.storage = None
+    AtlasNodePool._nodes.clear()
+
+
+async def connect(server: FakeLavalink, identifier: str) -> AtlasNode:
+    async def wait_until_ready() -> None:
+        pass
+
+    bot = SimpleNamespace(user=SimpleNamespace(id=1), wait_until_ready=wait_until_ready, add_listener=lambda *args: None)
+    node = await AtlasNodePool.create_node(bot=bot, host="127.0.0.1", port=await server.start(), password="", identifier=identifier)
+    await until(lambda: node._session_id is not None)
+    return node
+
+
+def player(node: AtlasNode, guild: int) -> AtlasPlayer:
+    player = AtlasPlayer(SimpleNamespace(), SimpleNamespace(guild=SimpleNamespace(id=guild)), node=node)
+    node._players[guild] = player
+    player._is_connected = True
+    player._voice_state = {"sessionId": f"voice{guild}", "event": {"token": "token", "endpoint": "endpoint"}}
+    player._current = pomice.Track(track_id=f"encoded{guild}", info={"title": "", "author": "", "uri": "", "length": 60000, "isStream": False}, track_type=pomice.TrackType.HTTP)
+    player._last_position, player._last_update = 1000, time.time() * 1000
+    return player
+
+
+async def close(*nodes: AtlasNode) -> None:
+    for node in nodes:
+        node._task.cancel()
+        await node._websocket.close()
+        await node._session.close()
+
+
+def test_nodes_without_stats_are_balanced() -> None:
+    async def run() -> None:
+        first, second = FakeLavalink("first"), FakeLavalink("second")
+        nodes = [await connect(first, "FIRST"), await connect(second, "SECOND")]
+        try:
+            assert all(node._stats is None and not node.overloaded for node in nodes)
+            nodes[0]._players[1] = None
+            assert AtlasNodePool.get_node() is nodes[1]
+            await AtlasNodePool.balance()
+        finally:
+            nodes[0]._players.clear()
+            await close(*nodes)
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(run())
+
+
+def test_players_move_off_a_dropped_node() -> None:
+    async def run() -> None:
+        dropped, backup = FakeLavalink("dropped"), FakeLavalink("backup", failing={2})
+        source = await connect(dropped, "DROPPED")
+        target = await connect(backup, "BACKUP")
+        players = [player(source, guild) for guild in (1, 2, 3)]
+        try:
+            await dropped.sockets[0].close()
+            await until(lambda: 3 in backup.updates)
+
+            # the player that failed to move didn't stop the others, and pomice is still trying to reconnect
+            assert {guild: [list(update) for update in updates] for guild, updates in backup.updates.items()} == {
+                1: [["voice"], ["volume", "paused", "encodedTrack", "position"]],
+                3: [["voice"], ["volume", "paused", "encodedTrack", "position"]],
+            }
+            assert backup.updates[1][1]["encodedTrack"] == "encoded1" and backup.updates[1][1]["position"] >= 1000
+            assert all(player._node is target for player in players)
+            assert not source._task.done()
+        finally:
+            await close(source, target)
+            await dropped.stop()
+            await backup.stop()
+
+    asyncio.run(run())
+
+
+def test_players_stay_put_without_a_session() -> None:
+    async def run() -> None:
+        first, second = FakeLavalink("first"), FakeLavalink("second")
+        source, target = await connect(first, "FIRST"), await connect(second, "SECOND")
+        moving = player(source, 1)
+        target._session_id = None
+        try:
+            with pytest.raises(pomice.exceptions.NodeNotAvailable):
+                await moving.migrate(target)
+            assert moving._node is source and source._players == {1: moving}
+        finally:
+            await close(source, target)
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(run())
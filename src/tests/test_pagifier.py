@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from scripts.message import AtlasPageSource, AtlasPagifier
+
+
+def test_a_failed_page_is_fetched_again() -> None:
+    async def run() -> None:
+        failures = 1
+
+        async def query(skip: int, limit: int) -> tuple[int, list]:
+            nonlocal failures
+            if failures:
+                failures -= 1
+                raise ConnectionError("lost the database")
+            return 3, ["a", "b", "c"][skip:skip + limit]
+
+        pagifier = AtlasPagifier(AtlasPageSource(query, lambda i, item: (str(i), item)), timeout=None, divider=2)
+        with pytest.raises(ConnectionError):
+            await pagifier.fetch_page(0)
+        await asyncio.sleep(0)
+
+        assert 0 not in pagifier.cache
+        assert await pagifier.fetch_page(0) == (("1", "a"), ("2", "b"))
+        assert 0 in pagifier.cache
+
+    asyncio.run(run())
@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import pytest
+from discord.ui.view import ViewStore
+
+from scripts.database import RadioDB
+from scripts.memory import MemoryStorage
+from scripts.message import AtlasPlayerControl
+from scripts.queue import AtlasQueue
+from scripts.storage import AtlasStorage
+
+
+class FakeMessage:
+    def __init__(self, id: int, embed) -> None:
+        self.id = id
+        self.embeds = [embed]
+
+    async def edit(self, embed) -> None:
+        self.embeds.append(embed)
+
+    async def delete(self) -> None:
+        pass
+
+
+class FakeChannel:
+    """Registers the view of every message it sends the way discord.py's send() does, unless the view has finished"""
+
+    def __init__(self) -> None:
+        self._state = SimpleNamespace()
+        self._state._view_store = ViewStore(self._state)
+        self.ids = itertools.count(1000)
+        self.sent: list[FakeMessage] = []
+        self.sending = asyncio.Event()
+        self.sending.set()
+
+    async def send(self, embed, view) -> FakeMessage:
+        await self.sending.wait()
+        message = FakeMessage(next(self.ids), embed)
+        if not view.is_finished():
+            self._state._view_store.add_view(view, message.id)
+        self.sent.append(message)
+        return message
+
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch: pytest.MonkeyPatch) -> None:
+    AtlasStorage.storage = MemoryStorage()
+    RadioDB.settings.clear()
+    monkeypatch.setattr(AtlasPlayerControl, "debounce", 0.01)
+    monkeypatch.setattr(AtlasPlayerControl, "view", None)
+    monkeypatch.setattr(AtlasPlayerControl, "layout", None)
+    yield
+    AtlasStorage.storage = None
+    RadioDB.settings.clear()
+
+
+async def player() -> SimpleNamespace:
+    player = SimpleNamespace(
+        text_channel=FakeChannel(), message=None, messages_below=0, panel_task=None, panel_stale=False,
+        queue=AtlasQueue(1), bot=SimpleNamespace(user=SimpleNamespace(avatar=None))
+    )
+    AtlasPlayerControl.register(SimpleNamespace(add_view=player.text_channel._state._view_store.add_view))
+    await player.queue.push([{"title": "first", "author": "someone", "length": 1000, "user": 7}])
+    return player
+
+
+def test_reposted_panels_share_the_persistent_view() -> None:
+    async def run() -> None:
+        radio = await player()
+        store = radio.text_channel._state._view_store
+        for _ in range(3):
+            radio.messages_below = AtlasPlayerControl.reposition
+            await AtlasPlayerControl.update_player_controls(radio)
+
+        assert len(radio.text_channel.sent) == 3
+        assert AtlasPlayerControl.layout.to_components() == AtlasPlayerControl.view.to_components()
+        assert list(store._views) == [None] and not store._synced_message_views
+        assert AtlasPlayerControl.view._cache_key is None and store.persistent_views == [AtlasPlayerControl.view]
+
+    asyncio.run(run())
+
+
+def test_changes_during_an_update_are_not_lost() -> None:
+    async def run() -> None:
+        radio = await player()
+        radio.text_channel.sending.clear()
+        AtlasPlayerControl.refresh(radio)
+        while not radio.text_channel.sending._waiters:
+            await asyncio.sleep(0.01)
+
+        await radio.queue.push([{"title": "second", "author": "someone", "length": 1000, "user": 7}])
+        AtlasPlayerControl.refresh(radio)
+        radio.text_channel.sending.set()
+        await radio.panel_task
+
+        assert [field.name for field in radio.message.embeds[-1].fields] == ["2) someone | second"]
+
+    asyncio.run(run())
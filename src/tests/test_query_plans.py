@@ -0,0 +1,239 @@
+"""Runs every DB class method against a seeded mongod and checks the plans of the queries it sent
+
+Each method runs with the profiler on, every query it sent is explained again and fails the test if any stage is a
+COLLSCAN, if a pipeline unwinds before it matches or if the method examined more documents than its budget. The seeded
+scales can be picked with QUERY_PLAN_SCALES, a comma separated list of guild counts.
+"""
+import asyncio
+import datetime
+import os
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+import pymongo
+import pytest
+from bson import ObjectId
+
+from scripts import schema
+from scripts.cache import AtlasCache
+from scripts.context import AtlasContext
+from scripts.database import BlameDB, ModuleDB, QotdDB, RadioDB, RoleDB
+from scripts.mongo import MongoStorage
+from scripts.storage import AtlasStorage
+from utils.enums import Module
+
+SCALES = [int(scale) for scale in os.getenv("QUERY_PLAN_SCALES", "100,10000,100000").split(",")]
+BATCH_SIZE = 10000
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+NOW = datetime.datetime(2030, 1, 1)
+
+# every 10th guild has qotd set up and a radio queue, the guild the methods run against has more of everything
+TRACKS, QUESTIONS, BLAMES, DUE = 100, 20, 50, 5
+
+
+def target(guilds: int) -> int:
+    return guilds // 20 * 10
+
+
+def seed(database: pymongo.database.Database, guilds: int) -> None:
+    database.client.drop_database(database.name)
+    busy = target(guilds)
+
+    def insert(collection: str, documents) -> None:
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) == BATCH_SIZE:
+                database[collection].insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            database[collection].insert_many(batch, ordered=False)
+
+    insert("modules", ({"_id": guild, "modules": [
+        {"name": Module.RADIO.value, "config": {}}, *([{"name": Module.QOTD.value, "config": {"channel": guild}}] if guild % 10 == 0 else [])
+    ]} for guild in range(guilds)))
+    insert("roles", ({"_id": guild, "manager": guild * 10 + 1, "radio": guild * 10 + 2} for guild in range(guilds)))
+
+    insert("blames", (
+        {"guild": guild, "user": user, "blamer": 0, "reason": "reason" if i % 2 else None}
+        for guild in range(guilds) for user, count in ((1, BLAMES if guild == busy else 2), (2, 2)) for i in range(count)
+    ))
+    insert("blame_counts", (
+        {"_id": {"guild": guild, "user": user}, "count": count, "reasons": count // 2}
+        for guild in range(guilds) for user, count in ((1, BLAMES if guild == busy else 2), (2, 2))
+    ))
+
+    # a few schedules are due, the rest are spread over the next days
+    insert("qotd", ({
+        "_id": guild, "seq": QUESTIONS * 2, "cron": "0 12 * * *", "timezone": "UTC",
+        "next_run": NOW - datetime.timedelta(minutes=guild) if guild < DUE * 10 else NOW + datetime.timedelta(minutes=guild)
+    } for guild in range(0, guilds, 10)))
+    insert("qotd_questions", (
+        {"guild": guild, "id": id, "state": "pending" if id <= count else "accepted", "order": NOW + datetime.timedelta(seconds=id), "question": "?", "user": 7}
+        for guild in range(0, guilds, 10) for count in (QUESTIONS if guild == busy else 2,) for id in range(1, count * 2 + 1)
+    ))
+
+    insert("radio", ({"_id": guild, "loop": "playlist_repeat", "stats": {"length": 0, "count": 0, "streams": 0, "users": {}}} for guild in range(guilds)))
+    insert("radio_tracks", (
+        {"_id": ObjectId(), "guild": guild, "position": position, "title": "", "author": "", "url": "", "length": 1000, "user": 7, "track": None}
+        for guild in range(0, guilds, 10) for position in range(1, (TRACKS if guild == busy else 10) + 1)
+    ))
+
+
+@dataclass
+class Query:
+    collection: str
+    command: dict
+    explain: dict
+    examined: int
+
+
+def stages(value):
+    """Every stage document of an explain output, however deeply nested"""
+    if isinstance(value, dict):
+        if "stage" in value:
+            yield value
+        for item in value.values():
+            yield from stages(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from stages(item)
+
+
+def examined(value) -> int:
+    """Documents examined according to an explain output, summed over the pipeline stages and lookups that report it"""
+    if isinstance(value, dict):
+        if "totalDocsExamined" in value:
+            return value["totalDocsExamined"] + sum(examined(item) for key, item in value.items() if key != "executionStages")
+        return sum(examined(item) for item in value.values())
+    if isinstance(value, list):
+        return sum(examined(item) for item in value)
+    return 0
+
+
+def pipelines(command: dict):
+    """The command's pipeline and every pipeline nested in it"""
+    for stage in command.get("pipeline", []):
+        yield from (pipeline for key in ("$lookup", "$unionWith") if isinstance(stage.get(key), dict) for pipeline in pipelines(stage[key]))
+    if "pipeline" in command:
+        yield command["pipeline"]
+
+
+def unwinds_before_matching(pipeline: list) -> bool:
+    for stage in pipeline:
+        if "$match" in stage:
+            return False
+        if "$unwind" in stage:
+            return True
+    return False
+
+
+def profiled(database: pymongo.database.Database) -> list[Query]:
+    """Explains every query in the profile, writes are explained as the statement the profiler recorded"""
+    queries = []
+    for entry in database["system.profile"].find({"ns": {"$not": {"$regex": r"\.system\."}}}, sort=[("ts", pymongo.ASCENDING)]):
+        collection = entry["ns"].split(".", 1)[1]
+        match entry["op"]:
+            case "update":
+                command = {"update": collection, "updates": [entry["command"]]}
+            case "remove":
+                command = {"delete": collection, "deletes": [entry["command"]]}
+            case "query" | "command":
+                command = {key: value for key, value in entry["command"].items() if not key.startswith("$") and key not in ("lsid", "txnNumber", "cursor")}
+            case _:
+                continue
+        if not EXPLAINABLE.intersection(command):
+            continue
+
+        try:
+            explain = database.command("explain", command, verbosity="executionStats")
+        except pymongo.errors.OperationFailure:  # pipelines ending in $merge can only be explained without running them
+            explain = database.command("explain", command, verbosity="queryPlanner")
+        queries.append(Query(collection, command, explain, max(entry.get("docsExamined", 0), examined(explain))))
+    return queries
+
+
+def member(guild: int) -> SimpleNamespace:
+    return SimpleNamespace(guild_permissions=SimpleNamespace(administrator=False), roles=[SimpleNamespace(id=guild * 10 + 2)])
+
+
+def track() -> dict:
+    return {"title": "", "author": "", "url": "", "length": 1000, "user": 8, "track": None}
+
+
+# method -> (what it runs against the busy guild, the documents it may examine at a scale), windows may fetch the
+# documents they skip and pipelines ending in $merge look up every document they write
+METHODS = {
+    "AtlasContext.load": (lambda guild: AtlasContext.load(guild), lambda guilds: 2),
+    "ModuleDB.is_enabled": (lambda guild: ModuleDB(guild).is_enabled(Module.RADIO), lambda guilds: 1),
+    "ModuleDB.get_config": (lambda guild: ModuleDB(guild).get_config(Module.QOTD, "channel"), lambda guilds: 1),
+    "ModuleDB.enable": (lambda guild: ModuleDB(guild).enable(Module.FUN), lambda guilds: 3),
+    "ModuleDB.disable": (lambda guild: ModuleDB(guild).disable(Module.RADIO), lambda guilds: 2),
+    "ModuleDB.get_guilds_enabled": (lambda guild: ModuleDB.get_guilds_enabled(Module.QOTD), lambda guilds: -(-guilds // 10)),
+    "RoleDB.list": (lambda guild: RoleDB(guild).list(), lambda guilds: 1),
+    "RoleDB.permission_level": (lambda guild: RoleDB(guild).permission_level(member(guild)), lambda guilds: 1),
+    "RoleDB.insert": (lambda guild: RoleDB(guild).insert(1, "qotd"), lambda guilds: 1),
+    "RoleDB.remove": (lambda guild: RoleDB(guild).remove("manager"), lambda guilds: 2),
+    "BlameDB.push": (lambda guild: BlameDB(guild).push(1, 2, "reason"), lambda guilds: 1),
+    "BlameDB.list": (lambda guild: BlameDB(guild).list(1, 10, 7), lambda guilds: 1 + 10 + 7),
+    "BlameDB.count": (lambda guild: BlameDB(guild).count(1), lambda guilds: 1),
+    "QotdDB.suggest": (lambda guild: QotdDB(guild).suggest("?", 7), lambda guilds: 1),
+    "QotdDB.get_pending": (lambda guild: QotdDB(guild).get_pending(7, 7), lambda guilds: 7 + 7),
+    "QotdDB.get_accepted": (lambda guild: QotdDB(guild).get_accepted(0, 7), lambda guilds: 7),
+    "QotdDB.accept": (lambda guild: QotdDB(guild).accept(3), lambda guilds: 1),
+    "QotdDB.decline": (lambda guild: QotdDB(guild).decline(4), lambda guilds: 1),
+    "QotdDB.fetch": (lambda guild: QotdDB(guild).fetch(), lambda guilds: 1),
+    "QotdDB.due": (lambda guild: QotdDB.due(NOW), lambda guilds: min(DUE, -(-guilds // 10))),
+    "QotdDB.upcoming": (lambda guild: QotdDB.upcoming(), lambda guilds: 1),
+    "QotdDB.set_schedule": (lambda guild: QotdDB(guild).set_schedule("0 9 * * *", "UTC"), lambda guilds: 1),
+    "QotdDB.claim": (lambda guild: QotdDB(guild).claim(NOW + datetime.timedelta(minutes=guild), NOW + datetime.timedelta(days=1)), lambda guilds: 1),
+    "QotdDB.clear_schedule": (lambda guild: QotdDB(guild).clear_schedule(), lambda guilds: 1),
+    "RadioDB.playlist": (lambda guild: RadioDB(guild).playlist(8), lambda guilds: 8),
+    "RadioDB.page": (lambda guild: RadioDB(guild).page(14, 7), lambda guilds: 2 + 14 + 7),
+    "RadioDB.stats": (lambda guild: RadioDB(guild).stats(), lambda guilds: 2),
+    "RadioDB.push": (lambda guild: RadioDB(guild).push([track(), track()]), lambda guilds: 2 + 1),
+    "RadioDB.remove": (lambda guild: RadioDB(guild).remove(3), lambda guilds: 4 + 1 + 2 + 1),
+    "RadioDB.update": (lambda guild: RadioDB(guild).update(), lambda guilds: 2 + 1),
+    "RadioDB.jump": (lambda guild: RadioDB(guild).jump(5), lambda guilds: 2 + 5 + 5),
+    "RadioDB.swap": (lambda guild: RadioDB(guild).swap(2, 9), lambda guilds: 3 + 10 + 2),
+    "RadioDB.shuffle": (lambda guild: RadioDB(guild).shuffle(), lambda guilds: 2 + 2 * (TRACKS + 2)),
+    "RadioDB.cycle_loop": (lambda guild: RadioDB(guild).cycle_loop(), lambda guilds: 2 + 1),
+    "RadioDB.clear": (lambda guild: RadioDB(guild).clear(), lambda guilds: 2 + TRACKS + 2 + 1),
+}
+
+
+async def capture(database: pymongo.database.Database, guilds: int) -> dict[str, list[Query]]:
+    AtlasStorage.storage = MongoStorage()
+    await schema.bootstrap()
+    plans = {}
+    try:
+        for name, (method, _) in METHODS.items():
+            for cache in AtlasCache.caches:
+                cache.clear()
+            database.command("profile", 0)
+            database.drop_collection("system.profile")
+            database.command("profile", 2)
+            await method(target(guilds))
+            database.command("profile", 0)
+            plans[name] = profiled(database)
+    finally:
+        await AtlasStorage.close()
+    return plans
+
+
+@pytest.fixture(scope="module", params=SCALES, ids=lambda guilds: f"{guilds} guilds")
+def plans(request: pytest.FixtureRequest, mongo: pymongo.database.Database) -> tuple[int, dict[str, list[Query]]]:
+    seed(mongo, request.param)
+    return request.param, asyncio.run(capture(mongo, request.param))
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_query_plan(plans: tuple[int, dict[str, list[Query]]], method: str) -> None:
+    guilds, queries = plans
+    for query in queries[method]:
+        scans = [stage for stage in stages(query.explain) if stage["stage"] == "COLLSCAN"]
+        assert not scans, f"{method} scans {query.collection}: {query.command}"
+        assert not any(unwinds_before_matching(pipeline) for pipeline in pipelines(query.command)), f"{method} unwinds before matching: {query.command}"
+
+    total = sum(query.examined for query in queries[method])
+    assert total <= METHODS[method][1](guilds), f"{method} examined {total} documents: {[query.command for query in queries[method]]}"
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from scripts.database import RadioDB
+from scripts.memory import MemoryStorage
+from scripts.queue import AtlasQueue
+from scripts.storage import AtlasStorage
+
+GUILD = 1
+
+
+class FlakyStorage(MemoryStorage):
+    """Fails the next `failures` writes of each kind"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.failures = {"write_tracks": 0, "set_radio_stats": 0, "clear_tracks": 0}
+
+    def _fail(self, operation: str) -> None:
+        if self.failures[operation]:
+            self.failures[operation] -= 1
+            raise ConnectionError(f"{operation} failed")
+
+    async def write_tracks(self, guild, inserted=[], updated=[], deleted=[]) -> None:
+        self._fail("write_tracks")
+        await super().write_tracks(guild, inserted, updated, deleted)
+
+    async def set_radio_stats(self, guild, stats) -> None:
+        self._fail("set_radio_stats")
+        await super().set_radio_stats(guild, stats)
+
+    async def clear_tracks(self, guild) -> None:
+        self._fail("clear_tracks")
+        await super().clear_tracks(guild)
+
+
+@pytest.fixture
+def storage() -> FlakyStorage:
+    AtlasStorage.storage = storage = FlakyStorage()
+    RadioDB.settings.clear()
+    yield storage
+    AtlasStorage.storage = None
+    RadioDB.settings.clear()
+
+
+def tracks(*titles: str) -> list[dict]:
+    return [{"title": title, "length": 1000, "user": 7} for title in titles]
+
+
+async def stored(queue: AtlasQueue) -> tuple[list[str], dict]:
+    RadioDB.settings.pop(queue.guild)
+    return [track["title"] for track in (await RadioDB(queue.guild).playlist())[1]], await RadioDB(queue.guild).stats()
+
+
+def test_failed_write_stays_pending(storage: FlakyStorage) -> None:
+    async def run() -> None:
+        queue = AtlasQueue(GUILD)
+        await queue.push(tracks("a", "b", "c"))
+        storage.failures["write_tracks"] = 1
+        with pytest.raises(ConnectionError):
+            await queue.flush()
+
+        # changes made after the batch was taken land on top of it
+        await queue.remove(1)
+        await queue.push(tracks("d"))
+        await queue.swap(0, 1)
+        await queue.flush()
+        assert await stored(queue) == (["c", "a", "d"], queue.totals)
+        assert queue.totals["count"] == 3
+
+    asyncio.run(run())
+
+
+def test_failed_stats_write_is_retried(storage: FlakyStorage) -> None:
+    async def run() -> None:
+        queue = AtlasQueue(GUILD)
+        await queue.push(tracks("a", "b"))
+        storage.failures["set_radio_stats"] = 1
+        with pytest.raises(ConnectionError):
+            await queue.flush()
+        await queue.flush()
+        assert await stored(queue) == (["a", "b"], queue.totals)
+
+    asyncio.run(run())
+
+
+def test_clear_after_failed_flush_drops_the_batch(storage: FlakyStorage) -> None:
+    async def run() -> None:
+        queue = AtlasQueue(GUILD)
+        await queue.push(tracks("a", "b"))
+        await queue.flush()
+
+        await queue.remove(0)
+        await queue.push(tracks("c"))
+        storage.failures["clear_tracks"] = 1
+        await queue.clear()
+        with pytest.raises(ConnectionError):
+            await queue.flush()
+        await queue.push(tracks("d"))
+        await queue.flush()
+        assert await stored(queue) == (["d"], queue.totals)
+
+    asyncio.run(run())
+
+
+def test_scheduled_flush_retries(storage: FlakyStorage, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(AtlasQueue, "flush_interval", 0.01)
+
+    async def run() -> None:
+        queue = AtlasQueue(GUILD)
+        storage.failures["write_tracks"] = 2
+        await queue.push(tracks("a"))
+        await asyncio.wait_for(queue._flush_task, 1)
+        assert await stored(queue) == (["a"], queue.totals)
+
+    asyncio.run(run())
+
+
+def test_stats_follow_the_queue(storage: FlakyStorage) -> None:
+    async def run() -> None:
+        queue = AtlasQueue(GUILD)
+        await queue.push(tracks("a", "b") + [{"title": "live", "length": 0, "user": 8}])
+        await queue.remove(0)
+        assert await queue.stats() == {"length": 1000, "count": 2, "streams": 1, "users": {"7": 1, "8": 1}}
+        assert await queue.playlist_length() == 1000
+
+    asyncio.run(run())
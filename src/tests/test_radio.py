@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from cogs.modules.Radio import RadioCore
+from scripts.database import RadioDB
+from scripts.memory import MemoryStorage
+from scripts.pomice import AtlasPrefetcher
+from scripts.queue import AtlasQueue
+from scripts.storage import AtlasStorage
+
+GUILD = 1
+
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.sent = []
+
+    async def send(self, embed, delete_after=None) -> None:
+        self.sent.append(embed)
+
+
+@pytest.fixture(autouse=True)
+def storage() -> None:
+    AtlasStorage.storage = MemoryStorage()
+    RadioDB.settings.clear()
+    yield
+    AtlasStorage.storage = None
+    RadioDB.settings.clear()
+
+
+async def player(titles: list[str]) -> SimpleNamespace:
+    async def resolve(entry: dict):
+        if entry["title"].startswith("missing"):
+            raise TypeError("'NoneType' object is not subscriptable")  # what get_tracks(...)[0] raises when nothing matched
+        return entry["title"]
+
+    async def play(track) -> None:
+        player.playing.append(track)
+
+    async def destroy() -> None:
+        player.destroyed = True
+
+    player = SimpleNamespace(
+        queue=AtlasQueue(GUILD), text_channel=FakeChannel(), panel_task=None, panel_stale=False, playing=[], destroyed=False,
+        resolve=resolve, play=play, destroy=destroy
+    )
+    player.prefetcher = AtlasPrefetcher(player)
+    await player.queue.set_loop("no_repeat")
+    await player.queue.push([{"title": title, "author": "someone", "url": "", "length": 1000, "user": 7} for title in titles])
+    return player
+
+
+def test_unplayable_entries_are_dropped_and_the_next_one_plays() -> None:
+    async def run() -> None:
+        radio = await player(["missing 1", "missing 2", "playable"])
+        await RadioCore.play_song(RadioCore, radio, await radio.queue.playlist(8))
+
+        assert radio.playing == ["playable"] and not radio.destroyed
+        assert [entry["title"] for entry in await radio.queue.playlist(8)] == ["playable"]
+        assert [embed.description for embed in radio.text_channel.sent] == ["someone | missing 1", "someone | missing 2"]
+
+    asyncio.run(run())
+
+
+def test_a_queue_with_nothing_playable_disconnects() -> None:
+    async def run() -> None:
+        radio = await player(["missing"])
+        await RadioCore.play_song(RadioCore, radio, await radio.queue.playlist(8))
+
+        assert radio.playing == [] and radio.destroyed
+        assert await radio.queue.playlist(8) == []
+
+    asyncio.run(run())
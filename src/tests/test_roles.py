@@ -0,0 +1,51 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from scripts.database import RoleDB
+from scripts.memory import MemoryStorage
+from scripts.storage import AtlasStorage
+from utils.enums import Roles
+
+GUILD = 1
+
+
+@pytest.fixture(autouse=True)
+def storage() -> MemoryStorage:
+    AtlasStorage.storage = storage = MemoryStorage()
+    RoleDB.cache.clear()
+    RoleDB.levels.clear()
+    yield storage
+    AtlasStorage.storage = None
+    RoleDB.cache.clear()
+    RoleDB.levels.clear()
+
+
+def member(*roles: int) -> SimpleNamespace:
+    return SimpleNamespace(guild_permissions=SimpleNamespace(administrator=False), roles=[SimpleNamespace(id=role) for role in roles])
+
+
+def test_changing_the_role_mapping_drops_memoized_levels() -> None:
+    async def run() -> None:
+        roles = RoleDB(GUILD)
+        assert await roles.permission_level(member(10)) == 0
+
+        await roles.insert(10, "manager")
+        assert await roles.permission_level(member(10)) == Roles.MANAGER.value
+        await roles.remove("manager")
+        assert await roles.permission_level(member(10)) == 0
+
+    asyncio.run(run())
+
+
+def test_reloading_the_role_mapping_drops_memoized_levels(storage: MemoryStorage) -> None:
+    async def run() -> None:
+        roles = RoleDB(GUILD)
+        assert await roles.permission_level(member(10)) == 0
+
+        await storage.set_role(GUILD, "radio", 10)  # written elsewhere, seen once the cached mapping expires
+        RoleDB.cache.pop(GUILD)
+        assert await roles.permission_level(member(10)) == Roles.RADIO.value
+
+    asyncio.run(run())
@@ -0,0 +1,192 @@
+"""The behaviour every storage backend has to share, run against memory, sqlite and, when a mongod is reachable, mongo"""
+import asyncio
+import datetime
+from typing import Awaitable, Callable
+
+from bson import ObjectId
+
+from scripts.storage import AtlasStorage
+
+GUILD, OTHER = 1, 2
+NOW = datetime.datetime(2030, 1, 1, 12)  # whole seconds, mongo keeps milliseconds
+
+
+def run(new_storage: Callable[[], AtlasStorage], test: Callable[[AtlasStorage], Awaitable[None]]) -> None:
+    async def main() -> None:
+        storage = new_storage()
+        await storage.bootstrap()
+        try:
+            await test(storage)
+        finally:
+            await storage.disconnect()
+
+    asyncio.run(main())
+
+
+def track(title: str, position: float, length: int = 1000, user: int = 7) -> dict:
+    return {"_id": ObjectId(), "position": position, "title": title, "author": "", "url": "", "length": length, "user": user, "track": None}
+
+
+def titles(tracks: list[dict]) -> list[str]:
+    return [track["title"] for track in tracks]
+
+
+def test_modules(new_storage) -> None:
+    async def test(storage: AtlasStorage) -> None:
+        assert await storage.get_modules(GUILD) == {}
+        await storage.set_module(GUILD, "qotd", {"channel": 5})
+        await storage.set_module(GUILD, "radio", {})
+        await storage.set_module(GUILD, "qotd", {"channel": 6})
+        await storage.set_module(OTHER, "radio", {"volume": 1})
+        assert await storage.get_modules(GUILD) == {"qotd": {"channel": 6}, "radio": {}}
+
+        await storage.unset_module(GUILD, "radio")
+        await storage.unset_module(OTHER, "fun")
+        assert await storage.get_modules(GUILD) == {"qotd": {"channel": 6}}
+        assert await storage.guilds_with_module("radio") == [{"guild": OTHER, "config": {"volume": 1}}]
+        assert await storage.guilds_with_module("blame") == []
+
+    run(new_storage, test)
+
+
+def test_roles_and_settings(new_storage) -> None:
+    async def test(storage: AtlasStorage) -> None:
+        assert await storage.get_settings(GUILD) == ({}, {})
+        await storage.set_role(GUILD, "manager", 10)
+        await storage.set_role(GUILD, "radio", 11)
+        await storage.set_role(GUILD, "radio", 12)
+        await storage.unset_role(GUILD, "manager")
+        await storage.unset_role(GUILD, "qotd")
+        await storage.set_module(GUILD, "radio", {})
+        assert await storage.get_roles(GUILD) == {"radio": 12}
+        assert await storage.get_settings(GUILD) == ({"radio": {}}, {"radio": 12})
+        assert await storage.get_settings(OTHER) == ({}, {})
+
+    run(new_storage, test)
+
+
+def test_blames(new_storage) -> None:
+    async def test(storage: AtlasStorage) -> None:
+        assert await storage.count_blames(GUILD, 7) == (0, 0)
+        assert await storage.list_blames(GUILD, 7) == (0, 0, [])
+        totals = [await storage.push_blame(GUILD, 7, blamer, f"reason {blamer}" if blamer % 2 else None) for blamer in range(1, 7)]
+        await storage.push_blame(GUILD, 8, 1, "elsewhere")
+        await storage.push_blame(OTHER, 7, 1, "elsewhere")
+
+        assert totals == [1, 2, 3, 4, 5, 6]
+        assert await storage.count_blames(GUILD, 7) == (6, 3)
+        assert await storage.list_blames(GUILD, 7) == (6, 3, [{"blamer": blamer, "reason": f"reason {blamer}"} for blamer in (1, 3, 5)])
+        assert await storage.list_blames(GUILD, 7, skip=1, limit=1) == (6, 3, [{"blamer": 3, "reason": "reason 3"}])
+        assert await storage.list_blames(GUILD, 7, skip=3) == (6, 3, [])
+        assert await storage.list_blames(GUILD, 8) == (1, 1, [{"blamer": 1, "reason": "elsewhere"}])
+
+    run(new_storage, test)
+
+
+def test_questions(new_storage) -> None:
+    def question(entry: dict | None) -> tuple | None:
+        return None if entry is None else (entry["id"], entry["state"], entry["question"], entry["user"])
+
+    async def test(storage: AtlasStorage) -> None:
+        ids = [await storage.push_question(GUILD, f"question {i}", 7) for i in range(1, 5)]
+        assert ids == [1, 2, 3, 4]
+        assert await storage.push_question(OTHER, "elsewhere", 7) == 1
+
+        assert question(await storage.accept_question(GUILD, 3)) == (3, "pending", "question 3", 7)
+        await asyncio.sleep(0.01)  # accepted questions queue up in the order they were accepted
+        assert question(await storage.accept_question(GUILD, 1)) == (1, "pending", "question 1", 7)
+        assert await storage.accept_question(GUILD, 1) is None
+
+        count, pending = await storage.get_questions(GUILD, "pending")
+        assert (count, [entry["id"] for entry in pending]) == (2, [2, 4])
+        count, accepted = await storage.get_questions(GUILD, "accepted", skip=1, limit=1)
+        assert (count, [entry["id"] for entry in accepted]) == (2, [1])
+
+        assert await storage.delete_question(GUILD, "accepted", 2) is None
+        assert question(await storage.delete_question(GUILD, "pending", 2)) == (2, "pending", "question 2", 7)
+        assert question(await storage.pop_question(GUILD)) == (3, "accepted", "question 3", 7)
+        assert question(await storage.pop_question(GUILD)) == (1, "accepted", "question 1", 7)
+        assert await storage.pop_question(GUILD) is None
+        assert await storage.push_question(GUILD, "question 5", 7) == 5
+
+    run(new_storage, test)
+
+
+def test_schedules(new_storage) -> None:
+    async def test(storage: AtlasStorage) -> None:
+        assert await storage.upcoming_schedule() is None
+        await storage.push_question(OTHER, "a guild with questions but no schedule", 7)
+        await storage.set_schedule(GUILD, "0 12 * * *", "UTC", NOW)
+        await storage.set_schedule(OTHER, "0 9 * * *", "Europe/London", NOW + datetime.timedelta(hours=1))
+
+        assert await storage.upcoming_schedule() == NOW
+        assert await storage.due_schedules(NOW - datetime.timedelta(seconds=1)) == []
+        assert await storage.due_schedules(NOW) == [{"guild": GUILD, "cron": "0 12 * * *", "timezone": "UTC", "next_run": NOW}]
+
+        tomorrow = NOW + datetime.timedelta(days=1)
+        assert await storage.claim_schedule(GUILD, NOW, tomorrow)
+        assert not await storage.claim_schedule(GUILD, NOW, tomorrow)
+        assert await storage.upcoming_schedule() == NOW + datetime.timedelta(hours=1)
+
+        await storage.clear_schedule(OTHER)
+        await storage.clear_schedule(3)
+        assert await storage.upcoming_schedule() == tomorrow
+        assert await storage.due_schedules(tomorrow) == [{"guild": GUILD, "cron": "0 12 * * *", "timezone": "UTC", "next_run": tomorrow}]
+
+    run(new_storage, test)
+
+
+def test_radio_settings(new_storage) -> None:
+    async def test(storage: AtlasStorage) -> None:
+        assert await storage.get_radio(GUILD) is None
+        await storage.set_loop(GUILD, "no_repeat")
+        assert await storage.get_radio(GUILD) == {"loop": "no_repeat", "tail": 0, "stats": None}
+
+        tracks = [track("a", 1, user=7), track("b", 2, user=8), track("live", 3, length=0, user=8)]
+        await storage.add_radio_stats(GUILD, AtlasStorage.tally_stats(tracks))
+        await storage.add_radio_stats(GUILD, AtlasStorage.tally_stats(tracks[:1], -1))
+        expected = {"length": 1000, "count": 2, "streams": 1, "users": {"8": 2}}  # a user without tracks is dropped
+        assert (await storage.get_radio(GUILD))["stats"] == expected
+
+        await storage.add_radio_stats(OTHER, AtlasStorage.tally_stats(tracks[:1]))
+        assert await storage.get_radio(OTHER) == {"loop": None, "tail": 0, "stats": {"length": 1000, "count": 1, "streams": 0, "users": {"7": 1}}}
+
+        await storage.set_radio_stats(GUILD, AtlasStorage.tally_stats([]))
+        assert await storage.get_radio(GUILD) == {"loop": "no_repeat", "tail": 0, "stats": AtlasStorage.tally_stats([])}
+
+    run(new_storage, test)
+
+
+def test_tracks(new_storage) -> None:
+    async def test(storage: AtlasStorage) -> None:
+        tracks = [track(title, position) for position, title in enumerate("abcdef", start=1)]
+        await storage.set_loop(GUILD, "playlist_repeat")
+        await storage.write_tracks(GUILD, inserted=tracks)
+        await storage.write_tracks(OTHER, inserted=[track("elsewhere", 1)])
+        assert await storage.get_tracks(GUILD) == tracks
+        assert titles(await storage.get_tracks(GUILD, skip=1, limit=2)) == ["b", "c"]
+        assert (await storage.get_radio(GUILD))["tail"] == 6
+
+        await storage.write_tracks(GUILD, updated=[{**tracks[0], "position": 3.5, "track": "encoded"}], deleted=[tracks[1]["_id"]])
+        assert titles(await storage.get_tracks(GUILD)) == ["c", "a", "d", "e", "f"]
+        assert (await storage.get_tracks(GUILD, limit=2))[1]["track"] == "encoded"
+
+        assert (await storage.rotate_track(GUILD, 7))["position"] == 3
+        assert titles(await storage.get_tracks(GUILD)) == ["a", "d", "e", "f", "c"]
+        assert titles([await storage.pop_track(GUILD)]) == ["a"]
+
+        await storage.jump_tracks(GUILD, 2, 7)
+        assert [(track["title"], track["position"]) for track in await storage.get_tracks(GUILD)] == [("f", 6), ("c", 7), ("d", 8), ("e", 9)]
+        await storage.swap_tracks(GUILD, 0, 3)
+        await storage.swap_tracks(GUILD, 0, 4)
+        assert titles(await storage.get_tracks(GUILD)) == ["e", "c", "d", "f"]
+
+        await storage.shuffle_tracks(GUILD, 9)
+        shuffled = await storage.get_tracks(GUILD)
+        assert sorted(titles(shuffled)) == ["c", "d", "e", "f"] and all(0 <= track["position"] <= 9 for track in shuffled)
+
+        await storage.clear_tracks(GUILD)
+        assert await storage.get_tracks(GUILD) == [] and await storage.pop_track(GUILD) is None and await storage.rotate_track(GUILD, 1) is None
+        assert titles(await storage.get_tracks(OTHER)) == ["elsewhere"]
+
+    run(new_storage, test)
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+import pomice
+import pytest
+
+from scripts.cache import AtlasCache
+from scripts.pomice import AtlasNode
+
+
+def track(title: str) -> pomice.Track:
+    return pomice.Track(track_id=None, track_type=pomice.TrackType.SPOTIFY, info={"title": title, "author": "someone", "length": 1000})
+
+
+@pytest.fixture(autouse=True)
+def tracks(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(AtlasNode, "tracks", AtlasCache("tracks", maxsize=10))
+
+
+def get_tracks(results: dict, query: str):
+    async def _get_tracks(query: str, **kwargs):
+        return results[query]
+
+    return AtlasNode.get_tracks(SimpleNamespace(_get_tracks=_get_tracks), query)
+
+
+def test_resolving_a_cached_track_leaves_the_cache_alone() -> None:
+    async def run() -> None:
+        results = {"song": [track("song")]}
+        resolved = (await get_tracks(results, "song"))[0]
+        resolved.original, resolved.track_id = track("match"), "encoded"
+
+        cached = (await get_tracks(results, "song"))[0]
+        assert (cached.original, cached.track_id) == (None, None)
+        assert cached is not resolved and results["song"][0].track_id is None
+
+    asyncio.run(run())
+
+
+def test_cached_playlists_are_copied_down_to_their_tracks() -> None:
+    async def run() -> None:
+        playlist = pomice.Playlist(
+            playlist_info={"name": "playlist", "selectedTrack": 1}, tracks=[track("first"), track("second")],
+            playlist_type=pomice.PlaylistType.SPOTIFY
+        )
+        first = await get_tracks({"playlist": playlist}, "playlist")
+        first.tracks[1].track_id = "encoded"
+
+        second = await get_tracks({}, "playlist")
+        assert [track.track_id for track in second.tracks] == [None, None]
+        assert second.selected_track is second.tracks[1] and second.tracks[1] is not playlist.tracks[1]
+
+    asyncio.run(run())
@@ -1,2 +1,9 @@
 def clamp(num: int, min_value: int, max_value: int) -> int:
     return max(min(num, max_value), min_value)
+
+
+def format_track_time(length: int) -> str:
+    if length < 3600000:  # if less than 01:00:00 minutes
+        return f"{length//60000:02}:{(length//1000)%60:02}"
+    else:
+        return f"{length//3600000:02}:{(length//60000)%60:02}:{(length//1000)%60:02}"